@@ -11,7 +11,7 @@ https://docs.djangoproject.com/en/5.0/ref/settings/
 """
 import os
 from pathlib import Path
-from decouple import config
+from decouple import Csv, config
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -120,6 +120,8 @@ MIDDLEWARE = [
     "django.contrib.messages.middleware.MessageMiddleware",
     "allauth.account.middleware.AccountMiddleware",
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
+    "helpers.billing_instrumentation.InstrumentationMiddleware",
+    "helpers.billing_resilience.deadline_middleware",
 ]
 
 ROOT_URLCONF = "cfehome.urls"
@@ -168,6 +170,105 @@ if DATABASE_URL is not None:
 }
 
 
+# Cache
+# outside DEBUG the database cache is shared by every worker, so cached metrics
+# are computed once per TTL per cluster (needs `manage.py createcachetable`)
+DEFAULT_CACHE_BACKEND = "django.core.cache.backends.locmem.LocMemCache" if DEBUG else "django.core.cache.backends.db.DatabaseCache"
+CACHES = {
+    "default": {
+        "BACKEND": config("DJANGO_CACHE_BACKEND", default=DEFAULT_CACHE_BACKEND),
+        "LOCATION": config("DJANGO_CACHE_LOCATION", default="django_cache"),
+    }
+}
+
+
+# Stripe webhooks
+# "background" applies stored webhook events in a worker thread right after
+# they are acknowledged; "command" leaves them to `manage.py process_stripe_events`
+STRIPE_EVENTS_PROCESSING = config("STRIPE_EVENTS_PROCESSING", default="background")
+
+# Stripe catalog
+# plans and prices saved without a stripe_id are queued in CatalogOutbox;
+# "background" pushes them from a worker thread once the save commits,
+# "command" leaves them to `manage.py push_catalog`
+CATALOG_SYNC = config("CATALOG_SYNC", default="background")
+
+# Stripe customers
+# confirmed customers are queued in ProvisioningJob; "background" creates them
+# from a worker thread once the confirmation commits, "command" leaves them to
+# `manage.py process_customer_jobs`
+CUSTOMER_PROVISIONING = config("CUSTOMER_PROVISIONING", default="background")
+
+
+# Metrics
+# /metrics/ serves the in-process registry (Stripe call counts, latency
+# histograms, breaker state) to staff users or to `Authorization: Bearer <METRICS_TOKEN>`
+METRICS_TOKEN = config("METRICS_TOKEN", default="")
+
+LOGGING = {
+    "version": 1,
+    "disable_existing_loggers": False,
+    "handlers": {
+        "console": {"class": "logging.StreamHandler"},
+    },
+    "loggers": {
+        # per-request summaries of Stripe calls are logged at INFO
+        "helpers.billing": {
+            "handlers": ["console"],
+            "level": config("BILLING_LOG_LEVEL", default="INFO"),
+            "propagate": False,
+        },
+    },
+}
+
+
+# Page visit recording
+# visits are buffered in-process and written with bulk_create
+# once VISITS_BUFFER_SIZE are queued or every VISITS_FLUSH_INTERVAL seconds
+VISITS_WRITE_BEHIND = config("VISITS_WRITE_BEHIND", cast=bool, default=True)
+VISITS_BUFFER_SIZE = config("VISITS_BUFFER_SIZE", cast=int, default=100)
+VISITS_FLUSH_INTERVAL = config("VISITS_FLUSH_INTERVAL", cast=float, default=5.0)
+VISITS_BUFFER_MAX_PENDING = config("VISITS_BUFFER_MAX_PENDING", cast=int, default=10_000)
+# visit counters shown on pages are cached for VISITS_COUNTER_CACHE_TTL seconds
+# and served stale for up to VISITS_COUNTER_CACHE_STALE_TTL while one worker
+# recomputes them
+VISITS_COUNTER_CACHE_TTL = config("VISITS_COUNTER_CACHE_TTL", cast=int, default=30)
+VISITS_COUNTER_CACHE_STALE_TTL = config("VISITS_COUNTER_CACHE_STALE_TTL", cast=int, default=300)
+# VISITS_TRACKING="beacon" records visits from a client-side beacon posted to
+# visit_beacon_view (served async under ASGI) instead of while rendering pages
+VISITS_TRACKING = config("VISITS_TRACKING", default="inline")
+VISITS_BEACON_MAX_BYTES = config("VISITS_BEACON_MAX_BYTES", cast=int, default=8 * 1024)
+VISITS_BEACON_MAX_EVENTS = config("VISITS_BEACON_MAX_EVENTS", cast=int, default=20)
+# events each client IP may post to the beacon per minute
+VISITS_BEACON_RATE_LIMIT = config("VISITS_BEACON_RATE_LIMIT", cast=int, default=120)
+# client IPs come from REMOTE_ADDR unless the app sits behind this many
+# proxies, each appending to X-Forwarded-For (e.g. 1 behind Railway's edge)
+VISITS_TRUSTED_PROXY_HOPS = config("VISITS_TRUSTED_PROXY_HOPS", cast=int, default=0)
+# VISITS_STORAGE="segments" flushes visits to append-only segment files
+# instead of the database; replay_visit_segments loads closed segments
+VISITS_STORAGE = config("VISITS_STORAGE", default="db")
+VISITS_SEGMENT_DIR = config("VISITS_SEGMENT_DIR", default=str(BASE_DIR / "visit-segments"))
+VISITS_SEGMENT_MAX_BYTES = config("VISITS_SEGMENT_MAX_BYTES", cast=int, default=4 * 1024 * 1024)
+VISITS_SEGMENT_MAX_AGE = config("VISITS_SEGMENT_MAX_AGE", cast=int, default=300)
+# crawler/health-check hits are matched on User-Agent and path (on top of the
+# defaults in visits.filters) and either tallied as "bot:" counters or dropped
+VISITS_BOT_ACTION = config("VISITS_BOT_ACTION", default="tally")
+VISITS_BOT_USER_AGENTS = config("VISITS_BOT_USER_AGENTS", cast=Csv(), default="")
+VISITS_BOT_PATHS = config("VISITS_BOT_PATHS", cast=Csv(), default="")
+# compact_visits folds raw visits into minute/hour/day rollups and prunes
+# raw rows once they are rolled up and older than VISITS_RAW_RETENTION_DAYS
+VISITS_ROLLUP_GRACE_SECONDS = config("VISITS_ROLLUP_GRACE_SECONDS", cast=int, default=300)
+VISITS_RAW_RETENTION_DAYS = config("VISITS_RAW_RETENTION_DAYS", cast=int, default=7)
+# unique visitors are counted with HyperLogLog sketches per (path, day);
+# 2**precision registers, standard error ~1.04/sqrt(2**precision)
+VISITS_HLL_PRECISION = config("VISITS_HLL_PRECISION", cast=int, default=12)
+# top paths are tracked with Space-Saving summaries of VISITS_HEAVY_HITTERS_CAPACITY
+# keys per VISITS_HEAVY_HITTERS_BUCKET_MINUTES bucket, kept in memory by each
+# worker and checkpointed every VISITS_HEAVY_HITTERS_CHECKPOINT_INTERVAL seconds
+VISITS_HEAVY_HITTERS_CAPACITY = config("VISITS_HEAVY_HITTERS_CAPACITY", cast=int, default=100)
+VISITS_HEAVY_HITTERS_BUCKET_MINUTES = config("VISITS_HEAVY_HITTERS_BUCKET_MINUTES", cast=int, default=10)
+VISITS_HEAVY_HITTERS_CHECKPOINT_INTERVAL = config("VISITS_HEAVY_HITTERS_CHECKPOINT_INTERVAL", cast=float, default=30.0)
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.0/ref/settings/#auth-password-validators
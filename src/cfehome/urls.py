@@ -20,12 +20,14 @@ from auth import views as auth_views
 from checkouts import views as checkout_views
 from landing import views as landing_views
 from subscriptions import views as subscriptions_views
+from visits import views as visits_views
 from .views import (
     home_view, 
     about_view, 
     pw_protected_view,
     user_only_view,
-    staff_only_view
+    staff_only_view,
+    metrics_view
 )
 
 urlpatterns = [
@@ -49,10 +51,14 @@ urlpatterns = [
     path("hello-world.html", home_view),
     path('accounts/billing/', subscriptions_views.user_subscription_view, name='user_subscription'),
     path('accounts/billing/cancel', subscriptions_views.user_subscription_cancel_view, name='user_subscription_cancel'),
+    path('webhooks/stripe/', subscriptions_views.stripe_webhook_view, name='stripe-webhook'),
     path('accounts/', include('allauth.urls')),
     path('protected/user-only/', user_only_view),
     path('protected/staff-only/', staff_only_view),
     path('protected/', pw_protected_view),
+    path('visits/export/', visits_views.visits_export_view, name='visits-export'),
+    path('v/', visits_views.visit_beacon_view, name='visit-beacon'),
+    path('metrics/', metrics_view, name='metrics'),
     path('profiles/', include('profiles.urls')),
     path("admin/", admin.site.urls),
 ]
\ No newline at end of file
@@ -1,4 +1,5 @@
 from django.http import HttpResponse
+import hmac
 import pathlib
 from django.shortcuts import render
 from django.contrib.auth.decorators import login_required
@@ -6,7 +7,9 @@ from django.contrib.admin.views.decorators import staff_member_required
 from django.conf import settings
 LOGIN_URL = settings.LOGIN_URL
 
-from visits.models import PageVisits
+from helpers.metrics import REGISTRY
+from visits.counters import get_cached_visit_stats
+from visits.utils import track_page_visit
 
 
 this_dir = pathlib.Path(__file__).resolve().parent
@@ -18,22 +21,17 @@ def home_view(request, *args, **kwargs):
 
 
 def about_view(request,  *args, **kwargs):
-    qs = PageVisits.objects.all()
-    page_qs = PageVisits.objects.filter(path = request.path)
-    try: 
-        percent = (page_qs.count() / qs.count()) * 100
-    except:
-        percent = 0
+    stats = get_cached_visit_stats(request.path)
     my_title = "My Page"
     my_context = {
         "page_title" : my_title,
-        "page_visits_count" : page_qs.count(),
-        "percent_count" : percent,
-        "total_visit_count" : qs.count()
+        "page_visits_count" : stats["path_count"],
+        "percent_count" : stats["percent"],
+        "total_visit_count" : stats["total"],
+        "visit_beacon": track_page_visit(request),
     }
     html_template = "home.html"
     path = request.path
-    PageVisits.objects.create(path=request.path)
     return render(request, html_template, my_context)
 
 def my_old_home_page_view(request, *args, **kwargs):
@@ -79,3 +77,11 @@ def user_only_view(request, *args, **kwargs):
 def staff_only_view(request, *args, **kwargs):
     return render(request, "protected/user-only.html", {})
 
+
+def metrics_view(request, *args, **kwargs):
+    token = settings.METRICS_TOKEN
+    auth = request.headers.get("Authorization", "")
+    allowed = request.user.is_staff or (token and hmac.compare_digest(auth, f"Bearer {token}"))
+    if not allowed:
+        return HttpResponse(status=403)
+    return HttpResponse(REGISTRY.render(), content_type="text/plain; version=0.0.4")
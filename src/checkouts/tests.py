@@ -1,3 +1,43 @@
-from django.test import TestCase
+from django.contrib.auth import get_user_model
+from django.urls import reverse
 
-# Create your tests here.
+from customers.models import Customer
+from helpers.testing import FakeStripeTestCase
+from subscriptions.models import CheckoutSession, Subscription, SubscriptionPrice, UserSubscription
+
+User = get_user_model()
+
+
+class CheckoutTestCase(FakeStripeTestCase):
+
+    def test_checkout_start_and_finalize(self):
+        plan = Subscription.objects.create(name="Pro")
+        price = SubscriptionPrice.objects.create(subscription=plan, price=10)
+        user = User.objects.create_user("buyer", password="pw")
+        Customer.objects.create(user=user, stripe_id=self.server.state.create("cus", "customer")["id"])
+        self.client.force_login(user)
+
+        response = self.client.get(reverse("sub-price-checkout", kwargs={"price_id": price.id}), follow=False)
+        response = self.client.get(response.url)
+        session_id = response.url.rsplit("/", 1)[-1]
+        self.assertEqual(self.server.state.objects[session_id]["payment_status"], "paid")
+
+        response = self.client.get(reverse("stripe-checkout-end"), {"session_id": session_id})
+        self.assertRedirects(response, reverse("user_subscription"), fetch_redirect_response=False)
+        user_sub = UserSubscription.objects.get(user=user)
+        self.assertEqual(user_sub.subscription, plan)
+        self.assertEqual(user_sub.stripe_id, self.server.state.objects[session_id]["subscription"])
+        self.assertEqual(user_sub.status, "active")
+        self.assertEqual(self.server.state.requests["retrieve"], 1)
+
+        # reloading the success URL does not call Stripe again
+        response = self.client.get(reverse("stripe-checkout-end"), {"session_id": session_id})
+        self.assertRedirects(response, reverse("user_subscription"), fetch_redirect_response=False)
+        self.assertEqual(self.server.state.requests["retrieve"], 1)
+        self.assertTrue(CheckoutSession.objects.filter(stripe_id=session_id, user=user).exists())
+
+    def test_finalize_rejects_non_session_ids(self):
+        for session_id in ["", "sub_1NabcDEF23", "junk"]:
+            response = self.client.get(reverse("stripe-checkout-end"), {"session_id": session_id})
+            self.assertRedirects(response, reverse("pricing"), fetch_redirect_response=False)
+        self.assertFalse(self.server.state.requests)
@@ -8,8 +8,12 @@ from django.conf import settings
 from django.http import HttpResponseBadRequest
 from django.db import transaction
 import logging
+import stripe
 
-from subscriptions.models import SubscriptionPrice, Subscription, UserSubscription
+from subscriptions.models import SubscriptionPrice, Subscription
+from customers import provisioning as customers_provisioning
+from subscriptions import catalog as subs_catalog
+from subscriptions import utils as subs_utils
 
 User = get_user_model()
 logger = logging.getLogger(__name__)
@@ -34,12 +38,22 @@ def checkout_redirect_view(request):
     if checkout_subscription_price_id is None or obj is None:
         return redirect("pricing")
         
-    customer_stripe_id = request.user.customer.stripe_id
+    # a customer confirmed moments ago may still be queued for Stripe
+    try:
+        customer_stripe_id = customers_provisioning.provision_now(request.user.customer)
+    except stripe.error.StripeError as e:
+        logger.error(f"Error creating Stripe customer: {str(e)}")
+        messages.error(request, "We could not start your checkout. Please try again in a moment.")
+        return redirect("pricing")
+    if customer_stripe_id is None:
+        messages.error(request, "Please confirm your email address before subscribing.")
+        return redirect("pricing")
     success_url_path = reverse("stripe-checkout-end")
     pricing_url_path = reverse("pricing")
     success_url = f"{BASE_URL}{success_url_path}"
     cancel_url = f"{BASE_URL}{pricing_url_path}"
-    price_stripe_id = obj.stripe_id
+    # a price saved moments ago may still be queued for Stripe
+    price_stripe_id = obj.stripe_id or subs_catalog.sync_price_now(obj)
     
     url = helpers.billing.start_checkout_session(
         customer_stripe_id,
@@ -54,10 +68,17 @@ def checkout_redirect_view(request):
 def checkout_finalize_view(request):
     session_id = request.GET.get('session_id')
 
-    if not session_id:
+    # anything else is not a Checkout Session; don't spend a Stripe call on it
+    if not session_id or not session_id.startswith("cs_"):
         messages.error(request, "Invalid checkout session.")
         return redirect("pricing")
 
+    # the success URL was reloaded; the session is already applied
+    processed = subs_utils.get_processed_checkout(session_id)
+    if processed is not None:
+        messages.success(request, "Success! Thank you for joining.")
+        return redirect("user_subscription")
+
     try:
         checkout_data = helpers.billing.get_checkout_customer_plan(session_id)
         
@@ -77,6 +98,7 @@ def checkout_finalize_view(request):
     plan_id = checkout_data.pop('plan_id')
     customer_id = checkout_data.pop('customer_id')
     sub_stripe_id = checkout_data.pop("sub_stripe_id")
+    helpers.billing.invalidate_subscription(sub_stripe_id)
     
     # The remaining data should include the period dates
     subscription_data = {**checkout_data}
@@ -86,7 +108,9 @@ def checkout_finalize_view(request):
 
     # Get subscription object
     try:
-        sub_obj = Subscription.objects.get(subscriptionprice__stripe_id=plan_id)
+        sub_obj = subs_utils.get_subscription_for_price(plan_id)
+        if sub_obj is None:
+            raise Subscription.DoesNotExist
     except Subscription.DoesNotExist:
         logger.error(f"Subscription not found for plan_id: {plan_id}")
         messages.error(request, "Subscription plan not found. Please contact support.")
@@ -108,57 +132,19 @@ def checkout_finalize_view(request):
         messages.error(request, "Database error. Please contact support.")
         return redirect("pricing")
 
-    # Prepare subscription update data
-    updated_sub_options = {
-        "subscription": sub_obj,
-        "stripe_id": sub_stripe_id,
-        "user_cancelled": False,
-        **subscription_data,  # This should include current_period_start and current_period_end
-    }
-    
-    # DEBUG: Log the final update options
-    logger.info(f"Updated subscription options: {updated_sub_options}")
-
     # Handle user subscription creation/update
     try:
-        _user_sub_obj, created = UserSubscription.objects.get_or_create(
-            user=user_obj,
-            defaults=updated_sub_options
+        _user_sub_obj, created = subs_utils.activate_user_subscription(
+            user_obj,
+            sub_obj,
+            sub_stripe_id,
+            subscription_data  # This should include current_period_start and current_period_end
         )
-        
-        if not created:
-            # User subscription exists, handle the update
-            old_stripe_id = _user_sub_obj.stripe_id
-            same_stripe_id = sub_stripe_id == old_stripe_id
-            
-            # Cancel old subscription if different
-            if old_stripe_id is not None and not same_stripe_id:
-                try:
-                    helpers.billing.cancel_subscription(
-                        old_stripe_id, 
-                        reason="Auto ended, new membership", 
-                        feedback="other"
-                    )
-                    logger.info(f"Cancelled old subscription: {old_stripe_id}")
-                except Exception as e:
-                    logger.warning(f"Failed to cancel old subscription {old_stripe_id}: {str(e)}")
-                    # Don't fail the entire process if old subscription cancellation fails
-            
-            # Update the subscription with new data
-            for k, v in updated_sub_options.items():
-                setattr(_user_sub_obj, k, v)
-            _user_sub_obj.save()
-            
-            # DEBUG: Log the saved subscription
-            logger.info(f"Updated UserSubscription - ID: {_user_sub_obj.id}, "
-                       f"Period Start: {_user_sub_obj.current_period_start}, "
-                       f"Period End: {_user_sub_obj.current_period_end}")
-        else:
-            # DEBUG: Log the created subscription
-            logger.info(f"Created UserSubscription - ID: {_user_sub_obj.id}, "
-                       f"Period Start: {_user_sub_obj.current_period_start}, "
-                       f"Period End: {_user_sub_obj.current_period_end}")
-            
+        subs_utils.record_checkout(session_id, _user_sub_obj)
+        action = "Created" if created else "Updated"
+        logger.info(f"{action} UserSubscription - ID: {_user_sub_obj.id}, "
+                   f"Period Start: {_user_sub_obj.current_period_start}, "
+                   f"Period End: {_user_sub_obj.current_period_end}")
     except Exception as e:
         logger.error(f"Error handling user subscription: {str(e)}")
         messages.error(request, "Error processing subscription. Please contact support.")
@@ -0,0 +1,140 @@
+import contextlib
+import io
+import statistics
+import time
+from typing import Any
+
+import stripe
+from django.contrib.auth import get_user_model
+from django.contrib.messages.storage.cookie import CookieStorage
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.test import RequestFactory
+from django.urls import reverse
+from django.utils import timezone
+
+from checkouts.views import checkout_finalize_view, checkout_redirect_view
+from customers.models import Customer
+from helpers import billing_resilience
+from helpers.fake_stripe import FakeStripeServer
+from subscriptions import catalog as subs_catalog
+from subscriptions import utils as subs_utils
+from subscriptions.models import Subscription, SubscriptionPrice, SubscriptionStatus, UserSubscription
+
+User = get_user_model()
+BENCH_PREFIX = "bench-billing-"
+
+
+def _summary(name, timings, errors=0):
+    ms = sorted(t * 1000 for t in timings) or [0.0]
+    p99 = statistics.quantiles(ms, n=100)[98] if len(ms) > 1 else ms[0]
+    return (
+        f"{name:>22}: {len(timings) / (sum(timings) or 1):8.1f} ops/s, "
+        f"p50 {statistics.median(ms):7.2f} ms, p99 {p99:7.2f} ms, errors {errors}"
+    )
+
+
+class Command(BaseCommand):
+    help = "Throughput and p50/p99 of checkout and subscription refresh against a local Stripe stand-in"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--iterations", default=200, type=int, help="checkouts to start and finalize")
+        parser.add_argument("--users", default=200, type=int, help="subscriptions to refresh")
+        parser.add_argument("--latency", default=0.0, type=float, help="ms the stand-in adds to every request")
+        parser.add_argument("--error-rate", default=0.0, type=float, help="fraction of requests failing with a 500")
+
+    def handle(self, *args: Any, **options: Any):
+        # python manage.py bench_billing --latency 80 --iterations 100
+        server = FakeStripeServer(
+            latency=options.get("latency") / 1000,
+            errors={500: options.get("error_rate")},
+        ).start()
+        previous = stripe.api_base, stripe.api_key
+        stripe.api_base = server.url
+        stripe.api_key = "sk_test_bench"
+        try:
+            # everything written here is rolled back at the end
+            with transaction.atomic(), contextlib.redirect_stdout(io.StringIO()):
+                results = self.run(server, options)
+                transaction.set_rollback(True)
+        finally:
+            stripe.api_base, stripe.api_key = previous
+            server.stop()
+        for line in results:
+            self.stdout.write(line)
+        self.stdout.write(f"Stand-in requests: {dict(server.state.requests)}")
+        for endpoint, counts in billing_resilience.stats().items():
+            self.stdout.write(f"{endpoint}: {counts}")
+
+    def run(self, server, options):
+        factory = RequestFactory()
+        plan = Subscription.objects.create(name=f"{BENCH_PREFIX}plan")
+        price = SubscriptionPrice.objects.create(subscription=plan, price=10)
+        subs_catalog.drain_outbox()
+        price.refresh_from_db()
+        user = User.objects.create(username=f"{BENCH_PREFIX}checkout")
+        Customer.objects.create(user=user, stripe_id=server.state.create("cus", "customer")["id"])
+
+        def timed(fn):
+            start = time.perf_counter()
+            try:
+                ok = fn()
+            except Exception:
+                ok = False
+            return time.perf_counter() - start, ok
+
+        def start_checkout():
+            request = factory.get(reverse("stripe-checkout-start"))
+            request.user = user
+            request.session = {"checkout_subscription_price_id": price.id}
+            response = checkout_redirect_view(request)
+            session_ids.append(response.url.rsplit("/", 1)[-1])
+            return True
+
+        def finalize_checkout():
+            request = factory.get(reverse("stripe-checkout-end"), {"session_id": session_ids.pop(0)})
+            request.user = user
+            request._messages = CookieStorage(request)
+            response = checkout_finalize_view(request)
+            return response.url != reverse("pricing")
+
+        results = []
+        session_ids = []
+        for name, fn in [("checkout_redirect_view", start_checkout), ("checkout_finalize_view", finalize_checkout)]:
+            timings = []
+            errors = 0
+            for _ in range(options.get("iterations")):
+                if fn is finalize_checkout and not session_ids:
+                    break
+                elapsed, ok = timed(fn)
+                timings.append(elapsed)
+                errors += not ok
+            results.append(_summary(name, timings, errors))
+
+        price_obj = server.state.objects[price.stripe_id]
+        users = User.objects.bulk_create([
+            User(username=f"{BENCH_PREFIX}{i}") for i in range(options.get("users"))
+        ])
+        customers = Customer.objects.bulk_create([
+            Customer(user=u, stripe_id=server.state.create("cus", "customer")["id"]) for u in users
+        ])
+        now = timezone.now()
+        UserSubscription.objects.bulk_create([
+            UserSubscription(
+                user=c.user,
+                subscription=plan,
+                stripe_id=server.state.create_subscription(c.stripe_id, price_obj)["id"],
+                status=SubscriptionStatus.ACTIVE,
+                current_period_start=now,
+                current_period_end=now,
+            ) for c in customers
+        ])
+        user_ids = [u.id for u in users]
+
+        start = time.perf_counter()
+        subs_utils.refresh_active_users_subscriptions(user_ids=user_ids)
+        batch_elapsed = time.perf_counter() - start
+        per_user = [timed(lambda: subs_utils.refresh_active_users_subscriptions(user_ids=[uid])) for uid in user_ids]
+        results.append(f"{'refresh (batch)':>22}: {len(user_ids) / batch_elapsed:8.1f} ops/s")
+        results.append(_summary("refresh (per user)", [t for t, _ in per_user], sum(not ok for _, ok in per_user)))
+        return results
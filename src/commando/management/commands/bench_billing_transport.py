@@ -0,0 +1,62 @@
+import statistics
+import time
+from typing import Any
+
+import stripe
+from django.core.management.base import BaseCommand
+
+import helpers.billing
+from helpers import billing_transport
+from helpers.fake_stripe import FakeStripeServer
+
+
+def _summary(timings):
+    ms = sorted(t * 1000 for t in timings)
+    p99 = statistics.quantiles(ms, n=100)[98] if len(ms) > 1 else ms[0]
+    return f"p50 {statistics.median(ms):.3f} ms, p99 {p99:.3f} ms"
+
+
+class Command(BaseCommand):
+    help = "Compare Stripe call latency on cold (new connection) vs warm (pooled keep-alive) clients"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--calls", default=500, type=int)
+        parser.add_argument("--api-base", default=None,
+                            help="Stripe-compatible server to call (default: start a local stand-in)")
+        parser.add_argument("--connect-delay", default=0.0, type=float,
+                            help="ms the local stand-in spends on each new connection, e.g. 30 for TLS to a remote API")
+
+    def handle(self, *args: Any, **options: Any):
+        # python manage.py bench_billing_transport --calls 1000
+        n = options.get("calls")
+        previous = stripe.api_base, stripe.api_key, stripe.default_http_client
+        server = None
+        if options.get("api_base"):
+            stripe.api_base = options.get("api_base")
+        else:
+            server = FakeStripeServer(connect_delay=options.get("connect_delay") / 1000).start()
+            stripe.api_base = server.url
+            stripe.api_key = "sk_test_bench"
+        try:
+            customer_id = helpers.billing.create_customer(email="bench@example.com")
+
+            def call():
+                start = time.perf_counter()
+                stripe.Customer.retrieve(customer_id)
+                return time.perf_counter() - start
+
+            cold = []
+            for _ in range(n):
+                stripe.default_http_client = billing_transport.new_http_client()
+                cold.append(call())
+                stripe.default_http_client.close()
+            stripe.default_http_client = billing_transport.new_http_client()
+            call()
+            warm = [call() for _ in range(n)]
+        finally:
+            stripe.api_base, stripe.api_key, stripe.default_http_client = previous
+            if server is not None:
+                server.stop()
+
+        self.stdout.write(f"cold (new connection per call): {_summary(cold)}")
+        self.stdout.write(f"warm (pooled keep-alive):       {_summary(warm)}")
@@ -0,0 +1,32 @@
+from typing import Any
+
+from django.core.management.base import BaseCommand
+
+from helpers.fake_stripe import FakeStripeServer
+
+
+class Command(BaseCommand):
+    help = "Run a local stand-in for the Stripe API (point STRIPE_API_BASE at it)"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--host", default="127.0.0.1")
+        parser.add_argument("--port", default=12111, type=int)
+        parser.add_argument("--latency", default=0.0, type=float, help="ms added to every request")
+        parser.add_argument("--error-rate", default=0.0, type=float, help="fraction of requests failing with a 500")
+        parser.add_argument("--rate-limit-rate", default=0.0, type=float, help="fraction of requests failing with a 429")
+
+    def handle(self, *args: Any, **options: Any):
+        # python manage.py fake_stripe --latency 80 --error-rate 0.01
+        server = FakeStripeServer(
+            host=options.get("host"),
+            port=options.get("port"),
+            latency=options.get("latency") / 1000,
+            errors={500: options.get("error_rate"), 429: options.get("rate_limit_rate")},
+        )
+        self.stdout.write(f"Fake Stripe API listening on {server.url} (STRIPE_API_BASE={server.url})")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.httpd.server_close()
@@ -1,5 +1,19 @@
+import importlib.util
+import time
+import unittest
+from unittest import mock
+
+import stripe
+from asgiref.sync import async_to_sync
 from django.conf import settings
-from django.test import TestCase
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+import helpers.billing
+from helpers import billing_instrumentation, billing_resilience, billing_transport
+from helpers.metrics import REGISTRY, Histogram
+from helpers.testing import FakeStripeTestCase
 
 # Create your tests here.
 class NeonDBTestCase(TestCase):
@@ -7,3 +21,155 @@ class NeonDBTestCase(TestCase):
     def test_db_url(self):
         DATABASE_URL = settings.DATABASE_URL
         self.assertIn("neon.tech", DATABASE_URL)
+
+
+class BillingTransportTestCase(FakeStripeTestCase):
+
+    def test_billing_calls_share_the_pooled_client(self):
+        client = billing_transport.install(pool_size=2)
+        self.assertIsInstance(client, billing_transport.PooledRequestsClient)
+        stripe_id = helpers.billing.create_customer(email="a@example.com", metadata={"user_id": 1})
+        self.assertEqual(self.server.state.objects[stripe_id]["metadata"], {"user_id": "1"})
+        self.assertIs(stripe.default_http_client, client)
+
+    def test_per_call_timeout(self):
+        client = billing_transport.new_http_client(timeout=30)
+        with billing_transport.timeout(2):
+            self.assertEqual(client._timeout, (2, 2))
+        self.assertEqual(client._timeout, (billing_transport.STRIPE_HTTP_CONNECT_TIMEOUT, 30))
+
+    @unittest.skipUnless(importlib.util.find_spec("httpx"), "needs httpx")
+    def test_async_calls_from_successive_event_loops(self):
+        client = billing_transport.install(pool_size=2)
+        # async_to_sync runs each call on a new loop, closing the last one
+        for _ in range(2):
+            customer = async_to_sync(stripe.Customer.create_async)(email="a@example.com")
+            self.assertIn(customer.id, self.server.state.objects)
+        # each loop's client was closed with it instead of piling up
+        self.assertFalse(client._async_fallback_client.__dict__["_loop_clients"])
+
+
+@mock.patch.object(billing_resilience, "STRIPE_RETRY_BASE_DELAY", 0.001)
+class BillingResilienceTestCase(FakeStripeTestCase):
+
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        self.customer_id = helpers.billing.create_customer(email="a@example.com")
+
+    def test_endpoint_names_mask_every_id_segment(self):
+        cases = {
+            "/v1/subscriptions/sub_1NabcDEF23": "GET /v1/subscriptions/:id",
+            "/v1/payment_intents/pi_3MtwBwLkdIwHu7ix": "GET /v1/payment_intents/:id",
+            "/v1/billing_portal/sessions": "GET /v1/billing_portal/sessions",
+            "/v1/checkout/sessions/cs_test_a1b2c3d4e5": "GET /v1/checkout/sessions/:id",
+            "/v1/customers/cus_fake00000001/balance_transactions": "GET /v1/customers/:id/balance_transactions",
+            "/v1/checkout/sessions/x": "GET /v1/checkout/sessions/:id",
+            "/v1/checkout/sessions/junk-../line_items": "GET /v1/checkout/sessions/:id/line_items",
+            "/v1/customers/cus_1/sources/card_2": "GET /v1/customers/:id/sources/:id",
+            "/v1/subscriptions/search": "GET /v1/subscriptions/search",
+        }
+        for path, name in cases.items():
+            self.assertEqual(billing_resilience.endpoint_name("get", f"https://api.stripe.com{path}"), name)
+
+    @mock.patch.object(stripe, "max_network_retries", 2)
+    def test_only_reads_are_retried(self):
+        self.server.httpd.errors = {500: 1.0}
+        with self.assertRaises(stripe.APIError):
+            helpers.billing.get_subscription("sub_missing01")
+        with self.assertRaises(stripe.APIError):
+            helpers.billing.create_customer(email="b@example.com")
+        stats = billing_resilience.stats()
+        self.assertEqual(stats["GET /v1/subscriptions/:id"]["calls"], 3)
+        self.assertEqual(stats["GET /v1/subscriptions/:id"]["retries"], 2)
+        self.assertEqual(self.server.state.requests["create_customer"], 2)
+
+    @mock.patch.object(stripe, "max_network_retries", 0)
+    @mock.patch.object(billing_resilience, "STRIPE_BREAKER_FAILURES", 3)
+    @mock.patch.object(helpers.billing, "STRIPE_SUBSCRIPTION_CACHE_TTL", 0)
+    def test_breaker_fails_fast_and_serves_cached_data(self):
+        product = self.server.state.create("prod", "product")
+        price = self.server.state.create("price", "price", product=product["id"], recurring={"interval": "month"})
+        sub_id = self.server.state.create_subscription(self.customer_id, price)["id"]
+        snapshot = helpers.billing.get_subscription_snapshot(sub_id)
+        self.server.httpd.errors = {500: 1.0}
+        with self.assertLogs("helpers.billing", "WARNING"):
+            for _ in range(3):
+                with self.assertRaises(stripe.APIError):
+                    helpers.billing.get_subscription(sub_id)
+        with self.assertRaises(billing_resilience.CircuitOpen):
+            helpers.billing.get_subscription(sub_id)
+        self.assertEqual(self.server.state.requests["retrieve"], 4)
+        with self.assertLogs("helpers.cache", "WARNING"):
+            self.assertEqual(helpers.billing.get_subscription_snapshot(sub_id), snapshot)
+        self.assertEqual(billing_resilience.stats()["GET /v1/subscriptions/:id"]["state"], "open")
+        # other endpoints keep working
+        self.server.httpd.errors = {}
+        helpers.billing.create_customer(email="b@example.com")
+
+    def test_deadline_is_shared_across_calls(self):
+        self.server.httpd.latency = 0.3
+        start = time.monotonic()
+        with billing_resilience.deadline(0.5):
+            stripe.Customer.retrieve(self.customer_id)
+            with self.assertRaises(stripe.APIConnectionError):
+                stripe.Customer.retrieve(self.customer_id)
+            with self.assertRaises(billing_resilience.DeadlineExceeded):
+                stripe.Customer.retrieve(self.customer_id)
+        self.assertLess(time.monotonic() - start, 1.0)
+
+    @unittest.skipUnless(importlib.util.find_spec("httpx"), "needs httpx")
+    @mock.patch.object(stripe, "max_network_retries", 0)
+    def test_deadline_bounds_async_calls(self):
+        self.server.httpd.latency = 2.0
+
+        async def retrieve():
+            with billing_resilience.deadline(0.5):
+                return await stripe.Customer.retrieve_async(self.customer_id)
+
+        start = time.monotonic()
+        with self.assertRaises(stripe.APIConnectionError):
+            async_to_sync(retrieve)()
+        self.assertLess(time.monotonic() - start, 1.0)
+
+
+class BillingInstrumentationTestCase(FakeStripeTestCase):
+
+    def setUp(self):
+        super().setUp()
+        REGISTRY.clear()
+        self.addCleanup(REGISTRY.clear)
+
+    def test_calls_are_counted_timed_and_attributed(self):
+        with billing_instrumentation.scope("task:test") as current:
+            helpers.billing.create_customer(email="a@example.com")
+            with self.assertRaises(stripe.InvalidRequestError):
+                helpers.billing.get_subscription("sub_missing01")
+        self.assertEqual(current.calls["POST /v1/customers"][0], 1)
+        metrics = REGISTRY.render()
+        self.assertIn('stripe_calls_total{endpoint="POST /v1/customers",scope="task:test"} 1', metrics)
+        self.assertIn(
+            'stripe_call_errors_total{endpoint="GET /v1/subscriptions/:id",error="InvalidRequestError",scope="task:test"} 1',
+            metrics
+        )
+        self.assertIn('stripe_call_duration_seconds_count{endpoint="POST /v1/customers"} 1', metrics)
+        self.assertIn('stripe_circuit_open{endpoint="POST /v1/customers"} 0', metrics)
+        self.assertIn("# TYPE stripe_call_retries_total counter", metrics)
+        self.assertIn('stripe_call_retries_total{endpoint="POST /v1/customers"} 0', metrics)
+        self.assertIn("# TYPE stripe_circuit_open gauge", metrics)
+
+    def test_histogram_buckets(self):
+        hist = Histogram()
+        for ms in range(1, 101):
+            hist.observe(ms / 1000)
+        self.assertEqual(hist.count, 100)
+        self.assertTrue(0.05 <= hist.quantile(0.5) <= 0.05 * 1.2)
+        self.assertTrue(0.099 <= hist.quantile(0.99) <= 0.099 * 1.2)
+
+    @override_settings(METRICS_TOKEN="secret")
+    def test_metrics_view_requires_staff_or_token(self):
+        helpers.billing.create_customer(email="a@example.com")
+        self.assertEqual(self.client.get(reverse("metrics")).status_code, 403)
+        response = self.client.get(reverse("metrics"), HTTP_AUTHORIZATION="Bearer secret")
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b"stripe_calls_total", response.content)
@@ -2,5 +2,13 @@ from django.contrib import admin
 
 # Register your models here.
 
-from .models import Customer
+from .models import Customer, ProvisioningJob
 admin.site.register(Customer)
+
+
+class ProvisioningJobAdmin(admin.ModelAdmin):
+    list_display = ['customer', 'attempts', 'timestamp', 'processed']
+    readonly_fields = ['error']
+
+
+admin.site.register(ProvisioningJob, ProvisioningJobAdmin)
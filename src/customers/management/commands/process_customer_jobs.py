@@ -0,0 +1,28 @@
+import time
+from typing import Any
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from customers import provisioning
+
+class Command(BaseCommand):
+
+    def add_arguments(self, parser):
+        parser.add_argument("--limit", default=5_000, type=int)
+        parser.add_argument("--batch-size", default=provisioning.BATCH_SIZE, type=int)
+        parser.add_argument("--forever", action="store_true", default=False,
+                            help="keep polling for new jobs instead of exiting once the queue is empty")
+        parser.add_argument("--interval", default=5.0, type=float,
+                            help="seconds to wait between polls of an empty queue")
+
+    def handle(self, *args: Any, **options: Any):
+        # python manage.py process_customer_jobs --forever
+        while True:
+            created = provisioning.process_jobs(limit=options.get("limit"), batch_size=options.get("batch_size"))
+            if created or not options.get("forever"):
+                self.stdout.write(f"Created {created} Stripe customers")
+            if not options.get("forever"):
+                return
+            if not created:
+                time.sleep(options.get("interval"))
+            close_old_connections()
@@ -0,0 +1,27 @@
+from typing import Any
+from django.core.management.base import BaseCommand
+
+from customers import provisioning
+
+class Command(BaseCommand):
+
+    def add_arguments(self, parser):
+        parser.add_argument("--concurrency", default=8, type=int)
+        parser.add_argument("--rps", default=None, type=float,
+                            help="max Stripe calls per second across threads (default: STRIPE_MAX_RPS)")
+        parser.add_argument("--batch-size", default=200, type=int)
+        parser.add_argument("--after", default=0, type=int,
+                            help="resume after this customer id, as printed by an earlier run")
+
+    def handle(self, *args: Any, **options: Any):
+        # python manage.py provision_customers --concurrency 8
+        stats = provisioning.backfill_customers(
+            concurrency=options.get("concurrency"),
+            rps=options.get("rps"),
+            batch_size=options.get("batch_size"),
+            after=options.get("after"),
+            verbose=True
+        )
+        self.stdout.write(f"Created {stats['created']} Stripe customers, {stats['failed']} failed")
+        if stats["failed"]:
+            self.stdout.write("Run the command again to retry the failed ones")
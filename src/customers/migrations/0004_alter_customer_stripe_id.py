@@ -0,0 +1,19 @@
+# Generated by Django 5.0.14 on 2026-10-16 23:29
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("customers", "0003_customer_init_email_customer_init_email_confirmed"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="customer",
+            name="stripe_id",
+            field=models.CharField(
+                blank=True, db_index=True, max_length=120, null=True
+            ),
+        ),
+    ]
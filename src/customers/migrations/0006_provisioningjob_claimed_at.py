@@ -0,0 +1,21 @@
+# Generated by Django 5.0.14 on 2026-10-17 00:09
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("customers", "0005_provisioningjob"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="provisioningjob",
+            name="claimed_at",
+            field=models.DateTimeField(
+                blank=True,
+                help_text="When a worker took the job to run it",
+                null=True,
+            ),
+        ),
+    ]
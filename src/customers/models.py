@@ -1,6 +1,5 @@
-from django.db import models
+from django.db import models, transaction
 from django.conf import settings
-import helpers.billing
 
 from allauth.account.signals import (
     user_signed_up as allauth_user_signed_up,
@@ -12,7 +11,7 @@ User = settings.AUTH_USER_MODEL
 
 class Customer(models.Model):
     user = models.OneToOneField(User, on_delete=models.CASCADE)
-    stripe_id = models.CharField(max_length=120, blank=True, null=True)
+    stripe_id = models.CharField(max_length=120, blank=True, null=True, db_index=True)
     init_email = models.EmailField(blank=True, null=True)
     init_email_confirmed = models.BooleanField(default=False)
 
@@ -20,18 +19,50 @@ class Customer(models.Model):
     def __str__(self):
         return f"{self.user.username}"
     
-    def save(self, *args, **kwargs):    
-        if not self.stripe_id:
-            if self.init_email_confirmed and self.init_email:
-                email = self.init_email
-                if email != "" or email is not None:
-                    stripe_id = helpers.billing.create_customer(email=email, metadata={
-                        "user_id": self.user.id,
-                        "username":self.user.username
-                    },raw=False)
-                    self.stripe_id = stripe_id
-        super().save(*args, **kwargs)
-       
+    @property
+    def needs_provisioning(self):
+        return not self.stripe_id and self.init_email_confirmed and bool(self.init_email)
+
+    def save(self, *args, **kwargs):
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            if self.needs_provisioning:
+                # created in Stripe by customers.provisioning once committed
+                ProvisioningJob.enqueue([self.id])
+
+
+class ProvisioningJob(models.Model):
+    """
+    A confirmed Customer waiting for its Stripe customer; drained by
+    customers.provisioning.
+    """
+    customer = models.ForeignKey(Customer, on_delete=models.CASCADE)
+    attempts = models.IntegerField(default=0)
+    error = models.TextField(blank=True, null=True)
+    processed = models.DateTimeField(blank=True, null=True, db_index=True)
+    claimed_at = models.DateTimeField(blank=True, null=True, help_text="When a worker took the job to run it")
+    timestamp = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ['timestamp']
+
+    def __str__(self):
+        return f"{self.customer}"
+
+    @classmethod
+    def enqueue(cls, customer_ids):
+        if not customer_ids:
+            return
+        pending = set(cls.objects.filter(
+            customer_id__in=customer_ids,
+            processed__isnull=True
+        ).values_list("customer_id", flat=True))
+        cls.objects.bulk_create([cls(customer_id=i) for i in customer_ids if i not in pending])
+        if settings.CUSTOMER_PROVISIONING == "background":
+            from customers import provisioning
+            transaction.on_commit(provisioning.wake_worker)
+
+
 def allauth_user_signed_up_handler(request, user, **kwargs):
     email = user.email
     Customer.objects.create(
@@ -46,8 +77,10 @@ def allauth_email_confirmed_handler(request, email_address, **kwargs):
         init_email=email_address,
         init_email_confirmed=False
     )
-    for obj in qs:
-        obj.init_email_confirmed = True
-        obj.save()
+    with transaction.atomic():
+        ids = list(qs.filter(stripe_id__isnull=True).values_list("id", flat=True))
+        qs.update(init_email_confirmed=True)
+        # Stripe is called by the job queue, not during the confirmation request
+        ProvisioningJob.enqueue(ids)
         
 allauth_email_confirmed.connect(allauth_email_confirmed_handler)
\ No newline at end of file
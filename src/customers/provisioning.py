@@ -0,0 +1,182 @@
+import hashlib
+import json
+import logging
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+import helpers.billing
+from customers.models import Customer, ProvisioningJob
+from helpers import billing_instrumentation, job_queue
+from helpers.background import BackgroundWorker
+from helpers.rate_limit import TokenBucket
+
+logger = logging.getLogger(__name__)
+
+MAX_ATTEMPTS = 10
+BATCH_SIZE = 50
+
+
+def idempotency_key(customer, params):
+    """
+    One Stripe customer per user, however often creating it is retried.
+    The payload hash and the user's signup time keep a changed email or a
+    user recreated under the same id (e.g. after a database reset) from
+    reusing a key with different parameters, which Stripe rejects.
+    """
+    payload = json.dumps({"joined": customer.user.date_joined.isoformat(), **params}, sort_keys=True, default=str)
+    digest = hashlib.sha256(payload.encode()).hexdigest()[:16]
+    return f"{helpers.billing.STRIPE_IDEMPOTENCY_PREFIX}customer-user-{customer.user_id}-{digest}"
+
+
+def create_stripe_customer(customer, limiter=None):
+    params = {
+        "email": customer.init_email or customer.user.email,
+        "metadata": {
+            "user_id": customer.user_id,
+            "username": customer.user.username
+        },
+    }
+    return helpers.billing.call_rate_limited(
+        lambda: helpers.billing.create_customer(
+            **params,
+            idempotency_key=idempotency_key(customer, params),
+            raw=False
+        ),
+        limiter=limiter
+    )
+
+
+def provision_now(customer):
+    """
+    Create `customer` in Stripe right away, for a checkout that cannot wait
+    for the queue; uses the queue's idempotency key, so a job running at
+    the same time ends up with the same Stripe customer. Returns its
+    stripe_id, or None while the customer's email is unconfirmed.
+    """
+    if customer.stripe_id:
+        return customer.stripe_id
+    if not customer.needs_provisioning:
+        return None
+    customer.stripe_id = create_stripe_customer(customer)
+    with transaction.atomic():
+        Customer.objects.filter(id=customer.id).update(stripe_id=customer.stripe_id)
+        ProvisioningJob.objects.filter(
+            customer=customer,
+            processed__isnull=True
+        ).update(processed=timezone.now())
+    return customer.stripe_id
+
+
+def _run_batch(jobs, limiter):
+    customers = Customer.objects.select_related("user").in_bulk([job.customer_id for job in jobs])
+    now = timezone.now()
+    created = []
+    for job in jobs:
+        customer = customers.get(job.customer_id)
+        try:
+            # provisioned since it was queued
+            if customer is not None and customer.needs_provisioning:
+                customer.stripe_id = create_stripe_customer(customer, limiter=limiter)
+                created.append(customer)
+        except Exception:
+            logger.warning("Failed to create Stripe customer for %s", job, exc_info=True)
+            job.error = traceback.format_exc()
+        else:
+            job.error = None
+            job.processed = now
+    with transaction.atomic():
+        Customer.objects.bulk_update(created, ["stripe_id"])
+        job_queue.release(jobs)
+    return len(created)
+
+
+def process_jobs(limit=5_000, batch_size=BATCH_SIZE, rps=None):
+    """
+    Create the Stripe customers of pending jobs, oldest first, claiming
+    them through helpers.job_queue like the catalog outbox. Failures
+    stay queued, up to MAX_ATTEMPTS; the idempotency key makes a retry
+    return the customer an interrupted attempt created.
+    """
+    limiter = TokenBucket(rps or helpers.billing.STRIPE_MAX_RPS)
+    return job_queue.drain(
+        ProvisioningJob.objects.filter(processed__isnull=True, attempts__lt=MAX_ATTEMPTS),
+        lambda jobs: _run_batch(jobs, limiter),
+        limit=limit,
+        batch_size=batch_size
+    )
+
+
+def unprovisioned_customers():
+    """
+    Confirmed customers without a Stripe customer; Customer.needs_provisioning
+    as a queryset.
+    """
+    return Customer.objects.filter(
+        Q(stripe_id__isnull=True) | Q(stripe_id=""),
+        init_email_confirmed=True,
+        init_email__isnull=False
+    ).exclude(init_email="")
+
+
+def backfill_customers(concurrency=8, rps=None, batch_size=200, after=0, verbose=False):
+    """
+    Create the Stripe customers of every unprovisioned customer with an id
+    above `after`, `batch_size` rows at a time in id order (keyset
+    pagination) from `concurrency` threads sharing a token bucket of `rps`
+    calls per second. Each batch is written back with bulk_update before
+    the next is read, so an interrupted run resumes where it stopped;
+    the idempotency key covers the calls that were in flight.
+    """
+    limiter = TokenBucket(rps or helpers.billing.STRIPE_MAX_RPS)
+    stats = {"created": 0, "failed": 0, "last_id": after}
+
+    def create(customer):
+        try:
+            return create_stripe_customer(customer, limiter=limiter)
+        except Exception:
+            logger.warning("Failed to create Stripe customer for %s", customer, exc_info=True)
+            return None
+
+    qs = unprovisioned_customers().select_related("user").order_by("id")
+    with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="provision") as executor:
+        while True:
+            customers = list(qs.filter(id__gt=stats["last_id"])[:batch_size])
+            if not customers:
+                break
+            created = []
+            for customer, stripe_id in zip(customers, executor.map(create, customers)):
+                if stripe_id is None:
+                    stats["failed"] += 1
+                    continue
+                customer.stripe_id = stripe_id
+                created.append(customer)
+            with transaction.atomic():
+                Customer.objects.bulk_update(created, ["stripe_id"])
+                ProvisioningJob.objects.filter(
+                    customer__in=created,
+                    processed__isnull=True
+                ).update(processed=timezone.now())
+            stats["created"] += len(created)
+            stats["last_id"] = customers[-1].id
+            if verbose:
+                print(f"Created {stats['created']} Stripe customers, {stats['failed']} failed, up to id {stats['last_id']}")
+    return stats
+
+
+def _process_in_background():
+    with billing_instrumentation.scope("task:customer-provisioning"):
+        process_jobs()
+
+
+_worker = BackgroundWorker("customer-provisioning", _process_in_background)
+
+
+def wake_worker():
+    """
+    Have this process's background thread run pending jobs.
+    """
+    _worker.wake()
@@ -1,3 +1,101 @@
-from django.test import TestCase
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth import get_user_model
+from django.test import override_settings
+from django.urls import reverse
+
+import helpers.billing
+from customers import provisioning
+from customers.models import Customer, ProvisioningJob, allauth_email_confirmed_handler
+from helpers.testing import FakeStripeTestCase
+from subscriptions.models import Subscription, SubscriptionPrice
+
+User = get_user_model()
+
+
+@override_settings(CUSTOMER_PROVISIONING="command")
+class ProvisioningJobTestCase(FakeStripeTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user("signup", email="signup@example.com", password="pw")
+        self.customer = Customer.objects.create(user=self.user, init_email=self.user.email)
+
+    def test_confirmation_queues_without_calling_stripe(self):
+        allauth_email_confirmed_handler(None, self.user.email)
+        self.assertEqual(sum(self.server.state.requests.values()), 0)
+        job = ProvisioningJob.objects.get()
+        self.assertEqual(job.customer, self.customer)
+
+        self.assertEqual(provisioning.process_jobs(), 1)
+        self.customer.refresh_from_db()
+        self.assertEqual(self.server.state.objects[self.customer.stripe_id]["email"], "signup@example.com")
+        job.refresh_from_db()
+        self.assertIsNotNone(job.processed)
+        self.assertEqual(provisioning.process_jobs(), 0)
+
+    def test_retry_reuses_the_stripe_customer(self):
+        allauth_email_confirmed_handler(None, self.user.email)
+        # a create that was in flight when an earlier run was interrupted
+        first = provisioning.create_stripe_customer(self.customer)
+        self.assertEqual(provisioning.process_jobs(), 1)
+        self.customer.refresh_from_db()
+        self.assertEqual(self.customer.stripe_id, first)
+        self.assertEqual(len(self.server.state.of_type("customer")), 1)
+
+    def test_checkout_provisions_a_queued_customer(self):
+        allauth_email_confirmed_handler(None, self.user.email)
+        price = self.server.state.create("price", "price", product=self.server.state.create("prod", "product")["id"],
+                                         recurring={"interval": "month"})
+        plan = Subscription.objects.create(name="Pro", stripe_id=price["product"])
+        price_obj = SubscriptionPrice.objects.create(subscription=plan, stripe_id=price["id"], price=10)
+        self.client.force_login(self.user)
+        response = self.client.get(reverse("sub-price-checkout", kwargs={"price_id": price_obj.id}))
+        response = self.client.get(response.url)
+        session = self.server.state.objects[response.url.rsplit("/", 1)[-1]]
+        self.customer.refresh_from_db()
+        self.assertEqual(session["customer"], self.customer.stripe_id)
+        self.assertIsNotNone(ProvisioningJob.objects.get().processed)
+        self.assertEqual(provisioning.process_jobs(), 0)
+        self.assertEqual(len(self.server.state.of_type("customer")), 1)
+
+    def test_checkout_start_without_a_stripe_customer(self):
+        plan = Subscription.objects.create(name="Pro", stripe_id="prod_x")
+        price_obj = SubscriptionPrice.objects.create(subscription=plan, stripe_id="price_x", price=10)
+        self.client.force_login(self.user)
+        start = self.client.get(reverse("sub-price-checkout", kwargs={"price_id": price_obj.id})).url
+        # unconfirmed email: nothing is created in Stripe
+        self.assertRedirects(self.client.get(start), reverse("pricing"), fetch_redirect_response=False)
+        self.assertEqual(sum(self.server.state.requests.values()), 0)
+
+        allauth_email_confirmed_handler(None, self.user.email)
+        self.server.httpd.errors = {400: 1.0}
+        self.assertRedirects(self.client.get(start), reverse("pricing"), fetch_redirect_response=False)
+
+    def test_idempotency_key_is_prefixed_and_tracks_the_payload(self):
+        params = {"email": "signup@example.com"}
+        key = provisioning.idempotency_key(self.customer, params)
+        self.assertNotEqual(provisioning.idempotency_key(self.customer, {"email": "new@example.com"}), key)
+        with mock.patch.object(helpers.billing, "STRIPE_IDEMPOTENCY_PREFIX", "staging-"):
+            self.assertEqual(provisioning.idempotency_key(self.customer, params), f"staging-{key}")
+
+
+class ProvisionCustomersTestCase(FakeStripeTestCase):
+
+    def test_backfill_in_batches_and_resume(self):
+        users = User.objects.bulk_create([User(username=f"backfill-{i}", email=f"b{i}@example.com") for i in range(30)])
+        customers = Customer.objects.bulk_create([
+            Customer(user=u, init_email=u.email, init_email_confirmed=True) for u in users
+        ])
+        Customer.objects.create(user=User.objects.create(username="unconfirmed"), init_email="u@example.com")
+        # a create that was in flight when an earlier run was interrupted
+        interrupted = provisioning.create_stripe_customer(customers[0])
+
+        stats = provisioning.backfill_customers(concurrency=4, rps=500, batch_size=7)
+        self.assertEqual((stats["created"], stats["failed"]), (30, 0))
+        self.assertEqual(stats["last_id"], customers[-1].id)
+        self.assertFalse(provisioning.unprovisioned_customers().exists())
+        customers[0].refresh_from_db()
+        self.assertEqual(customers[0].stripe_id, interrupted)
+        self.assertEqual(len(self.server.state.of_type("customer")), 30)
+        self.assertEqual(provisioning.backfill_customers()["created"], 0)
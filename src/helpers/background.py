@@ -0,0 +1,41 @@
+import logging
+import os
+import threading
+
+from django.db import close_old_connections
+
+logger = logging.getLogger(__name__)
+
+
+class BackgroundWorker:
+    """
+    A daemon thread that runs `fn()` whenever it is woken; wakes that
+    arrive during a run coalesce into one more run. The thread is started
+    on the first wake in each process, so forked workers get their own.
+    """
+
+    def __init__(self, name, fn):
+        self.name = name
+        self.fn = fn
+        self.pid = None
+        self.event = threading.Event()
+        self.lock = threading.Lock()
+
+    def _run(self):
+        while True:
+            self.event.wait()
+            self.event.clear()
+            close_old_connections()
+            try:
+                self.fn()
+            except Exception:
+                logger.exception("Background worker %s failed", self.name)
+
+    def wake(self):
+        pid = os.getpid()
+        if self.pid != pid:
+            with self.lock:
+                if self.pid != pid:
+                    threading.Thread(target=self._run, name=self.name, daemon=True).start()
+                    self.pid = pid
+        self.event.set()
@@ -1,16 +1,35 @@
+import time
+
 import stripe
 from decouple import config
 
-from . import date_utils
+from . import billing_resilience, billing_transport, cache, date_utils
 
 DJANGO_DEBUG = config("DJANGO_DEBUG", default=False, cast=bool)
 STRIPE_SECRET_KEY = config("STRIPE_SECRET_KEY", default="", cast=str)
 STRIPE_TEST_OVERRIDE = config("STRIPE_TEST_OVERRIDE", default=False, cast=bool)
+# e.g. http://127.0.0.1:12111 for `manage.py fake_stripe` in local development
+STRIPE_API_BASE = config("STRIPE_API_BASE", default="", cast=str)
+STRIPE_WEBHOOK_SECRET = config("STRIPE_WEBHOOK_SECRET", default="", cast=str)
+# serialized subscriptions are cached for STRIPE_SUBSCRIPTION_CACHE_TTL seconds and
+# kept for STRIPE_SUBSCRIPTION_CACHE_STALE_TTL more to serve while Stripe is failing
+STRIPE_SUBSCRIPTION_CACHE_TTL = config("STRIPE_SUBSCRIPTION_CACHE_TTL", default=300, cast=int)
+STRIPE_SUBSCRIPTION_CACHE_STALE_TTL = config("STRIPE_SUBSCRIPTION_CACHE_STALE_TTL", default=86400, cast=int)
+STRIPE_SUBSCRIPTION_CACHE_TIMEOUT = config("STRIPE_SUBSCRIPTION_CACHE_TIMEOUT", default=10.0, cast=float)
+# Stripe allows 25 read requests per second in test mode and 100 in live mode
+STRIPE_MAX_RPS = config("STRIPE_MAX_RPS", default=25.0, cast=float)
+STRIPE_RATE_LIMIT_RETRIES = config("STRIPE_RATE_LIMIT_RETRIES", default=5, cast=int)
+# prepended to idempotency keys we derive from row ids, so deployments (or databases)
+# sharing a Stripe account within its 24 hour key window never replay each other's objects
+STRIPE_IDEMPOTENCY_PREFIX = config("STRIPE_IDEMPOTENCY_PREFIX", default="", cast=str)
 
 if "sk_test" in STRIPE_SECRET_KEY and not DJANGO_DEBUG and not STRIPE_TEST_OVERRIDE:
     raise ValueError("Invalid stripe key for prod")
 
 stripe.api_key = STRIPE_SECRET_KEY
+if STRIPE_API_BASE:
+    stripe.api_base = STRIPE_API_BASE
+billing_transport.install()
 
 def serialize_subscription_data(subscription_response):
     """
@@ -64,11 +83,13 @@ def create_customer(
     name="",
     email="",
     metadata={},
+    idempotency_key=None,
     raw=False):
     response = stripe.Customer.create(
         name=name,
         email=email,
         metadata=metadata,
+        idempotency_key=idempotency_key,
     )
     if raw:
         return response
@@ -77,10 +98,12 @@ def create_customer(
 
 def create_product(name="",
     metadata={},
+    idempotency_key=None,
     raw=False):
     response = stripe.Product.create(
         name=name,
         metadata=metadata,
+        idempotency_key=idempotency_key,
     )
     if raw:
         return response
@@ -92,6 +115,7 @@ def create_price(currency="usd",
     interval="month",
     product=None,
     metadata={},
+    idempotency_key=None,
     raw=False):
     if product is None:
         return None
@@ -100,7 +124,8 @@ def create_price(currency="usd",
         unit_amount=unit_amount,
         recurring={"interval": interval},
         product=product,
-        metadata=metadata
+        metadata=metadata,
+        idempotency_key=idempotency_key,
     )
     if raw:
         return response
@@ -125,9 +150,10 @@ def start_checkout_session(customer_id,
         return response
     return response.url
 
-def get_checkout_session(stripe_id, raw=True):
+def get_checkout_session(stripe_id, raw=True, expand=None):
     response = stripe.checkout.Session.retrieve(
-        stripe_id
+        stripe_id,
+        expand=expand or []
     )
     if raw:
         return response
@@ -141,6 +167,71 @@ def get_subscription(stripe_id, raw=True):
         return response
     return serialize_subscription_data(response)
 
+def _subscription_cache_key(stripe_id):
+    return f"billing:subscription:{stripe_id}"
+
+def get_subscription_snapshot(stripe_id, allow_stale=True):
+    """
+    Serialized subscription, read through the shared cache. Concurrent
+    misses for the same id make one Stripe call, and a stale snapshot is
+    returned if Stripe errors or times out. Pass allow_stale=False for data
+    written back to UserSubscription: it gets a snapshot younger than
+    STRIPE_SUBSCRIPTION_CACHE_TTL or Stripe's answer, and errors raise.
+    """
+    def fetch():
+        with billing_transport.timeout(STRIPE_SUBSCRIPTION_CACHE_TIMEOUT):
+            return get_subscription(stripe_id, raw=False)
+    return cache.cached_value(
+        _subscription_cache_key(stripe_id),
+        fetch,
+        ttl=STRIPE_SUBSCRIPTION_CACHE_TTL,
+        stale_ttl=STRIPE_SUBSCRIPTION_CACHE_STALE_TTL,
+        lock_timeout=STRIPE_SUBSCRIPTION_CACHE_TIMEOUT * 3,
+        wait=STRIPE_SUBSCRIPTION_CACHE_TIMEOUT,
+        stale_if_error=True,
+        allow_stale=allow_stale,
+    )
+
+def invalidate_subscription(stripe_id):
+    """
+    Call after anything changes a subscription in Stripe.
+    """
+    cache.invalidate(_subscription_cache_key(stripe_id))
+
+def retry_after(error, attempt):
+    """
+    Seconds to wait before retrying a 429: its Retry-After, else a backoff.
+    """
+    headers = error.headers or {}
+    value = headers.get("Retry-After") or headers.get("retry-after")
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return min(0.5 * 2 ** attempt, 8.0)
+
+def call_rate_limited(fn, limiter=None, retries=None):
+    """
+    Call fn() once `limiter` (a helpers.rate_limit.TokenBucket) allows it,
+    retrying 429 responses after their Retry-After. The wait is applied to
+    the limiter, so every worker sharing it backs off together.
+    """
+    retries = STRIPE_RATE_LIMIT_RETRIES if retries is None else retries
+    attempt = 0
+    while True:
+        if limiter is not None:
+            limiter.acquire()
+        try:
+            return fn()
+        except stripe.RateLimitError as e:
+            if attempt >= retries:
+                raise
+            wait = retry_after(e, attempt)
+            attempt += 1
+            if limiter is not None:
+                limiter.pause(wait)
+            else:
+                time.sleep(wait)
+
 def get_customer_active_subscriptions(customer_stripe_id):
     response = stripe.Subscription.list(
         customer=customer_stripe_id,
@@ -148,6 +239,28 @@ def get_customer_active_subscriptions(customer_stripe_id):
     )
     return response
 
+def _iter_pages(resource, limit=100, **params):
+    """
+    Every object of `resource`, one page (one API call) at a time; what
+    auto_paging_iter() does, but callers can count the calls.
+    """
+    starting_after = None
+    while True:
+        page = resource.list(limit=limit, starting_after=starting_after, **params)
+        yield page.data
+        if not page.has_more or not page.data:
+            return
+        starting_after = page.data[-1].id
+
+def iter_subscription_pages(status="all", limit=100, **params):
+    return _iter_pages(stripe.Subscription, limit=limit, status=status, **params)
+
+def iter_product_pages(limit=100, **params):
+    return _iter_pages(stripe.Product, limit=limit, **params)
+
+def iter_price_pages(limit=100, **params):
+    return _iter_pages(stripe.Price, limit=limit, **params)
+
 def cancel_subscription(stripe_id, reason="", feedback="other", cancel_at_period_end=False, raw=True):
     if cancel_at_period_end:
         response = stripe.Subscription.modify(
@@ -166,60 +279,76 @@ def cancel_subscription(stripe_id, reason="", feedback="other", cancel_at_period
                 "feedback": feedback
             }
         )
+    invalidate_subscription(stripe_id)
     if raw:
         return response
     return serialize_subscription_data(response)
 
+def construct_webhook_event(payload, signature):
+    """
+    Verify a webhook's Stripe-Signature header. Raises ValueError for a bad
+    payload and stripe.SignatureVerificationError for a bad signature.
+    """
+    if not STRIPE_WEBHOOK_SECRET:
+        raise stripe.SignatureVerificationError("STRIPE_WEBHOOK_SECRET is not set", signature)
+    return stripe.Webhook.construct_event(payload, signature, STRIPE_WEBHOOK_SECRET)
+
+def checkout_subscription_id(checkout_r):
+    """
+    The subscription of a completed checkout session.
+    """
+    # Check if checkout session is completed
+    if checkout_r.payment_status != 'paid':
+        raise ValueError(f"Payment not completed. Status: {checkout_r.payment_status}")
+    subscription = checkout_r.subscription
+    if not subscription:
+        raise ValueError("No subscription found in checkout session")
+    # expanded into the full object by get_checkout_customer_plan
+    return subscription if isinstance(subscription, str) else subscription.id
+
+def checkout_customer_plan_data(checkout_r, sub_r):
+    # Check subscription status
+    if sub_r.status in ['incomplete', 'incomplete_expired']:
+        raise ValueError(f"Subscription is incomplete. Status: {sub_r.status}")
+
+    # Get plan information - handle both old and new Stripe API formats
+    sub_plan = None
+    if hasattr(sub_r, 'plan') and sub_r.plan:
+        sub_plan = sub_r.plan
+    elif hasattr(sub_r, 'items') and sub_r.items.data:
+        # For newer Stripe API, get price from subscription items
+        sub_plan = sub_r.items.data[0].price
+
+    if not sub_plan:
+        raise ValueError("Unable to retrieve subscription plan information")
+
+    subscription_data = serialize_subscription_data(sub_r)
+
+    data = {
+        "customer_id": checkout_r.customer,
+        "plan_id": sub_plan.id,
+        "sub_stripe_id": sub_r.id,
+        **subscription_data,
+    }
+    return data
+
 def get_checkout_customer_plan(session_id):
     """
     Get checkout customer plan with improved error handling
     """
     try:
-        checkout_r = get_checkout_session(session_id, raw=True)
-
-        # Check if checkout session is completed
-        if checkout_r.payment_status != 'paid':
-            raise ValueError(f"Payment not completed. Status: {checkout_r.payment_status}")
-
-        customer_id = checkout_r.customer
-        sub_stripe_id = checkout_r.subscription
-
-        if not sub_stripe_id:
-            raise ValueError("No subscription found in checkout session")
-
-        # Retrieve subscription with error handling
-        sub_r = get_subscription(sub_stripe_id, raw=True)
-        print(f"DEBUG: Raw Stripe Subscription Object: {sub_r}") # Add this line
-        print(f"DEBUG: sub_r.current_period_start: {getattr(sub_r, 'current_period_start', 'Not Found')}") # Add this line
-        print(f"DEBUG: sub_r.current_period_end: {getattr(sub_r, 'current_period_end', 'Not Found')}") # Add this line
-
-
-        # Check subscription status
-        if sub_r.status in ['incomplete', 'incomplete_expired']:
-            raise ValueError(f"Subscription is incomplete. Status: {sub_r.status}")
-
-        # Get plan information - handle both old and new Stripe API formats
-        sub_plan = None
-        if hasattr(sub_r, 'plan') and sub_r.plan:
-            sub_plan = sub_r.plan
-        elif hasattr(sub_r, 'items') and sub_r.items.data:
-            # For newer Stripe API, get price from subscription items
-            sub_plan = sub_r.items.data[0].price
-
-        if not sub_plan:
-            raise ValueError("Unable to retrieve subscription plan information")
-
-        subscription_data = serialize_subscription_data(sub_r)
-
-        data = {
-            "customer_id": customer_id,
-            "plan_id": sub_plan.id,
-            "sub_stripe_id": sub_stripe_id,
-            **subscription_data,
-        }
-        return data
+        # both lookups share one budget, also outside of a request (webhook worker)
+        with billing_resilience.deadline(billing_resilience.STRIPE_REQUEST_BUDGET):
+            # one round trip: the subscription (and the prices on its
+            # items, which Stripe always includes) comes with the session
+            checkout_r = get_checkout_session(session_id, raw=True, expand=["subscription"])
+            sub_stripe_id = checkout_subscription_id(checkout_r)
+            sub_r = checkout_r.subscription
+            if isinstance(sub_r, str):
+                sub_r = get_subscription(sub_stripe_id, raw=True)
+        return checkout_customer_plan_data(checkout_r, sub_r)
 
     except stripe.error.StripeError as e:
         raise ValueError(f"Stripe API error: {str(e)}")
     except Exception as e:
-        raise ValueError(f"Error processing checkout: {str(e)}")
\ No newline at end of file
+        raise ValueError(f"Error processing checkout: {str(e)}")
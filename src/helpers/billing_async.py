@@ -0,0 +1,116 @@
+"""
+Async counterparts of helpers.billing for async views and jobs. They use
+the SDK's *_async methods on the pooled client billing_transport installs
+(httpx when installed, else the sync pool from a worker thread), so
+independent calls can run together with asyncio.gather().
+"""
+import asyncio
+
+import stripe
+from asgiref.sync import sync_to_async
+
+from . import billing, billing_resilience
+
+
+async def acreate_customer(
+    name="",
+    email="",
+    metadata={},
+    idempotency_key=None,
+    raw=False):
+    response = await stripe.Customer.create_async(
+        name=name,
+        email=email,
+        metadata=metadata,
+        idempotency_key=idempotency_key,
+    )
+    if raw:
+        return response
+    return response.id
+
+async def astart_checkout_session(customer_id,
+    success_url="",
+    cancel_url="",
+    price_stripe_id="",
+    raw=True):
+    if not success_url.endswith("?session_id={CHECKOUT_SESSION_ID}"):
+        success_url = f"{success_url}" + "?session_id={CHECKOUT_SESSION_ID}"
+    response = await stripe.checkout.Session.create_async(
+        customer=customer_id,
+        success_url=success_url,
+        cancel_url=cancel_url,
+        line_items=[{"price": price_stripe_id, "quantity": 1}],
+        mode="subscription",
+    )
+    if raw:
+        return response
+    return response.url
+
+async def aget_checkout_session(stripe_id, raw=True, expand=None):
+    response = await stripe.checkout.Session.retrieve_async(stripe_id, expand=expand or [])
+    if raw:
+        return response
+    return response.url
+
+async def aget_subscription(stripe_id, raw=True):
+    response = await stripe.Subscription.retrieve_async(stripe_id)
+    if raw:
+        return response
+    return billing.serialize_subscription_data(response)
+
+async def acancel_subscription(stripe_id, reason="", feedback="other", cancel_at_period_end=False, raw=True):
+    cancellation_details = {
+        "comment": reason,
+        "feedback": feedback
+    }
+    if cancel_at_period_end:
+        response = await stripe.Subscription.modify_async(
+            stripe_id,
+            cancel_at_period_end=cancel_at_period_end,
+            cancellation_details=cancellation_details
+        )
+    else:
+        response = await stripe.Subscription.cancel_async(
+            stripe_id,
+            cancellation_details=cancellation_details
+        )
+    await sync_to_async(billing.invalidate_subscription)(stripe_id)
+    if raw:
+        return response
+    return billing.serialize_subscription_data(response)
+
+async def aget_checkout_customer_plan(session_id):
+    try:
+        with billing_resilience.deadline(billing_resilience.STRIPE_REQUEST_BUDGET):
+            checkout_r = await aget_checkout_session(session_id, raw=True, expand=["subscription"])
+            sub_stripe_id = billing.checkout_subscription_id(checkout_r)
+            sub_r = checkout_r.subscription
+            if isinstance(sub_r, str):
+                sub_r = await aget_subscription(sub_stripe_id, raw=True)
+        return billing.checkout_customer_plan_data(checkout_r, sub_r)
+    except stripe.error.StripeError as e:
+        raise ValueError(f"Stripe API error: {str(e)}")
+    except Exception as e:
+        raise ValueError(f"Error processing checkout: {str(e)}")
+
+async def acall_rate_limited(fn, limiter=None, retries=None):
+    """
+    Async billing.call_rate_limited: awaits fn() once `limiter` allows it,
+    retrying 429 responses after their Retry-After.
+    """
+    retries = billing.STRIPE_RATE_LIMIT_RETRIES if retries is None else retries
+    attempt = 0
+    while True:
+        if limiter is not None:
+            await limiter.acquire_async()
+        try:
+            return await fn()
+        except stripe.RateLimitError as e:
+            if attempt >= retries:
+                raise
+            wait = billing.retry_after(e, attempt)
+            attempt += 1
+            if limiter is not None:
+                limiter.pause(wait)
+            else:
+                await asyncio.sleep(wait)
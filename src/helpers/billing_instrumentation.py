@@ -0,0 +1,180 @@
+import contextlib
+import contextvars
+import logging
+import os
+import sys
+import time
+from collections import defaultdict
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+
+from . import billing_resilience
+from .metrics import REGISTRY
+
+logger = logging.getLogger("helpers.billing")
+
+CALLS = "stripe_calls_total"
+ERRORS = "stripe_call_errors_total"
+DURATION = "stripe_call_duration_seconds"
+RETRIES = "stripe_call_retries_total"
+REGISTRY.describe(CALLS, "Stripe API calls, retries included, by endpoint and caller.")
+REGISTRY.describe(ERRORS, "Failed Stripe API calls by endpoint, caller and Stripe error class.")
+REGISTRY.describe(DURATION, "Stripe API call latency, retries included, by endpoint.")
+REGISTRY.describe(RETRIES, "Retried Stripe reads by endpoint.")
+REGISTRY.describe("stripe_circuit_open", "1 while the endpoint's circuit breaker is not closed.")
+
+# mirrors the status -> error class mapping of stripe's APIRequestor
+_ERROR_CLASSES = {
+    400: "InvalidRequestError",
+    401: "AuthenticationError",
+    402: "CardError",
+    403: "PermissionError",
+    404: "InvalidRequestError",
+    429: "RateLimitError",
+}
+
+
+class _Scope:
+    def __init__(self, name):
+        self.name = name
+        self.calls = defaultdict(lambda: [0, 0.0])
+
+
+_scope = contextvars.ContextVar("stripe_scope", default=None)
+_default_scope = None
+
+
+def _process_scope():
+    # calls made outside of a request belong to the running management command
+    global _default_scope
+    if _default_scope is None:
+        argv = sys.argv
+        if len(argv) > 1 and os.path.basename(argv[0]) == "manage.py":
+            _default_scope = _Scope(f"command:{argv[1]}")
+        else:
+            _default_scope = _Scope("-")
+    return _default_scope
+
+
+def current_scope():
+    return _scope.get() or _process_scope()
+
+
+@contextlib.contextmanager
+def scope(name):
+    """
+    Attribute the Stripe calls made inside the block to `name`, e.g.
+    "task:stripe-events" for a background worker.
+    """
+    token = _scope.set(_Scope(name))
+    try:
+        yield _scope.get()
+    finally:
+        _scope.reset(token)
+
+
+def _error_class(response, error):
+    if error is not None:
+        return type(error).__name__
+    status = response[1]
+    if status < 400:
+        return None
+    return _ERROR_CLASSES.get(status, "APIError")
+
+
+def record(method, url, seconds, response=None, error=None):
+    endpoint = billing_resilience.endpoint_name(method, url)
+    current = current_scope()
+    REGISTRY.inc(CALLS, (("endpoint", endpoint), ("scope", current.name)))
+    REGISTRY.observe(DURATION, (("endpoint", endpoint),), seconds)
+    error_class = _error_class(response, error)
+    if error_class is not None:
+        REGISTRY.inc(ERRORS, (("endpoint", endpoint), ("error", error_class), ("scope", current.name)))
+    if current is not _default_scope:
+        totals = current.calls[endpoint]
+        totals[0] += 1
+        totals[1] += seconds
+
+
+class InstrumentedClientMixin:
+    """
+    Counts and times every Stripe call, retries included, into REGISTRY.
+    """
+
+    def request_with_retries(self, method, url, headers, post_data=None, max_network_retries=None, *, _usage=None):
+        start = time.perf_counter()
+        try:
+            response = super().request_with_retries(method, url, headers, post_data, max_network_retries, _usage=_usage)
+        except Exception as e:
+            record(method, url, time.perf_counter() - start, error=e)
+            raise
+        record(method, url, time.perf_counter() - start, response=response)
+        return response
+
+    async def request_with_retries_async(self, method, url, headers, post_data=None, max_network_retries=None, *, _usage=None):
+        start = time.perf_counter()
+        try:
+            response = await super().request_with_retries_async(method, url, headers, post_data, max_network_retries, _usage=_usage)
+        except Exception as e:
+            record(method, url, time.perf_counter() - start, error=e)
+            raise
+        record(method, url, time.perf_counter() - start, response=response)
+        return response
+
+
+@REGISTRY.collector(kind="counter")
+def _resilience_counters():
+    for endpoint, counts in billing_resilience.stats().items():
+        yield RETRIES, (("endpoint", endpoint),), counts.get("retries", 0)
+
+
+@REGISTRY.collector
+def _resilience_gauges():
+    for endpoint, counts in billing_resilience.stats().items():
+        yield "stripe_circuit_open", (("endpoint", endpoint),), int(counts["state"] != "closed")
+
+
+def _log_summary(current):
+    if not current.calls:
+        return
+    total = sum(n for n, _ in current.calls.values())
+    seconds = sum(s for _, s in current.calls.values())
+    detail = ", ".join(
+        f"{endpoint} {n}x {s * 1000:.1f} ms" for endpoint, (n, s) in sorted(current.calls.items())
+    )
+    logger.info("%s made %s Stripe calls in %.1f ms (%s)", current.name, total, seconds * 1000, detail)
+
+
+class InstrumentationMiddleware:
+    """
+    Attributes a request's Stripe calls to its view and logs a summary of
+    them once the response is ready.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        with scope("view:-") as current:
+            response = self.get_response(request)
+        _log_summary(current)
+        return response
+
+    async def __acall__(self, request):
+        with scope("view:-") as current:
+            response = await self.get_response(request)
+        _log_summary(current)
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        # label by URL name rather than by path, which can hold ids
+        current = _scope.get()
+        if current is not None:
+            match = request.resolver_match
+            current.name = f"view:{match.view_name if match else view_func.__qualname__}"
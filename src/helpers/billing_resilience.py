@@ -0,0 +1,272 @@
+import asyncio
+import contextlib
+import contextvars
+import logging
+import random
+import threading
+import time
+from collections import Counter, defaultdict
+from urllib.parse import urlsplit
+
+import stripe
+from asgiref.sync import iscoroutinefunction
+from decouple import config
+from django.utils.decorators import sync_and_async_middleware
+
+# seconds all Stripe calls made for one request (or one checkout lookup) may take
+STRIPE_REQUEST_BUDGET = config("STRIPE_REQUEST_BUDGET", default=10.0, cast=float)
+# consecutive failures that open an endpoint's breaker, and how long it stays open
+STRIPE_BREAKER_FAILURES = config("STRIPE_BREAKER_FAILURES", default=5, cast=int)
+STRIPE_BREAKER_RESET = config("STRIPE_BREAKER_RESET", default=30.0, cast=float)
+STRIPE_RETRY_BASE_DELAY = config("STRIPE_RETRY_BASE_DELAY", default=0.25, cast=float)
+STRIPE_RETRY_MAX_DELAY = config("STRIPE_RETRY_MAX_DELAY", default=2.0, cast=float)
+
+logger = logging.getLogger("helpers.billing")
+
+_deadline = contextvars.ContextVar("stripe_deadline", default=None)
+_breakers = {}
+_stats = defaultdict(Counter)
+_lock = threading.Lock()
+
+
+class StripeUnavailable(stripe.APIConnectionError):
+    """
+    A Stripe call that was not attempted; a StripeError so existing
+    handlers treat it like a network failure.
+    """
+
+    def __init__(self, message):
+        super().__init__(message, should_retry=False)
+
+
+class DeadlineExceeded(StripeUnavailable):
+    pass
+
+
+class CircuitOpen(StripeUnavailable):
+    pass
+
+
+@contextlib.contextmanager
+def deadline(seconds):
+    """
+    Limit every Stripe call made inside the block to `seconds` in total,
+    retries included. Nested blocks can only shorten the outer budget.
+    """
+    end = time.monotonic() + seconds
+    outer = _deadline.get()
+    token = _deadline.set(end if outer is None else min(outer, end))
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+
+def remaining():
+    """
+    Seconds left in the current deadline, or None outside of one.
+    """
+    end = _deadline.get()
+    if end is None:
+        return None
+    return end - time.monotonic()
+
+
+@sync_and_async_middleware
+def deadline_middleware(get_response):
+    """
+    Give each request STRIPE_REQUEST_BUDGET seconds of Stripe calls, so a
+    degraded Stripe cannot hold a worker for longer.
+    """
+    if iscoroutinefunction(get_response):
+        async def middleware(request):
+            with deadline(STRIPE_REQUEST_BUDGET):
+                return await get_response(request)
+    else:
+        def middleware(request):
+            with deadline(STRIPE_REQUEST_BUDGET):
+                return get_response(request)
+    return middleware
+
+
+# /v1/<namespace>/<collection>/...: the namespace is not itself a collection
+_NAMESPACES = {
+    "apps", "billing", "billing_portal", "checkout", "climate", "entitlements", "financial_connections",
+    "forwarding", "identity", "issuing", "radar", "reporting", "sigma", "tax", "terminal", "test_helpers",
+    "treasury",
+}
+# collection-level actions that sit where an id would
+_COLLECTION_ACTIONS = {"search", "upcoming"}
+
+
+def endpoint_name(method, url):
+    """
+    "GET /v1/subscriptions/:id" for any segment that follows a resource
+    collection, whatever it looks like, so made-up ids cannot add
+    breakers or metric series. Actions after an id (cancel, line_items)
+    are kept.
+    """
+    segments = urlsplit(url).path.strip("/").split("/")
+    i = 1
+    if len(segments) > 2 and segments[1] in _NAMESPACES:
+        i = 2
+    # segments alternate collection, id, collection (or action), id...
+    for i in range(i + 1, len(segments), 2):
+        if segments[i] not in _COLLECTION_ACTIONS:
+            segments[i] = ":id"
+    return f"{method.upper()} /{'/'.join(segments)}"
+
+
+class CircuitBreaker:
+    """
+    Opens after `failures` consecutive failures of one endpoint and fails
+    calls fast for `reset` seconds, then lets a single probe through;
+    its success closes the breaker again.
+    """
+    CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+    def __init__(self, name, failures=None, reset=None):
+        self.name = name
+        self.failures = failures or STRIPE_BREAKER_FAILURES
+        self.reset = reset or STRIPE_BREAKER_RESET
+        self.state = self.CLOSED
+        self.consecutive = 0
+        self.opened_at = 0.0
+        self.lock = threading.Lock()
+
+    def allow(self):
+        with self.lock:
+            if self.state == self.CLOSED:
+                return True
+            if time.monotonic() - self.opened_at >= self.reset:
+                # one probe per `reset` window
+                self.state = self.HALF_OPEN
+                self.opened_at = time.monotonic()
+                return True
+            return False
+
+    def record(self, ok):
+        with self.lock:
+            if ok:
+                if self.state != self.CLOSED:
+                    logger.info("Stripe circuit for %s closed", self.name)
+                self.state = self.CLOSED
+                self.consecutive = 0
+                return
+            self.consecutive += 1
+            if self.state == self.HALF_OPEN or self.consecutive >= self.failures:
+                if self.state != self.OPEN:
+                    logger.warning("Stripe circuit for %s opened after %s failures", self.name, self.consecutive)
+                self.state = self.OPEN
+                self.opened_at = time.monotonic()
+
+
+def get_breaker(endpoint):
+    with _lock:
+        breaker = _breakers.get(endpoint)
+        if breaker is None:
+            breaker = _breakers[endpoint] = CircuitBreaker(endpoint)
+        return breaker
+
+
+def stats():
+    """
+    Per endpoint: calls, retries, failures, rejected (breaker open),
+    deadline_exceeded and the breaker state.
+    """
+    with _lock:
+        return {
+            endpoint: {**counts, "state": _breakers[endpoint].state if endpoint in _breakers else CircuitBreaker.CLOSED}
+            for endpoint, counts in _stats.items()
+        }
+
+
+def reset():
+    with _lock:
+        _breakers.clear()
+        _stats.clear()
+
+
+class _Call:
+    """
+    The bookkeeping for one logical Stripe call and its retries.
+    """
+
+    def __init__(self, client, method, url, max_network_retries):
+        self.client = client
+        self.endpoint = endpoint_name(method, url)
+        self.breaker = get_breaker(self.endpoint)
+        with _lock:
+            self.counts = _stats[self.endpoint]
+        # only reads are idempotent without an idempotency key
+        self.retries = (max_network_retries or 0) if method.lower() == "get" else 0
+        self.attempt = 0
+
+    def start(self):
+        left = remaining()
+        if left is not None and left <= 0:
+            self.counts["deadline_exceeded"] += 1
+            raise DeadlineExceeded(f"No time left for Stripe call {self.endpoint}")
+        if not self.breaker.allow():
+            self.counts["rejected"] += 1
+            raise CircuitOpen(f"Stripe circuit for {self.endpoint} is open")
+        self.counts["calls"] += 1
+
+    def retry_delay(self, response, error):
+        """
+        Seconds to wait before retrying, or None when the call is done.
+        """
+        failed = error is not None or response[1] >= 500
+        self.breaker.record(not failed)
+        if failed:
+            self.counts["failures"] += 1
+        if not self.client._should_retry(response, error, self.attempt, self.retries):
+            return None
+        self.attempt += 1
+        # full jitter: spreads the retries of many workers apart
+        delay = random.uniform(0, min(STRIPE_RETRY_MAX_DELAY, STRIPE_RETRY_BASE_DELAY * 2 ** self.attempt))
+        left = remaining()
+        if left is not None and delay >= left:
+            return None
+        self.counts["retries"] += 1
+        return delay
+
+
+class ResilientClientMixin:
+    """
+    Sends every Stripe call through its endpoint's circuit breaker and the
+    current deadline. GETs are retried with jittered exponential backoff,
+    up to the SDK's max_network_retries; writes are sent once.
+    """
+
+    def request_with_retries(self, method, url, headers, post_data=None, max_network_retries=None, *, _usage=None):
+        call = _Call(self, method, url, max_network_retries)
+        while True:
+            call.start()
+            try:
+                response = super().request_with_retries(method, url, headers, post_data, 0, _usage=_usage)
+                error = None
+            except stripe.APIConnectionError as e:
+                response, error = None, e
+            delay = call.retry_delay(response, error)
+            if delay is None:
+                if error is not None:
+                    raise error
+                return response
+            time.sleep(delay)
+
+    async def request_with_retries_async(self, method, url, headers, post_data=None, max_network_retries=None, *, _usage=None):
+        call = _Call(self, method, url, max_network_retries)
+        while True:
+            call.start()
+            try:
+                response = await super().request_with_retries_async(method, url, headers, post_data, 0, _usage=_usage)
+                error = None
+            except stripe.APIConnectionError as e:
+                response, error = None, e
+            delay = call.retry_delay(response, error)
+            if delay is None:
+                if error is not None:
+                    raise error
+                return response
+            await asyncio.sleep(delay)
@@ -0,0 +1,214 @@
+import asyncio
+import contextlib
+import contextvars
+import logging
+import os
+import ssl
+import weakref
+
+import requests
+import stripe
+from decouple import config
+from requests.adapters import HTTPAdapter
+
+from .billing_instrumentation import InstrumentedClientMixin
+from .billing_resilience import ResilientClientMixin, remaining
+
+STRIPE_HTTP_POOL_SIZE = config("STRIPE_HTTP_POOL_SIZE", default=10, cast=int)
+STRIPE_HTTP_TIMEOUT = config("STRIPE_HTTP_TIMEOUT", default=30.0, cast=float)
+STRIPE_HTTP_CONNECT_TIMEOUT = config("STRIPE_HTTP_CONNECT_TIMEOUT", default=5.0, cast=float)
+STRIPE_HTTP2 = config("STRIPE_HTTP2", default=False, cast=bool)
+
+logger = logging.getLogger("helpers.billing")
+
+_call_timeout = contextvars.ContextVar("stripe_call_timeout", default=None)
+_install_kwargs = None
+
+
+@contextlib.contextmanager
+def timeout(seconds):
+    """
+    Override the read timeout of Stripe calls made inside the block,
+    e.g. `with billing_transport.timeout(3): billing.get_subscription(...)`.
+    """
+    token = _call_timeout.set(seconds)
+    try:
+        yield
+    finally:
+        _call_timeout.reset(token)
+
+
+class CallTimeoutMixin:
+    """
+    Reads the timeout from the current `timeout()` block, falling back to
+    the client default, so one shared client serves every thread.
+    """
+
+    @property
+    def _timeout(self):
+        seconds = _call_timeout.get()
+        left = remaining()
+        if left is not None:
+            # never wait past the request's deadline
+            seconds = max(0.001, left if seconds is None else min(seconds, left))
+        if seconds is None:
+            return self._default_timeout
+        return self._call_timeout(min(STRIPE_HTTP_CONNECT_TIMEOUT, seconds), seconds)
+
+    @_timeout.setter
+    def _timeout(self, value):
+        self._default_timeout = value
+
+    def _call_timeout(self, connect, read):
+        return (connect, read)
+
+
+class HTTPXCallTimeoutMixin(CallTimeoutMixin):
+    """
+    CallTimeoutMixin for httpx clients, which take an httpx.Timeout
+    rather than a (connect, read) pair.
+    """
+
+    def _call_timeout(self, connect, read):
+        return self.httpx.Timeout(read, connect=connect)
+
+
+class PooledRequestsClient(InstrumentedClientMixin, ResilientClientMixin, CallTimeoutMixin, stripe.RequestsClient):
+    """
+    One keep-alive requests.Session with a connection pool of `pool_size`,
+    shared by every thread of the process.
+    """
+
+    def __init__(self, pool_size=STRIPE_HTTP_POOL_SIZE, timeout=STRIPE_HTTP_TIMEOUT, **kwargs):
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=2, pool_maxsize=pool_size)
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        super().__init__(timeout=(STRIPE_HTTP_CONNECT_TIMEOUT, timeout), session=session, **kwargs)
+
+
+async def _close_with_loop(clients, loop, client):
+    # asyncio.run (and so async_to_sync) cancels leftover tasks before
+    # closing its loop, which closes the client and its sockets here
+    try:
+        await asyncio.Event().wait()
+    finally:
+        clients.pop(loop, None)
+        await client.aclose()
+
+
+class LoopAsyncClientMixin:
+    """
+    One httpx.AsyncClient per event loop: its pooled connections belong to
+    the loop that opened them, and async_to_sync runs each call on a new one.
+    Each client is closed, and forgotten, when its loop shuts down.
+    """
+    async_client_kwargs = {}
+
+    @property
+    def _client_async(self):
+        loop = asyncio.get_running_loop()
+        clients = self.__dict__.setdefault("_loop_clients", weakref.WeakKeyDictionary())
+        entry = clients.get(loop)
+        if entry is None:
+            client = self.httpx.AsyncClient(**self.async_client_kwargs)
+            # the task is only weakly referenced by the loop; keep it here
+            entry = clients[loop] = (client, loop.create_task(_close_with_loop(clients, loop, client)))
+        return entry[0]
+
+    @_client_async.setter
+    def _client_async(self, value):
+        # HTTPXClient.__init__ builds one up front, outside of any loop
+        pass
+
+
+def _http2_client(pool_size, timeout):
+    try:
+        import h2  # noqa: F401
+        import httpx
+    except ImportError:
+        logger.warning("STRIPE_HTTP2 needs `pip install httpx[http2]`, using HTTP/1.1")
+        return None
+
+    class HTTP2Client(InstrumentedClientMixin, ResilientClientMixin, HTTPXCallTimeoutMixin, LoopAsyncClientMixin, stripe.HTTPXClient):
+        def __init__(self, **kwargs):
+            super().__init__(timeout=timeout, **kwargs)
+            limits = httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size)
+            verify = ssl.create_default_context(cafile=stripe.ca_bundle_path)
+            self._client = httpx.Client(http2=True, limits=limits, verify=verify)
+            self.async_client_kwargs = {"http2": True, "limits": limits, "verify": verify}
+
+    return HTTP2Client()
+
+
+class ThreadedAsyncClient(stripe.HTTPClient):
+    """
+    Serves the SDK's *_async calls by running the pooled sync client in a
+    worker thread; the fallback when httpx is not installed.
+    """
+    name = "threaded"
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.sync_client = None
+
+    def request(self, method, url, headers, post_data=None):
+        return self.sync_client.request(method, url, headers, post_data)
+
+    async def request_async(self, method, url, headers, post_data=None):
+        return await asyncio.to_thread(self.request, method, url, headers, post_data)
+
+    def sleep_async(self, secs):
+        return asyncio.sleep(secs)
+
+    async def close_async(self):
+        pass
+
+class PooledAsyncClient(HTTPXCallTimeoutMixin, LoopAsyncClientMixin, stripe.HTTPXClient):
+    """
+    The async side of PooledRequestsClient; the sync client's mixins
+    handle breakers and retries, this one bounds each socket wait by the
+    current `timeout()` and deadline.
+    """
+
+
+def _async_client(pool_size, timeout):
+    try:
+        import httpx
+    except ImportError:
+        return ThreadedAsyncClient()
+    client = PooledAsyncClient(timeout=timeout)
+    limits = httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size)
+    verify = ssl.create_default_context(cafile=stripe.ca_bundle_path)
+    client.async_client_kwargs = {"limits": limits, "verify": verify}
+    return client
+
+def new_http_client(pool_size=STRIPE_HTTP_POOL_SIZE, timeout=STRIPE_HTTP_TIMEOUT, http2=STRIPE_HTTP2):
+    client = None
+    if http2:
+        client = _http2_client(pool_size, timeout)
+    if client is None:
+        async_client = _async_client(pool_size, timeout)
+        client = PooledRequestsClient(pool_size=pool_size, timeout=timeout, async_fallback_client=async_client)
+        if isinstance(async_client, ThreadedAsyncClient):
+            async_client.sync_client = client
+    return client
+
+
+def install(**kwargs):
+    """
+    Make a pooled client the one every stripe.* call in this process uses.
+    """
+    global _install_kwargs
+    _install_kwargs = kwargs
+    stripe.default_http_client = new_http_client(**kwargs)
+    return stripe.default_http_client
+
+
+def _reinstall_after_fork():
+    # pooled sockets must not be shared with the parent (gunicorn --preload)
+    if _install_kwargs is not None:
+        install(**_install_kwargs)
+
+
+os.register_at_fork(after_in_child=_reinstall_after_fork)
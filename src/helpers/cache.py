@@ -0,0 +1,102 @@
+import logging
+import threading
+import time
+from concurrent.futures import Future
+
+from django.core.cache import cache
+
+LOCK_SUFFIX = ":lock"
+GENERATION_SUFFIX = ":gen"
+
+logger = logging.getLogger("helpers.cache")
+
+_inflight = {}
+_inflight_lock = threading.Lock()
+
+
+def _coalesced(key, fn):
+    """
+    Run fn() once per key at a time in this process; concurrent callers
+    for the same key wait for, and share, the in-flight result.
+    """
+    with _inflight_lock:
+        future = _inflight.get(key)
+        leader = future is None
+        if leader:
+            future = _inflight[key] = Future()
+    if not leader:
+        return future.result()
+    try:
+        future.set_result(fn())
+    except BaseException as e:
+        future.set_exception(e)
+    finally:
+        with _inflight_lock:
+            del _inflight[key]
+    return future.result()
+
+
+def _usable(envelope, allow_stale):
+    return envelope is not None and (allow_stale or envelope["fresh_until"] > time.time())
+
+
+def _refresh(key, compute, ttl, stale_ttl, lock_timeout, wait, stale_if_error, allow_stale):
+    envelope = cache.get(key)
+    if envelope is not None and envelope["fresh_until"] > time.time():
+        return envelope["value"]
+    lock_key = f"{key}{LOCK_SUFFIX}"
+    locked = cache.add(lock_key, 1, timeout=lock_timeout)
+    if not locked:
+        if _usable(envelope, allow_stale):
+            return envelope["value"]
+        deadline = time.monotonic() + wait
+        while time.monotonic() < deadline:
+            time.sleep(0.05)
+            envelope = cache.get(key)
+            if _usable(envelope, allow_stale):
+                return envelope["value"]
+    generation_key = f"{key}{GENERATION_SUFFIX}"
+    generation = cache.get(generation_key)
+    try:
+        value = compute()
+    except Exception:
+        if stale_if_error and allow_stale and envelope is not None:
+            logger.warning("Serving stale %s after a failed refresh", key, exc_info=True)
+            return envelope["value"]
+        raise
+    finally:
+        if locked:
+            cache.delete(lock_key)
+    # skip the write if invalidate() ran while computing
+    if cache.get(generation_key) == generation:
+        cache.set(key, {"value": value, "fresh_until": time.time() + ttl}, timeout=ttl + stale_ttl)
+    return value
+
+
+def cached_value(key, compute, ttl=30, stale_ttl=300, lock_timeout=10, wait=1.0, stale_if_error=False,
+                 allow_stale=True):
+    """
+    Return compute() cached under `key` for `ttl` seconds.
+
+    Once the value goes stale it is still served for up to `stale_ttl`
+    seconds while the single caller holding the `key:lock` entry
+    (taken with cache.add, so one per cluster on a shared cache)
+    recomputes it; callers in the same process share one computation.
+    On a cold miss the other callers wait up to `wait` seconds for that
+    value before computing it themselves. With `stale_if_error` a failed
+    recompute returns the stale value instead of raising. With
+    allow_stale=False only a value younger than `ttl` is ever returned,
+    for callers that write what they read back somewhere.
+    """
+    envelope = cache.get(key)
+    if envelope is not None and envelope["fresh_until"] > time.time():
+        return envelope["value"]
+    return _coalesced(
+        (key, allow_stale),
+        lambda: _refresh(key, compute, ttl, stale_ttl, lock_timeout, wait, stale_if_error, allow_stale)
+    )
+
+
+def invalidate(key):
+    cache.delete(key)
+    cache.set(f"{key}{GENERATION_SUFFIX}", time.time_ns(), timeout=3600)
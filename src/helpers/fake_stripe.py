@@ -0,0 +1,406 @@
+import collections
+import itertools
+import json
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlsplit
+
+PERIOD_SECONDS = {"day": 86_400, "week": 7 * 86_400, "month": 30 * 86_400, "year": 365 * 86_400}
+
+
+def _unflatten(pairs):
+    """
+    Stripe form encoding to a dict: `metadata[user_id]=1` -> {"metadata": {"user_id": "1"}}.
+    Lists arrive indexed (`expand[0]=...`) and come out as {"0": ...} dicts.
+    """
+    data = {}
+    for key, value in pairs:
+        parts = re.findall(r"[^\[\]]+", key)
+        target = data
+        for part in parts[:-1]:
+            target = target.setdefault(part, {})
+        target[parts[-1]] = value
+    return data
+
+
+def _values(value):
+    if isinstance(value, dict):
+        return list(value.values())
+    return list(value or [])
+
+
+class FakeStripeState:
+    """
+    In-memory Stripe objects keyed by id, plus a count of requests per route
+    and the responses replayed for repeated idempotency keys.
+    """
+
+    def __init__(self):
+        self.objects = {}
+        self.requests = collections.Counter()
+        self.idempotent = {}
+        self.lock = threading.Lock()
+        self._ids = itertools.count(1)
+
+    def next_id(self, prefix):
+        return f"{prefix}_fake{next(self._ids):08d}"
+
+    def create(self, prefix, obj_type, **fields):
+        with self.lock:
+            stripe_id = self.next_id(prefix)
+            obj = {"id": stripe_id, "object": obj_type, "created": int(time.time()), "livemode": False, **fields}
+            self.objects[stripe_id] = obj
+            return obj
+
+    def of_type(self, obj_type):
+        with self.lock:
+            return [obj for obj in self.objects.values() if obj["object"] == obj_type]
+
+    def create_subscription(self, customer, price):
+        now = int(time.time())
+        interval = (price.get("recurring") or {}).get("interval")
+        end = now + PERIOD_SECONDS.get(interval, PERIOD_SECONDS["month"])
+        item = {
+            "id": self.next_id("si"),
+            "object": "subscription_item",
+            "price": price,
+            "plan": price,
+            "quantity": 1,
+            "current_period_start": now,
+            "current_period_end": end,
+        }
+        return self.create(
+            "sub", "subscription",
+            customer=customer,
+            status="active",
+            cancel_at_period_end=False,
+            cancellation_details={},
+            current_period_start=now,
+            current_period_end=end,
+            plan=price,
+            items={"object": "list", "data": [item], "has_more": False, "url": "/v1/subscription_items"},
+            metadata={},
+        )
+
+
+class FakeStripeHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive
+    disable_nagle_algorithm = True
+
+    routes = [
+        ("POST", r"/v1/customers", "create_customer"),
+        ("GET", r"/v1/customers", "list_customers"),
+        ("GET", r"/v1/customers/(?P<id>[^/]+)", "retrieve"),
+        ("POST", r"/v1/products", "create_product"),
+        ("GET", r"/v1/products", "list_products"),
+        ("GET", r"/v1/products/(?P<id>[^/]+)", "retrieve"),
+        ("POST", r"/v1/products/(?P<id>[^/]+)", "update"),
+        ("POST", r"/v1/prices", "create_price"),
+        ("GET", r"/v1/prices", "list_prices"),
+        ("GET", r"/v1/prices/(?P<id>[^/]+)", "retrieve"),
+        ("POST", r"/v1/prices/(?P<id>[^/]+)", "update"),
+        ("POST", r"/v1/checkout/sessions", "create_checkout_session"),
+        ("GET", r"/v1/checkout/sessions/(?P<id>[^/]+)", "retrieve"),
+        ("GET", r"/v1/subscriptions", "list_subscriptions"),
+        ("GET", r"/v1/subscriptions/(?P<id>[^/]+)", "retrieve"),
+        ("POST", r"/v1/subscriptions/(?P<id>[^/]+)", "modify_subscription"),
+        ("DELETE", r"/v1/subscriptions/(?P<id>[^/]+)", "cancel_subscription"),
+    ]
+
+    def setup(self):
+        super().setup()
+        if self.server.connect_delay:
+            # stands in for the TCP + TLS handshake round trips to the real API
+            time.sleep(self.server.connect_delay)
+
+    def log_message(self, format, *args):
+        pass
+
+    @property
+    def state(self):
+        return self.server.state
+
+    def _send(self, status, payload, headers=None):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("Request-Id", f"req_fake{time.monotonic_ns()}")
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        try:
+            self.wfile.write(body)
+        except ConnectionError:
+            # the client timed out and went away
+            self.close_connection = True
+
+    def _injected_failure(self):
+        """
+        Sleep for the configured latency, then maybe pick an error to return.
+        """
+        server = self.server
+        if server.latency:
+            time.sleep(server.latency * random.uniform(1 - server.jitter, 1 + server.jitter))
+        roll = random.random()
+        for status, rate in server.errors.items():
+            if roll < rate:
+                if status == 429:
+                    error = {"type": "invalid_request_error", "code": "rate_limit", "message": "Too many requests"}
+                    return status, {"error": error}, {"Retry-After": "1"}
+                error = {"type": "api_error", "message": "Injected failure"}
+                return status, {"error": error}, {}
+            roll -= rate
+        return None
+
+    def _dispatch(self):
+        url = urlsplit(self.path)
+        length = int(self.headers.get("Content-Length") or 0)
+        params = _unflatten(parse_qsl(self.rfile.read(length).decode("utf-8"), keep_blank_values=True))
+        params.update(_unflatten(parse_qsl(url.query, keep_blank_values=True)))
+        for method, pattern, name in self.routes:
+            match = re.fullmatch(pattern, url.path)
+            if method != self.command or not match:
+                continue
+            with self.state.lock:
+                self.state.requests[name] += 1
+            failure = self._injected_failure()
+            if failure is not None:
+                return self._send(*failure)
+            key = self.headers.get("Idempotency-Key") if method == "POST" else None
+            request_hash = json.dumps([url.path, params], sort_keys=True)
+            with self.state.lock:
+                replay = self.state.idempotent.get(key)
+            if replay is not None:
+                replay_hash, status, payload = replay
+                if replay_hash != request_hash:
+                    # like Stripe, refuse to reuse a key for a different request
+                    return self._send(400, {"error": {
+                        "type": "idempotency_error",
+                        "message": f"Keys for idempotent requests can only be used with the same parameters "
+                                   f"they were first used with. Try using a key other than '{key}'.",
+                    }})
+                return self._send(status, payload, headers={"Idempotent-Replayed": "true"})
+            status, payload = getattr(self, name)(params, **match.groupdict())
+            if key and status < 500:
+                with self.state.lock:
+                    self.state.idempotent[key] = (request_hash, status, payload)
+            return self._send(status, payload)
+        self._send(404, {"error": {"type": "invalid_request_error", "message": f"Unrecognized request URL ({url.path})"}})
+
+    do_GET = _dispatch
+    do_POST = _dispatch
+    do_DELETE = _dispatch
+
+    def not_found(self, stripe_id):
+        error = {"type": "invalid_request_error", "code": "resource_missing", "message": f"No such object: '{stripe_id}'"}
+        return 404, {"error": error}
+
+    def _expand(self, obj, params):
+        obj = dict(obj)
+        for field in _values(params.get("expand")):
+            field = field.removeprefix("data.")
+            value = obj.get(field)
+            if isinstance(value, str) and value in self.state.objects:
+                obj[field] = self.state.objects[value]
+        return obj
+
+    def _page(self, objects, params, url):
+        """
+        A list object with `limit` / `starting_after` cursor pagination.
+        """
+        objects = sorted(objects, key=lambda obj: obj["id"])
+        limit = min(int(params.get("limit") or 10), 100)
+        starting_after = params.get("starting_after")
+        if starting_after:
+            objects = [obj for obj in objects if obj["id"] > starting_after]
+        data = [self._expand(obj, params) for obj in objects[:limit]]
+        return 200, {"object": "list", "data": data, "has_more": len(objects) > limit, "url": url}
+
+    def _filter_created(self, objects, params):
+        created = params.get("created")
+        if isinstance(created, dict):
+            checks = {"lt": int.__lt__, "lte": int.__le__, "gt": int.__gt__, "gte": int.__ge__}
+            for op, bound in created.items():
+                objects = [obj for obj in objects if checks[op](obj["created"], int(bound))]
+        elif created:
+            objects = [obj for obj in objects if obj["created"] == int(created)]
+        return objects
+
+    def _filter_active(self, objects, params):
+        if "active" in params:
+            active = params["active"] == "true"
+            objects = [obj for obj in objects if obj["active"] == active]
+        return objects
+
+    def retrieve(self, params, id):
+        obj = self.state.objects.get(id)
+        if obj is None:
+            return self.not_found(id)
+        return 200, self._expand(obj, params)
+
+    def update(self, params, id):
+        obj = self.state.objects.get(id)
+        if obj is None:
+            return self.not_found(id)
+        with self.state.lock:
+            if "active" in params:
+                params["active"] = params["active"] == "true"
+            metadata = params.pop("metadata", {})
+            obj.update(params)
+            obj.setdefault("metadata", {}).update(metadata)
+        return 200, obj
+
+    def create_customer(self, params):
+        return 200, self.state.create(
+            "cus", "customer",
+            name=params.get("name", ""),
+            email=params.get("email", ""),
+            metadata=params.get("metadata", {}),
+        )
+
+    def list_customers(self, params):
+        return self._page(self.state.of_type("customer"), params, "/v1/customers")
+
+    def create_product(self, params):
+        return 200, self.state.create(
+            "prod", "product",
+            name=params.get("name", ""),
+            active=True,
+            metadata=params.get("metadata", {}),
+        )
+
+    def list_products(self, params):
+        products = self._filter_active(self.state.of_type("product"), params)
+        return self._page(products, params, "/v1/products")
+
+    def create_price(self, params):
+        product = params.get("product")
+        if product not in self.state.objects:
+            return self.not_found(product)
+        return 200, self.state.create(
+            "price", "price",
+            product=product,
+            currency=params.get("currency", "usd"),
+            unit_amount=int(params.get("unit_amount") or 0),
+            recurring=params.get("recurring", {"interval": "month"}),
+            active=True,
+            metadata=params.get("metadata", {}),
+        )
+
+    def list_prices(self, params):
+        prices = self._filter_active(self.state.of_type("price"), params)
+        if "product" in params:
+            prices = [p for p in prices if p["product"] == params["product"]]
+        return self._page(prices, params, "/v1/prices")
+
+    def create_checkout_session(self, params):
+        """
+        Sessions complete immediately: the subscription exists and is paid
+        as soon as the session is created.
+        """
+        customer = params.get("customer")
+        line_items = _values(params.get("line_items"))
+        price = self.state.objects.get(line_items[0].get("price")) if line_items else None
+        if customer not in self.state.objects or price is None:
+            return 400, {"error": {"type": "invalid_request_error", "message": "Missing customer or price"}}
+        subscription = self.state.create_subscription(customer, price)
+        session = self.state.create(
+            "cs", "checkout.session",
+            customer=customer,
+            subscription=subscription["id"],
+            mode=params.get("mode", "subscription"),
+            status="complete",
+            payment_status="paid",
+            success_url=params.get("success_url", ""),
+            cancel_url=params.get("cancel_url", ""),
+        )
+        session["url"] = f"https://checkout.stripe.test/c/pay/{session['id']}"
+        return 200, session
+
+    def list_subscriptions(self, params):
+        subs = self.state.of_type("subscription")
+        if "customer" in params:
+            subs = [s for s in subs if s["customer"] == params["customer"]]
+        status = params.get("status")
+        if status and status != "all":
+            subs = [s for s in subs if s["status"] == status]
+        elif not status:
+            subs = [s for s in subs if s["status"] != "canceled"]
+        subs = self._filter_created(subs, params)
+        return self._page(subs, params, "/v1/subscriptions")
+
+    def modify_subscription(self, params, id):
+        sub = self.state.objects.get(id)
+        if sub is None:
+            return self.not_found(id)
+        with self.state.lock:
+            if "cancel_at_period_end" in params:
+                sub["cancel_at_period_end"] = params["cancel_at_period_end"] == "true"
+            if "cancellation_details" in params:
+                sub["cancellation_details"] = params["cancellation_details"]
+            sub["metadata"].update(params.get("metadata", {}))
+        return 200, sub
+
+    def cancel_subscription(self, params, id):
+        sub = self.state.objects.get(id)
+        if sub is None:
+            return self.not_found(id)
+        with self.state.lock:
+            sub["status"] = "canceled"
+            sub["canceled_at"] = int(time.time())
+            sub["cancellation_details"] = params.get("cancellation_details", {})
+        return 200, sub
+
+
+class FakeStripeServer:
+    """
+    A local HTTP stand-in for the Stripe API, for benchmarks and offline runs:
+
+        with FakeStripeServer(latency=0.05, errors={500: 0.01}) as server:
+            stripe.api_base = server.url
+
+    Every request waits `latency` seconds (+/- `jitter` as a fraction),
+    and `errors` maps an HTTP status to the fraction of requests that
+    fail with it.
+    """
+
+    def __init__(self, host="127.0.0.1", port=0, latency=0.0, jitter=0.2, errors=None, connect_delay=0.0):
+        self.httpd = ThreadingHTTPServer((host, port), FakeStripeHandler)
+        self.httpd.daemon_threads = True
+        self.httpd.state = FakeStripeState()
+        self.httpd.latency = latency
+        self.httpd.jitter = jitter
+        self.httpd.errors = errors or {}
+        self.httpd.connect_delay = connect_delay
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    @property
+    def state(self):
+        return self.httpd.state
+
+    def start(self):
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def serve_forever(self):
+        self.httpd.serve_forever()
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
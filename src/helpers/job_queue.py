@@ -0,0 +1,73 @@
+"""
+Claiming rows of DB-backed job tables (customer provisioning, catalog
+sync, Stripe webhook events) from several workers at once.
+
+Claims are a conditional UPDATE on `claimed_at`, not SELECT ... FOR UPDATE
+SKIP LOCKED: a batch calls Stripe between claim and release, and a row
+lock would hold a transaction open across those calls. A conditional
+UPDATE is atomic on every database, including SQLite, which has no SKIP
+LOCKED. A claim left by a dead worker expires after CLAIM_TIMEOUT.
+"""
+import datetime
+
+from django.db.models import F, Q
+from django.utils import timezone
+
+# a claim older than this belongs to a worker that died mid-batch
+CLAIM_TIMEOUT = datetime.timedelta(minutes=10)
+
+
+def claimable(now):
+    """
+    Rows no worker is working on: never claimed, or claimed by one that died.
+    """
+    return Q(claimed_at__isnull=True) | Q(claimed_at__lt=now - CLAIM_TIMEOUT)
+
+
+def claim(model, row_id, now):
+    """
+    Take one unprocessed row for this worker and count the attempt. A
+    conditional UPDATE is atomic on every database, so one worker wins.
+    """
+    return model.objects.filter(
+        claimable(now),
+        id=row_id,
+        processed__isnull=True
+    ).update(claimed_at=now, attempts=F("attempts") + 1) == 1
+
+
+def release(rows):
+    """
+    Write back the outcome of claimed rows (error / processed) and drop
+    their claims.
+    """
+    for row in rows:
+        row.claimed_at = None
+    if rows:
+        type(rows[0]).objects.bulk_update(rows, ["error", "processed", "claimed_at"])
+
+
+def drain(queryset, run_batch, limit=5_000, batch_size=50):
+    """
+    Claim the rows of `queryset` (pending jobs with `attempts`, `error`,
+    `processed` and `claimed_at` fields) `batch_size` at a time in id
+    order and pass each batch to `run_batch(rows)`, which does the work
+    and calls release(). Nothing is locked while `run_batch` runs, so it
+    can call out to Stripe; rows another worker claimed are skipped.
+    Returns the sum of what `run_batch` returned.
+    """
+    model = queryset.model
+    seen = []
+    done = 0
+    while len(seen) < limit:
+        now = timezone.now()
+        candidates = list(
+            queryset.filter(claimable(now)).exclude(id__in=seen).order_by("id").values_list("id", flat=True)[:batch_size]
+        )
+        if not candidates:
+            break
+        seen += candidates
+        claimed = [row_id for row_id in candidates if claim(model, row_id, now)]
+        if claimed:
+            done += run_batch(list(model.objects.filter(id__in=claimed).order_by("id")))
+    return done
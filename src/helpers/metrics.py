@@ -0,0 +1,123 @@
+import bisect
+import math
+import threading
+from collections import defaultdict
+
+# HDR-style buckets: 4 per power of two from ~0.5 ms to ~65 s, so any
+# recorded latency is within ~19% of its bucket's upper bound
+SUB_BUCKETS = 4
+BUCKET_BOUNDS = tuple(2 ** (exp / SUB_BUCKETS) for exp in range(-11 * SUB_BUCKETS, 6 * SUB_BUCKETS + 1))
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in labels) + "}"
+
+
+class Histogram:
+    def __init__(self):
+        self.counts = [0] * (len(BUCKET_BOUNDS) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(BUCKET_BOUNDS, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def quantile(self, q):
+        """
+        Upper bound of the bucket holding the q-th quantile.
+        """
+        if not self.count:
+            return 0.0
+        rank = math.ceil(q * self.count)
+        seen = 0
+        for i, n in enumerate(self.counts):
+            seen += n
+            if seen >= rank:
+                return BUCKET_BOUNDS[i] if i < len(BUCKET_BOUNDS) else math.inf
+        return math.inf
+
+
+class Registry:
+    """
+    In-process counters and histograms keyed by metric name and a tuple of
+    (label, value) pairs; render() gives the Prometheus text format.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = defaultdict(lambda: defaultdict(float))
+        self.histograms = defaultdict(lambda: defaultdict(Histogram))
+        self.help = {}
+        self.collectors = []
+
+    def describe(self, name, text):
+        self.help[name] = text
+
+    def inc(self, name, labels=(), value=1):
+        with self.lock:
+            self.counters[name][labels] += value
+
+    def observe(self, name, labels, value):
+        with self.lock:
+            self.histograms[name][labels].observe(value)
+
+    def collector(self, fn=None, kind="gauge"):
+        """
+        Register fn() -> [(name, labels, value)] for values read at scrape
+        time; gauges by default, or running totals with kind="counter".
+        Use as @REGISTRY.collector or @REGISTRY.collector(kind="counter").
+        """
+        if fn is None:
+            return lambda fn: self.collector(fn, kind=kind)
+        self.collectors.append((fn, kind))
+        return fn
+
+    def clear(self):
+        with self.lock:
+            self.counters.clear()
+            self.histograms.clear()
+
+    def _header(self, name, kind):
+        lines = []
+        if name in self.help:
+            lines.append(f"# HELP {name} {self.help[name]}")
+        lines.append(f"# TYPE {name} {kind}")
+        return lines
+
+    def render(self):
+        lines = []
+        with self.lock:
+            for name, series in sorted(self.counters.items()):
+                lines += self._header(name, "counter")
+                for labels, value in sorted(series.items()):
+                    lines.append(f"{name}{_format_labels(labels)} {value:g}")
+            for name, series in sorted(self.histograms.items()):
+                lines += self._header(name, "histogram")
+                for labels, hist in sorted(series.items()):
+                    cumulative = 0
+                    for bound, n in zip(BUCKET_BOUNDS, hist.counts):
+                        cumulative += n
+                        lines.append(f"{name}_bucket{_format_labels(labels + (('le', f'{bound:.6g}'),))} {cumulative}")
+                    lines.append(f"{name}_bucket{_format_labels(labels + (('le', '+Inf'),))} {hist.count}")
+                    lines.append(f"{name}_sum{_format_labels(labels)} {hist.sum:.6f}")
+                    lines.append(f"{name}_count{_format_labels(labels)} {hist.count}")
+        collected = defaultdict(list)
+        for fn, kind in self.collectors:
+            for name, labels, value in fn():
+                collected[(name, kind)].append((labels, value))
+        for (name, kind), series in sorted(collected.items()):
+            lines += self._header(name, kind)
+            for labels, value in sorted(series):
+                lines.append(f"{name}{_format_labels(labels)} {value:g}")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
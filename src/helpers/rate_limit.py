@@ -0,0 +1,54 @@
+import asyncio
+import threading
+import time
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket allowing `rate` calls per second with
+    bursts of up to `burst`. Share one instance between workers calling
+    the same API.
+    """
+
+    def __init__(self, rate, burst=None):
+        self.rate = float(rate)
+        # at least one whole token, or rates below 1/s would never grant one
+        self.capacity = max(1.0, float(burst or rate))
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + max(0.0, now - self.updated) * self.rate)
+        self.updated = max(self.updated, now)
+
+    def _take(self):
+        """
+        Take a token if one is available; returns 0, else the wait in seconds.
+        """
+        with self.lock:
+            now = time.monotonic()
+            self._refill(now)
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return 0
+            return (1 - self.tokens) / self.rate + max(0.0, self.updated - now)
+
+    def acquire(self):
+        """
+        Block until a token is available and take it.
+        """
+        while wait := self._take():
+            time.sleep(wait)
+
+    async def acquire_async(self):
+        while wait := self._take():
+            await asyncio.sleep(wait)
+
+    def pause(self, seconds):
+        """
+        Hold every caller back for `seconds`, e.g. for a Retry-After.
+        """
+        with self.lock:
+            self.tokens = 0.0
+            self.updated = max(self.updated, time.monotonic() + seconds)
@@ -0,0 +1,24 @@
+import stripe
+from django.test import TestCase
+
+from . import billing_resilience
+from .fake_stripe import FakeStripeServer
+
+
+class FakeStripeTestCase(TestCase):
+    """
+    Runs Stripe calls against a local helpers.fake_stripe server.
+    """
+
+    def setUp(self):
+        previous = stripe.api_base, stripe.api_key, stripe.default_http_client
+        # tests may install() another transport
+        self.addCleanup(setattr, stripe, "default_http_client", previous[2])
+        self.addCleanup(setattr, stripe, "api_key", previous[1])
+        self.addCleanup(setattr, stripe, "api_base", previous[0])
+        self.server = FakeStripeServer().start()
+        self.addCleanup(self.server.stop)
+        stripe.api_base = self.server.url
+        stripe.api_key = "sk_test_fake"
+        billing_resilience.reset()
+        self.addCleanup(billing_resilience.reset)
@@ -7,13 +7,14 @@ from django.shortcuts import render
 # Create your views here.
 from dashboard.views import dashboard_view
 
-from visits.models import PageVisits
+from visits.counters import get_cached_total_visits
+from visits.utils import track_page_visit
 
 def landing_dashboard_page_view(request):
     if request.user.is_authenticated:
         return dashboard_view(request)
-    qs = PageVisits.objects.all()
-    PageVisits.objects.create(path=request.path)
-    page_views_formatted = helpers.numbers.shorten_number(qs.count() * 100_000)
-    social_views_formatted = helpers.numbers.shorten_number(qs.count() * 23_000)
-    return render(request, "landing/main.html", {"page_view_count": page_views_formatted, "social_views_count": social_views_formatted})
\ No newline at end of file
+    total_visits = get_cached_total_visits()
+    visit_beacon = track_page_visit(request)
+    page_views_formatted = helpers.numbers.shorten_number(total_visits * 100_000)
+    social_views_formatted = helpers.numbers.shorten_number(total_visits * 23_000)
+    return render(request, "landing/main.html", {"page_view_count": page_views_formatted, "social_views_count": social_views_formatted, "visit_beacon": visit_beacon})
\ No newline at end of file
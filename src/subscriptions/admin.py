@@ -1,7 +1,7 @@
 from django.contrib import admin
 
 # Register your models here.
-from .models import Subscription, SubscriptionPrice, UserSubscription
+from .models import CatalogOutbox, CheckoutSession, StripeEvent, Subscription, SubscriptionPrice, UserSubscription
 
 class SubscriptionPrice(admin.StackedInline):
     model = SubscriptionPrice
@@ -18,4 +18,30 @@ class SubscriptionAdmin(admin.ModelAdmin):
 admin.site.register(Subscription, SubscriptionAdmin)
 
 
-admin.site.register(UserSubscription)
\ No newline at end of file
+admin.site.register(UserSubscription)
+
+
+class StripeEventAdmin(admin.ModelAdmin):
+    list_display = ['stripe_id', 'type', 'object_id', 'created', 'attempts', 'processed']
+    list_filter = ['type']
+    search_fields = ['stripe_id', 'object_id']
+    readonly_fields = ['payload']
+
+
+admin.site.register(StripeEvent, StripeEventAdmin)
+
+class CheckoutSessionAdmin(admin.ModelAdmin):
+    list_display = ['stripe_id', 'user', 'timestamp']
+    search_fields = ['stripe_id']
+
+
+admin.site.register(CheckoutSession, CheckoutSessionAdmin)
+
+
+class CatalogOutboxAdmin(admin.ModelAdmin):
+    list_display = ['kind', 'object_id', 'attempts', 'timestamp', 'processed']
+    list_filter = ['kind']
+    readonly_fields = ['error']
+
+
+admin.site.register(CatalogOutbox, CatalogOutboxAdmin)
@@ -0,0 +1,248 @@
+import hashlib
+import json
+import logging
+import traceback
+from decimal import Decimal
+
+from django.db import transaction
+from django.utils import timezone
+
+import helpers.billing
+import helpers.cache
+from helpers import billing_instrumentation, job_queue
+from helpers.background import BackgroundWorker
+from helpers.rate_limit import TokenBucket
+from subscriptions.models import PRICE_PLAN_MAP_CACHE_KEY, CatalogOutbox, Subscription, SubscriptionPrice
+
+logger = logging.getLogger(__name__)
+
+PRODUCT = CatalogOutbox.Kind.PRODUCT
+PRICE = CatalogOutbox.Kind.PRICE
+MAX_ATTEMPTS = 10
+BATCH_SIZE = 50
+
+
+def _idempotency_key(kind, obj, params):
+    """
+    Retries of the same push map to the same Stripe object. Editing the row
+    after a failed push changes the payload hash, and a row recreated under
+    the same id (e.g. after a database reset) has a new timestamp, so
+    neither replays an object Stripe created for an earlier payload.
+    """
+    payload = json.dumps({"created": obj.timestamp.isoformat(), **params}, sort_keys=True, default=str)
+    digest = hashlib.sha256(payload.encode()).hexdigest()[:16]
+    return f"{helpers.billing.STRIPE_IDEMPOTENCY_PREFIX}catalog-{kind}-{obj.id}-{digest}"
+
+
+def push_product(sub, limiter=None):
+    params = {
+        "name": sub.name,
+        "metadata": {"subscription_plan_id": sub.id},
+    }
+    return helpers.billing.call_rate_limited(
+        lambda: helpers.billing.create_product(
+            **params,
+            idempotency_key=_idempotency_key(PRODUCT, sub, params),
+            raw=False
+        ),
+        limiter=limiter
+    )
+
+
+def push_price(price, limiter=None):
+    product = price.product_stripe_id
+    if not product:
+        raise ValueError(f"Plan of price {price.id} is not in Stripe yet")
+    params = {
+        "currency": price.stripe_currency,
+        "unit_amount": price.stripe_price,
+        "interval": price.interval,
+        "product": product,
+        "metadata": {"subscription_plan_price_id": price.id},
+    }
+    return helpers.billing.call_rate_limited(
+        lambda: helpers.billing.create_price(
+            **params,
+            idempotency_key=_idempotency_key(PRICE, price, params),
+            raw=False
+        ),
+        limiter=limiter
+    )
+
+
+def sync_price_now(price):
+    """
+    Push `price`, and its plan if needed, right away; for a checkout that
+    cannot wait for the drainer. Returns the price's stripe_id.
+    """
+    if price.stripe_id:
+        return price.stripe_id
+    sub = price.subscription
+    if sub is not None and not sub.stripe_id:
+        sub.stripe_id = push_product(sub)
+        Subscription.objects.filter(id=sub.id).update(stripe_id=sub.stripe_id)
+    price.stripe_id = push_price(price)
+    SubscriptionPrice.objects.filter(id=price.id).update(stripe_id=price.stripe_id)
+    helpers.cache.invalidate(PRICE_PLAN_MAP_CACHE_KEY)
+    return price.stripe_id
+
+
+def _push_batch(kind, rows, limiter):
+    if kind == PRODUCT:
+        model, push = Subscription, push_product
+        objs = Subscription.objects.in_bulk([row.object_id for row in rows])
+    else:
+        model, push = SubscriptionPrice, push_price
+        objs = SubscriptionPrice.objects.select_related("subscription").in_bulk([row.object_id for row in rows])
+    now = timezone.now()
+    pushed = []
+    for row in rows:
+        obj = objs.get(row.object_id)
+        try:
+            # deleted, or pushed since it was queued
+            if obj is not None and not obj.stripe_id:
+                obj.stripe_id = push(obj, limiter=limiter)
+                pushed.append(obj)
+        except Exception:
+            logger.warning("Failed to push %s to Stripe", row, exc_info=True)
+            row.error = traceback.format_exc()
+        else:
+            row.error = None
+            row.processed = now
+    with transaction.atomic():
+        model.objects.bulk_update(pushed, ["stripe_id"])
+        job_queue.release(rows)
+    if kind == PRICE and pushed:
+        helpers.cache.invalidate(PRICE_PLAN_MAP_CACHE_KEY)
+    return len(pushed)
+
+
+def drain_outbox(limit=5_000, batch_size=BATCH_SIZE, rps=None):
+    """
+    Create queued products, then prices, in Stripe and write back their
+    stripe_id. Rows are claimed `batch_size` at a time with a conditional
+    UPDATE (helpers.job_queue), so the background threads and
+    `push_catalog` never push the same row at once and no lock is held
+    while Stripe is called. Failures stay queued for later runs, up to
+    MAX_ATTEMPTS; the idempotency key makes a retry return the object an
+    earlier, interrupted attempt created.
+    """
+    limiter = TokenBucket(rps or helpers.billing.STRIPE_MAX_RPS)
+    pushed = 0
+    for kind in (PRODUCT, PRICE):
+        pushed += job_queue.drain(
+            CatalogOutbox.objects.filter(kind=kind, processed__isnull=True, attempts__lt=MAX_ATTEMPTS),
+            lambda rows, kind=kind: _push_batch(kind, rows, limiter),
+            limit=limit,
+            batch_size=batch_size
+        )
+    return pushed
+
+
+def _local_match(by_stripe_id, by_id, obj, metadata_key):
+    # rows whose push was interrupted have no stripe_id, only the metadata we sent
+    match = by_stripe_id.get(obj.id)
+    if match is None:
+        local_id = obj.metadata.to_dict().get(metadata_key) if obj.metadata else None
+        candidate = by_id.get(int(local_id)) if local_id and local_id.isdigit() else None
+        if candidate is not None and not candidate.stripe_id:
+            match = candidate
+    return match
+
+
+def _set_changed(obj, values, now):
+    changed = False
+    for field, value in values.items():
+        if getattr(obj, field) != value:
+            setattr(obj, field, value)
+            changed = True
+    if changed:
+        # bulk_update() skips auto_now
+        obj.updated = now
+    return changed
+
+
+def import_catalog(verbose=False):
+    """
+    Reconcile Subscription / SubscriptionPrice with every Stripe product
+    and recurring USD price, matched by stripe_id. Each side is read once
+    (Stripe 100 objects per call) and written with bulk_create /
+    bulk_update in one transaction. Returns call and row counts.
+    """
+    stats = {"api_calls": 0, "products": 0, "prices": 0, "skipped": 0,
+             "plans_created": 0, "plans_updated": 0, "prices_created": 0, "prices_updated": 0}
+    products = []
+    for page in helpers.billing.iter_product_pages():
+        stats["api_calls"] += 1
+        products += page
+    prices = []
+    for page in helpers.billing.iter_price_pages(active=True):
+        stats["api_calls"] += 1
+        prices += page
+    stats["products"], stats["prices"] = len(products), len(prices)
+    intervals = set(SubscriptionPrice.IntervalChoices.values)
+    now = timezone.now()
+
+    with transaction.atomic():
+        plans = Subscription.objects.in_bulk()
+        plans_by_stripe_id = {plan.stripe_id: plan for plan in plans.values() if plan.stripe_id}
+        create, update = [], []
+        for product in products:
+            plan = _local_match(plans_by_stripe_id, plans, product, "subscription_plan_id")
+            if plan is None:
+                plan = Subscription(stripe_id=product.id, name=product.name[:120], active=product.active)
+                create.append(plan)
+            elif _set_changed(plan, {"stripe_id": product.id, "name": product.name[:120], "active": product.active}, now):
+                update.append(plan)
+            plans_by_stripe_id[product.id] = plan
+        Subscription.objects.bulk_create(create, batch_size=500)
+        Subscription.objects.bulk_update(update, ["stripe_id", "name", "active", "updated"], batch_size=500)
+        stats["plans_created"], stats["plans_updated"] = len(create), len(update)
+
+        local_prices = SubscriptionPrice.objects.in_bulk()
+        prices_by_stripe_id = {p.stripe_id: p for p in local_prices.values() if p.stripe_id}
+        # imported prices are only featured where nothing is featured yet
+        featured = {(p.subscription_id, p.interval) for p in local_prices.values() if p.featured}
+        create, update = [], []
+        for price in prices:
+            interval = price.recurring.interval if price.recurring else None
+            plan = plans_by_stripe_id.get(price.product)
+            if price.currency != "usd" or interval not in intervals or price.unit_amount is None or plan is None:
+                stats["skipped"] += 1
+                continue
+            values = {
+                "stripe_id": price.id,
+                "subscription_id": plan.id,
+                "interval": interval,
+                "price": (Decimal(price.unit_amount) / 100).quantize(Decimal("0.01")),
+            }
+            obj = _local_match(prices_by_stripe_id, local_prices, price, "subscription_plan_price_id")
+            if obj is None:
+                obj = SubscriptionPrice(featured=(plan.id, interval) not in featured, **values)
+                featured.add((plan.id, interval))
+                create.append(obj)
+            elif _set_changed(obj, values, now):
+                update.append(obj)
+        SubscriptionPrice.objects.bulk_create(create, batch_size=500)
+        SubscriptionPrice.objects.bulk_update(update, ["stripe_id", "subscription_id", "interval", "price", "updated"], batch_size=500)
+        stats["prices_created"], stats["prices_updated"] = len(create), len(update)
+        if create or update:
+            transaction.on_commit(lambda: helpers.cache.invalidate(PRICE_PLAN_MAP_CACHE_KEY))
+    if verbose:
+        print(f"Stripe: {stats['products']} products, {stats['prices']} prices in {stats['api_calls']} API calls")
+    return stats
+
+
+def _drain_in_background():
+    with billing_instrumentation.scope("task:catalog-outbox"):
+        drain_outbox()
+
+
+_worker = BackgroundWorker("catalog-outbox", _drain_in_background)
+
+
+def wake_worker():
+    """
+    Have this process's background thread drain the outbox.
+    """
+    _worker.wake()
@@ -0,0 +1,141 @@
+import datetime
+import logging
+import traceback
+
+import stripe
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.utils import timezone
+
+import helpers.billing
+from helpers import billing_instrumentation, job_queue
+from helpers.background import BackgroundWorker
+from subscriptions import utils as subs_utils
+from subscriptions.models import StripeEvent, Subscription, UserSubscription
+
+User = get_user_model()
+logger = logging.getLogger(__name__)
+
+SUBSCRIPTION_EVENTS = {"customer.subscription.updated", "customer.subscription.deleted"}
+CHECKOUT_EVENTS = {"checkout.session.completed"}
+HANDLED_EVENTS = SUBSCRIPTION_EVENTS | CHECKOUT_EVENTS
+MAX_ATTEMPTS = 5
+CLAIM_TIMEOUT = job_queue.CLAIM_TIMEOUT
+
+
+def record_event(event):
+    """
+    Store a verified webhook event (a dict) once per event id; Stripe
+    redelivers events, so duplicates are ignored. Returns (obj, created).
+    """
+    data_object = event["data"]["object"]
+    return StripeEvent.objects.get_or_create(
+        stripe_id=event["id"],
+        defaults={
+            "type": event["type"],
+            "object_id": data_object.get("id"),
+            "created": datetime.datetime.fromtimestamp(event["created"], tz=datetime.UTC),
+            "payload": event,
+        }
+    )
+
+
+def _apply_subscription_event(event):
+    newer = StripeEvent.objects.filter(
+        object_id=event.object_id,
+        type__in=SUBSCRIPTION_EVENTS,
+        processed__isnull=False,
+        created__gt=event.created
+    )
+    if newer.exists():
+        # events can arrive out of order; a later state was already applied
+        return
+    sub = stripe.Subscription.construct_from(event.payload["data"]["object"], stripe.api_key)
+    sub_data = helpers.billing.serialize_subscription_data(sub)
+    helpers.billing.invalidate_subscription(sub.id)
+    for obj in UserSubscription.objects.filter(stripe_id=sub.id):
+        for k, v in sub_data.items():
+            setattr(obj, k, v)
+        obj.save()
+
+
+def _apply_checkout_event(event):
+    session = event.payload["data"]["object"]
+    if session.get("mode") != "subscription" or not session.get("subscription"):
+        return
+    if subs_utils.get_processed_checkout(session["id"]) is not None:
+        return
+    checkout_data = helpers.billing.get_checkout_customer_plan(session["id"])
+    plan_id = checkout_data.pop("plan_id")
+    customer_id = checkout_data.pop("customer_id")
+    sub_stripe_id = checkout_data.pop("sub_stripe_id")
+    helpers.billing.invalidate_subscription(sub_stripe_id)
+    sub_obj = subs_utils.get_subscription_for_price(plan_id)
+    if sub_obj is None:
+        raise Subscription.DoesNotExist(f"No plan with price {plan_id}")
+    user_obj = User.objects.get(customer__stripe_id=customer_id)
+    user_sub_obj, _created = subs_utils.activate_user_subscription(user_obj, sub_obj, sub_stripe_id, checkout_data)
+    subs_utils.record_checkout(session["id"], user_sub_obj)
+
+
+def apply_event(event):
+    if event.type in SUBSCRIPTION_EVENTS:
+        _apply_subscription_event(event)
+    elif event.type in CHECKOUT_EVENTS:
+        _apply_checkout_event(event)
+
+
+def _claim(event_id, now):
+    return job_queue.claim(StripeEvent, event_id, now)
+
+
+def process_pending_events(limit=500):
+    """
+    Apply unprocessed events oldest first. Each event is claimed with a
+    conditional UPDATE before it is applied, so the background threads
+    and `process_stripe_events` never apply the same event twice, and no
+    lock is held while Stripe is called. Failures are recorded and retried
+    on later runs, up to MAX_ATTEMPTS; claims left by a crashed worker
+    expire after CLAIM_TIMEOUT.
+    """
+    seen = []
+    processed = 0
+    while len(seen) < limit:
+        now = timezone.now()
+        event = StripeEvent.objects.filter(
+            job_queue.claimable(now),
+            processed__isnull=True,
+            attempts__lt=MAX_ATTEMPTS
+        ).exclude(id__in=seen).order_by("created", "id").first()
+        if event is None:
+            break
+        seen.append(event.id)
+        if not _claim(event.id, now):
+            continue
+        error, done = None, None
+        try:
+            with transaction.atomic():
+                apply_event(event)
+        except Exception:
+            logger.warning("Failed to apply Stripe event %s", event.stripe_id, exc_info=True)
+            error = traceback.format_exc()
+        else:
+            done = timezone.now()
+            processed += 1
+        StripeEvent.objects.filter(id=event.id).update(error=error, processed=done, claimed_at=None)
+    return processed
+
+
+def _process_in_background():
+    with billing_instrumentation.scope("task:stripe-events"):
+        process_pending_events()
+
+
+_worker = BackgroundWorker("stripe-events", _process_in_background)
+
+
+def wake_worker():
+    """
+    Have this process's background thread apply pending events.
+    """
+    _worker.wake()
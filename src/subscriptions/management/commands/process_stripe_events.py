@@ -0,0 +1,14 @@
+from typing import Any
+from django.core.management.base import BaseCommand
+
+from subscriptions import events as subs_events
+
+class Command(BaseCommand):
+
+    def add_arguments(self, parser):
+        parser.add_argument("--limit", default=5_000, type=int)
+
+    def handle(self, *args: Any, **options: Any):
+        # python manage.py process_stripe_events
+        processed = subs_events.process_pending_events(limit=options.get("limit"))
+        self.stdout.write(f"Applied {processed} Stripe events")
@@ -0,0 +1,14 @@
+from typing import Any
+from django.core.management.base import BaseCommand
+
+from subscriptions import catalog as subs_catalog
+
+class Command(BaseCommand):
+
+    def add_arguments(self, parser):
+        parser.add_argument("--limit", default=5_000, type=int)
+
+    def handle(self, *args: Any, **options: Any):
+        # python manage.py push_catalog
+        pushed = subs_catalog.drain_outbox(limit=options.get("limit"))
+        self.stdout.write(f"Created {pushed} products and prices in Stripe")
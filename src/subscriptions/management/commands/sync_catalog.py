@@ -0,0 +1,16 @@
+from typing import Any
+from django.core.management.base import BaseCommand
+
+from subscriptions import catalog as subs_catalog
+
+class Command(BaseCommand):
+
+    def handle(self, *args: Any, **options: Any):
+        # python manage.py sync_catalog
+        stats = subs_catalog.import_catalog(verbose=True)
+        self.stdout.write(
+            f"Plans: {stats['plans_created']} created, {stats['plans_updated']} updated; "
+            f"prices: {stats['prices_created']} created, {stats['prices_updated']} updated, "
+            f"{stats['skipped']} skipped (not recurring USD)"
+        )
+        self.stdout.write(f"Stripe API calls: {stats['api_calls']}")
@@ -1,5 +1,6 @@
 import helpers.billing
 from typing import Any
+from asgiref.sync import async_to_sync
 from django.core.management.base import BaseCommand
 
 from subscriptions import utils as subs_utils
@@ -12,6 +13,18 @@ class Command(BaseCommand):
         parser.add_argument("--days-left", default=0, type=int)
         parser.add_argument("--days-ago", default=0, type=int)
         parser.add_argument("--clear-dangling", action="store_true", default=False)
+        parser.add_argument("--sweep", action="store_true", default=False,
+                            help="with --clear-dangling, list the whole account's active subs instead of each customer's")
+        parser.add_argument("--dry-run", action="store_true", default=False,
+                            help="with --clear-dangling --sweep, only report the dangling subs")
+        parser.add_argument("--bulk", action="store_true", default=False,
+                            help="list every Stripe subscription (100 per call) instead of one call per user")
+        parser.add_argument("--async", action="store_true", default=False, dest="use_async",
+                            help="retrieve subscriptions concurrently on an asyncio event loop")
+        parser.add_argument("--concurrency", default=None, type=int,
+                            help="threads (or with --async, requests in flight) retrieving subscriptions in parallel")
+        parser.add_argument("--rps", default=None, type=float,
+                            help="max Stripe calls per second across threads (default: STRIPE_MAX_RPS)")
 
     def handle(self, *args: Any, **options: Any):
         # python manage.py sync_user_subs --clear-dangling
@@ -21,9 +34,54 @@ class Command(BaseCommand):
         day_start = options.get("day_start")
         day_end = options.get("day_end")
         clear_dangling = options.get("clear_dangling")
-        if clear_dangling:
+        if clear_dangling and options.get("sweep"):
+            print("Sweeping dangling not in use active subs in stripe")
+            stats = subs_utils.sweep_dangling_subs(
+                dry_run=options.get("dry_run"),
+                concurrency=options.get("concurrency") or 8,
+                rps=options.get("rps"),
+                verbose=True
+                )
+            print(f"Found {stats['dangling']} dangling of {stats['listed']} active subs "
+                  f"in {stats['list_calls']} Stripe API calls")
+            if not options.get("dry_run"):
+                print(f"Canceled {stats['canceled']}, failed {stats['failed']}")
+        elif clear_dangling:
             print("Clearing dangling not in use active subs in stripe")
             subs_utils.clear_dangling_subs()
+        elif options.get("bulk"):
+            print("Sync active subs from a bulk listing")
+            qs = subs_utils.get_refresh_queryset(
+                active_only=True,
+                days_left=days_left,
+                days_ago=days_ago,
+                day_start=day_start,
+                day_end=day_end,
+                verbose=True
+                )
+            stats = subs_utils.bulk_refresh_users_subscriptions(qs, verbose=True)
+            api_calls = stats["list_calls"] + stats["retrieve_calls"]
+            print(f"Checked {stats['checked']} subs against {stats['listed']} listed, updated {stats['changed']}")
+            print(f"Stripe API calls: {api_calls} ({stats['list_calls']} list, {stats['retrieve_calls']} retrieve) "
+                  f"instead of {stats['checked']}")
+        elif options.get("use_async"):
+            print("Sync active subs asynchronously")
+            qs = subs_utils.get_refresh_queryset(
+                active_only=True,
+                days_left=days_left,
+                days_ago=days_ago,
+                day_start=day_start,
+                day_end=day_end,
+                verbose=True
+                )
+            done = async_to_sync(subs_utils.arefresh_users_subscriptions)(
+                qs,
+                concurrency=options.get("concurrency") or 10,
+                rps=options.get("rps"),
+                verbose=True
+                )
+            if done:
+                print("Done")
         else:
             print("Sync active subs")
             done = subs_utils.refresh_active_users_subscriptions(
@@ -32,6 +90,8 @@ class Command(BaseCommand):
                 days_ago=days_ago,
                 day_start=day_start,
                 day_end=day_end,
+                concurrency=options.get("concurrency") or 1,
+                rps=options.get("rps"),
                 verbose=True
                 )
             if done:
@@ -0,0 +1,49 @@
+# Generated by Django 5.0.14 on 2026-10-16 23:17
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("subscriptions", "0017_usersubscription_cancel_at_period_end_and_more"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="StripeEvent",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("stripe_id", models.CharField(max_length=120, unique=True)),
+                ("type", models.CharField(db_index=True, max_length=120)),
+                (
+                    "object_id",
+                    models.CharField(
+                        blank=True, db_index=True, max_length=120, null=True
+                    ),
+                ),
+                (
+                    "created",
+                    models.DateTimeField(help_text="When Stripe created the event"),
+                ),
+                ("payload", models.JSONField()),
+                ("attempts", models.IntegerField(default=0)),
+                ("error", models.TextField(blank=True, null=True)),
+                (
+                    "processed",
+                    models.DateTimeField(blank=True, db_index=True, null=True),
+                ),
+                ("timestamp", models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                "ordering": ["created"],
+            },
+        ),
+    ]
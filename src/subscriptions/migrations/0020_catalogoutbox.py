@@ -0,0 +1,44 @@
+# Generated by Django 5.0.14 on 2026-10-16 23:32
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("subscriptions", "0019_checkoutsession"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="CatalogOutbox",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "kind",
+                    models.CharField(
+                        choices=[("product", "Product"), ("price", "Price")],
+                        max_length=20,
+                    ),
+                ),
+                ("object_id", models.BigIntegerField()),
+                ("attempts", models.IntegerField(default=0)),
+                ("error", models.TextField(blank=True, null=True)),
+                (
+                    "processed",
+                    models.DateTimeField(blank=True, db_index=True, null=True),
+                ),
+                ("timestamp", models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                "ordering": ["timestamp"],
+            },
+        ),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 5.0.14 on 2026-10-16 23:48
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("subscriptions", "0020_catalogoutbox"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="stripeevent",
+            name="claimed_at",
+            field=models.DateTimeField(
+                blank=True,
+                help_text="When a worker took the event to apply it",
+                null=True,
+            ),
+        ),
+    ]
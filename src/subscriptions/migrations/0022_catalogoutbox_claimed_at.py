@@ -0,0 +1,21 @@
+# Generated by Django 5.0.14 on 2026-10-17 00:07
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("subscriptions", "0021_stripeevent_claimed_at"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="catalogoutbox",
+            name="claimed_at",
+            field=models.DateTimeField(
+                blank=True,
+                help_text="When a worker took the row to push it",
+                null=True,
+            ),
+        ),
+    ]
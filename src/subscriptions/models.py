@@ -1,9 +1,10 @@
 import datetime
 import helpers.billing
-from django.db import models
+import helpers.cache
+from django.db import models, transaction
 from django.db.models import Q
 from django.contrib.auth.models import Group, Permission
-from django.db.models.signals import post_save
+from django.db.models.signals import post_delete, post_save
 from django.conf import settings 
 from django.urls import reverse
 from django.utils import timezone
@@ -12,6 +13,7 @@ from datetime import timedelta
 User = settings.AUTH_USER_MODEL # "auth.User"
 
 ALLOW_CUSTOM_GROUPS = True
+PRICE_PLAN_MAP_CACHE_KEY = "subscriptions:price-plan-map"
 SUBSCRIPTION_PERMISSIONS = [
     ("advanced", "Advanced Perm"), # subscriptions.advanced
     ("pro", "Pro Perm"),  # subscriptions.pro
@@ -54,16 +56,11 @@ class Subscription(models.Model):
         return [x.strip() for x in self.features.split("\n")]
 
     def save(self, *args, **kwargs):
-        if not self.stripe_id:
-            stripe_id = helpers.billing.create_product(
-                    name=self.name, 
-                    metadata={
-                        "subscription_plan_id": self.id
-                    }, 
-                    raw=False
-                )
-            self.stripe_id = stripe_id
-        super().save(*args, **kwargs)
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            if not self.stripe_id:
+                # created in Stripe by subscriptions.catalog once committed
+                CatalogOutbox.enqueue(CatalogOutbox.Kind.PRODUCT, self.id)
 
 
 # Create your models here.
@@ -76,7 +73,7 @@ class SubscriptionPrice(models.Model):
         YEARLY = "year", "Yearly"
 
     subscription = models.ForeignKey(Subscription, on_delete=models.SET_NULL, null=True)
-    stripe_id = models.CharField(max_length=120, null=True, blank=True)
+    stripe_id = models.CharField(max_length=120, null=True, blank=True, db_index=True)
     interval = models.CharField(max_length=120, 
                                 default=IntervalChoices.MONTHLY, 
                                 choices=IntervalChoices.choices
@@ -131,20 +128,10 @@ class SubscriptionPrice(models.Model):
         return self.subscription.stripe_id
     
     def save(self, *args, **kwargs):
-        if (not self.stripe_id and 
-            self.product_stripe_id is not None):
-            stripe_id = helpers.billing.create_price(
-                currency=self.stripe_currency,
-                unit_amount=self.stripe_price,
-                interval=self.interval,
-                product=self.product_stripe_id,
-                metadata={
-                        "subscription_plan_price_id": self.id
-                },
-                raw=False
-            )
-            self.stripe_id = stripe_id
-        super().save(*args, **kwargs)
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            if not self.stripe_id:
+                CatalogOutbox.enqueue(CatalogOutbox.Kind.PRICE, self.id)
         if self.featured and self.subscription:
             qs = SubscriptionPrice.objects.filter(
                 subscription=self.subscription,
@@ -355,6 +342,75 @@ class UserSubscription(models.Model):
 
 
 
+class StripeEvent(models.Model):
+    """
+    A Stripe webhook event, stored once per event id and applied later
+    by subscriptions.events.
+    """
+    stripe_id = models.CharField(max_length=120, unique=True)
+    type = models.CharField(max_length=120, db_index=True)
+    object_id = models.CharField(max_length=120, blank=True, null=True, db_index=True)
+    created = models.DateTimeField(help_text="When Stripe created the event")
+    payload = models.JSONField()
+    attempts = models.IntegerField(default=0)
+    error = models.TextField(blank=True, null=True)
+    processed = models.DateTimeField(blank=True, null=True, db_index=True)
+    claimed_at = models.DateTimeField(blank=True, null=True, help_text="When a worker took the event to apply it")
+    timestamp = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ['created']
+
+    def __str__(self):
+        return f"{self.type} {self.stripe_id}"
+
+
+class CatalogOutbox(models.Model):
+    """
+    A Subscription (Stripe product) or SubscriptionPrice (Stripe price)
+    waiting to be created in Stripe; written in the same transaction as
+    the row and drained by subscriptions.catalog.
+    """
+    class Kind(models.TextChoices):
+        PRODUCT = "product", "Product"
+        PRICE = "price", "Price"
+
+    kind = models.CharField(max_length=20, choices=Kind.choices)
+    object_id = models.BigIntegerField()
+    attempts = models.IntegerField(default=0)
+    error = models.TextField(blank=True, null=True)
+    processed = models.DateTimeField(blank=True, null=True, db_index=True)
+    claimed_at = models.DateTimeField(blank=True, null=True, help_text="When a worker took the row to push it")
+    timestamp = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ['timestamp']
+
+    def __str__(self):
+        return f"{self.kind} {self.object_id}"
+
+    @classmethod
+    def enqueue(cls, kind, object_id):
+        cls.objects.get_or_create(kind=kind, object_id=object_id, processed__isnull=True)
+        if settings.CATALOG_SYNC == "background":
+            from subscriptions import catalog
+            transaction.on_commit(catalog.wake_worker)
+
+
+class CheckoutSession(models.Model):
+    """
+    A Stripe checkout session that was already applied, so reloading the
+    success URL or a redelivered webhook does not call Stripe again.
+    """
+    stripe_id = models.CharField(max_length=120, unique=True)
+    user = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True)
+    user_subscription = models.ForeignKey(UserSubscription, on_delete=models.SET_NULL, null=True, blank=True)
+    timestamp = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.stripe_id}"
+
+
 def user_sub_post_save(sender, instance, *args, **kwargs):
     user_sub_instance = instance
     user = user_sub_instance.user
@@ -379,4 +435,12 @@ def user_sub_post_save(sender, instance, *args, **kwargs):
         user.groups.set(final_group_ids)
 
 
-post_save.connect(user_sub_post_save, sender=UserSubscription)
\ No newline at end of file
+post_save.connect(user_sub_post_save, sender=UserSubscription)
+
+
+def subscription_price_changed(sender, instance, *args, **kwargs):
+    helpers.cache.invalidate(PRICE_PLAN_MAP_CACHE_KEY)
+
+
+post_save.connect(subscription_price_changed, sender=SubscriptionPrice)
+post_delete.connect(subscription_price_changed, sender=SubscriptionPrice)
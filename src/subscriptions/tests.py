@@ -1,3 +1,438 @@
-from django.test import TestCase
+import asyncio
+import datetime
+import hashlib
+import hmac
+import json
+import threading
+import time
+from unittest import mock
 
-# Create your tests here.
+import stripe
+from asgiref.sync import async_to_sync
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import connection
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+import helpers.billing
+from customers.models import Customer
+from helpers import billing_async, date_utils, job_queue
+from helpers.rate_limit import TokenBucket
+from helpers.testing import FakeStripeTestCase
+from subscriptions import catalog as subs_catalog
+from subscriptions import events as subs_events
+from subscriptions import utils as subs_utils
+from subscriptions.models import CatalogOutbox, StripeEvent, Subscription, SubscriptionPrice, UserSubscription
+
+User = get_user_model()
+WEBHOOK_SECRET = "whsec_test"
+
+
+class SubscriptionSnapshotCacheTestCase(FakeStripeTestCase):
+
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        customer = self.server.state.create("cus", "customer")
+        product = self.server.state.create("prod", "product")
+        price = self.server.state.create("price", "price", product=product["id"], recurring={"interval": "month"})
+        self.sub_id = self.server.state.create_subscription(customer["id"], price)["id"]
+
+    def test_snapshot_is_cached_until_invalidated(self):
+        first = helpers.billing.get_subscription_snapshot(self.sub_id)
+        self.assertEqual(helpers.billing.get_subscription_snapshot(self.sub_id), first)
+        self.assertEqual(self.server.state.requests["retrieve"], 1)
+        helpers.billing.cancel_subscription(self.sub_id, reason="test")
+        self.assertEqual(helpers.billing.get_subscription_snapshot(self.sub_id)["status"], "canceled")
+        self.assertEqual(self.server.state.requests["retrieve"], 2)
+
+    def test_concurrent_misses_share_one_call(self):
+        self.server.httpd.latency = 0.2
+        threads = [threading.Thread(target=helpers.billing.get_subscription_snapshot, args=(self.sub_id,)) for _ in range(5)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(self.server.state.requests["retrieve"], 1)
+
+    @mock.patch.object(stripe, "max_network_retries", 0)
+    @mock.patch.object(helpers.billing, "STRIPE_SUBSCRIPTION_CACHE_TTL", 0)
+    def test_stale_snapshot_served_when_stripe_fails(self):
+        first = helpers.billing.get_subscription_snapshot(self.sub_id)
+        self.server.httpd.errors = {500: 1.0}
+        with self.assertLogs("helpers.cache", "WARNING"):
+            self.assertEqual(helpers.billing.get_subscription_snapshot(self.sub_id), first)
+
+    @mock.patch.object(stripe, "max_network_retries", 0)
+    @mock.patch.object(helpers.billing, "STRIPE_SUBSCRIPTION_CACHE_TTL", 0)
+    def test_refresh_never_saves_a_stale_snapshot(self):
+        helpers.billing.get_subscription_snapshot(self.sub_id)
+        user = User.objects.create(username="stale")
+        stale = timezone.now() - datetime.timedelta(days=60)
+        UserSubscription.objects.create(
+            user=user, stripe_id=self.sub_id, status="active", current_period_start=stale, current_period_end=stale
+        )
+        self.server.httpd.errors = {500: 1.0}
+        with self.assertRaises(stripe.APIError):
+            subs_utils.refresh_active_users_subscriptions(user_ids=[user.id])
+        self.assertEqual(UserSubscription.objects.get(user=user).current_period_end, stale)
+
+    def test_refresh_reads_fresh_snapshots(self):
+        user = User.objects.create(username="cached")
+        UserSubscription.objects.create(user=user, stripe_id=self.sub_id, status="past_due")
+        helpers.billing.get_subscription_snapshot(self.sub_id)
+        self.client.force_login(user)
+        response = self.client.post(reverse("user_subscription"))
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(UserSubscription.objects.get(user=user).status, "active")
+        self.assertEqual(self.server.state.requests["retrieve"], 1)
+
+
+class BulkRefreshTestCase(FakeStripeTestCase):
+
+    def test_bulk_refresh_lists_instead_of_retrieving(self):
+        plan = Subscription.objects.create(name="Bulk")
+        price = self.server.state.create("price", "price", recurring={"interval": "month"})
+        stale = timezone.now() - datetime.timedelta(days=60)
+        rows = []
+        for i in range(150):
+            customer = self.server.state.create("cus", "customer")
+            sub = self.server.state.create_subscription(customer["id"], price)
+            rows.append(UserSubscription(
+                user=User.objects.create(username=f"bulk-{i}"),
+                subscription=plan,
+                stripe_id=sub["id"],
+                status="active",
+                current_period_start=date_utils.timestamp_as_datetime(sub["current_period_start"]),
+                current_period_end=date_utils.timestamp_as_datetime(sub["current_period_end"]),
+            ))
+        UserSubscription.objects.bulk_create(rows)
+        UserSubscription.objects.filter(id=rows[0].id).update(current_period_end=stale)
+        stats = subs_utils.bulk_refresh_users_subscriptions(subs_utils.get_refresh_queryset())
+        self.assertEqual(stats["list_calls"], 2)
+        self.assertEqual(stats["retrieve_calls"], 0)
+        self.assertEqual(stats["checked"], 150)
+        self.assertEqual(stats["changed"], 1)
+        self.assertEqual(self.server.state.requests["retrieve"], 0)
+        rows[0].refresh_from_db()
+        self.assertGreater(rows[0].current_period_end, timezone.now())
+
+
+class ConcurrentRefreshTestCase(FakeStripeTestCase):
+
+    def test_concurrent_refresh_updates_every_row(self):
+        plan = Subscription.objects.create(name="Concurrent")
+        price = self.server.state.create("price", "price", recurring={"interval": "month"})
+        stale = timezone.now() - datetime.timedelta(days=60)
+        users = []
+        for i in range(20):
+            customer = self.server.state.create("cus", "customer")
+            sub = self.server.state.create_subscription(customer["id"], price)
+            user = User.objects.create(username=f"concurrent-{i}")
+            UserSubscription.objects.create(
+                user=user, subscription=plan, stripe_id=sub["id"], status="active",
+                current_period_start=stale, current_period_end=stale,
+            )
+            users.append(user.id)
+        self.server.httpd.latency = 0.02
+        done = subs_utils.refresh_active_users_subscriptions(user_ids=users, concurrency=5, rps=200)
+        self.assertTrue(done)
+        self.assertEqual(self.server.state.requests["retrieve"], 20)
+        self.assertFalse(UserSubscription.objects.filter(user_id__in=users, current_period_end=stale).exists())
+
+    def test_result_does_not_depend_on_concurrency(self):
+        price = self.server.state.create("price", "price", recurring={"interval": "month"})
+        sub = self.server.state.create_subscription(self.server.state.create("cus", "customer")["id"], price)
+        user = User.objects.create(username="either-path")
+        stale = timezone.now() - datetime.timedelta(days=60)
+        UserSubscription.objects.create(
+            user=user, stripe_id=sub["id"], status="active", current_period_start=stale, current_period_end=stale
+        )
+        cache.clear()
+        sub["status"] = "past_due"
+        results = []
+        for concurrency in (1, 2):
+            UserSubscription.objects.filter(user=user).update(status="active")
+            self.assertTrue(subs_utils.refresh_active_users_subscriptions(user_ids=[user.id], concurrency=concurrency))
+            results.append(UserSubscription.objects.get(user=user).status)
+        self.assertEqual(results, ["past_due", "past_due"])
+
+    def test_rate_limited_calls_wait_for_retry_after(self):
+        error = stripe.RateLimitError("Too many requests", http_status=429, headers={"Retry-After": "0.2"})
+        fn = mock.Mock(side_effect=[error, "ok"])
+        limiter = TokenBucket(100)
+        start = time.monotonic()
+        self.assertEqual(helpers.billing.call_rate_limited(fn, limiter=limiter), "ok")
+        self.assertGreaterEqual(time.monotonic() - start, 0.2)
+        self.assertEqual(fn.call_count, 2)
+        with self.assertRaises(stripe.RateLimitError):
+            helpers.billing.call_rate_limited(mock.Mock(side_effect=error), limiter=TokenBucket(100), retries=0)
+
+    def test_token_bucket_throttles(self):
+        limiter = TokenBucket(50, burst=1)
+        start = time.monotonic()
+        for _ in range(11):
+            limiter.acquire()
+        self.assertGreaterEqual(time.monotonic() - start, 0.19)
+
+    def test_token_bucket_with_fractional_rate(self):
+        limiter = TokenBucket(0.5)
+        self.assertEqual(limiter._take(), 0)
+        self.assertAlmostEqual(limiter._take(), 2.0, delta=0.1)
+
+
+class AsyncBillingTestCase(FakeStripeTestCase):
+
+    def test_async_checkout_round_trip(self):
+        product = self.server.state.create("prod", "product")
+        price = self.server.state.create("price", "price", product=product["id"], recurring={"interval": "month"})
+
+        async def checkout():
+            customer_id, other_id = await asyncio.gather(
+                billing_async.acreate_customer(email="a@example.com"),
+                billing_async.acreate_customer(email="b@example.com"),
+            )
+            session = await billing_async.astart_checkout_session(
+                customer_id, success_url="http://testserver/end", price_stripe_id=price["id"]
+            )
+            return customer_id, other_id, await billing_async.aget_checkout_customer_plan(session.id)
+
+        customer_id, other_id, data = async_to_sync(checkout)()
+        self.assertNotEqual(customer_id, other_id)
+        self.assertEqual(data["customer_id"], customer_id)
+        self.assertEqual(data["plan_id"], price["id"])
+        self.assertEqual(data["status"], "active")
+        canceled = async_to_sync(billing_async.acancel_subscription)(data["sub_stripe_id"], raw=False)
+        self.assertEqual(canceled["status"], "canceled")
+
+    def test_async_create_customer_is_idempotent(self):
+        create = async_to_sync(billing_async.acreate_customer)
+        first = create(email="a@example.com", idempotency_key="customer-retry")
+        self.assertEqual(create(email="a@example.com", idempotency_key="customer-retry"), first)
+        self.assertEqual(len(self.server.state.of_type("customer")), 1)
+
+    def test_async_refresh(self):
+        plan = Subscription.objects.create(name="Async")
+        price = self.server.state.create("price", "price", recurring={"interval": "month"})
+        stale = timezone.now() - datetime.timedelta(days=60)
+        for i in range(10):
+            customer = self.server.state.create("cus", "customer")
+            sub = self.server.state.create_subscription(customer["id"], price)
+            UserSubscription.objects.create(
+                user=User.objects.create(username=f"async-{i}"), subscription=plan, stripe_id=sub["id"],
+                status="active", current_period_start=stale, current_period_end=stale,
+            )
+        qs = subs_utils.get_refresh_queryset()
+        self.assertTrue(async_to_sync(subs_utils.arefresh_users_subscriptions)(qs, concurrency=4, rps=200))
+        self.assertEqual(self.server.state.requests["retrieve"], 10)
+        self.assertFalse(UserSubscription.objects.filter(current_period_end=stale).exists())
+
+
+class DanglingSweepTestCase(FakeStripeTestCase):
+
+    def test_sweep_cancels_untracked_subs_of_our_customers(self):
+        state = self.server.state
+        price = state.create("price", "price", recurring={"interval": "month"})
+        plan = Subscription.objects.create(name="Sweep")
+        subs = []
+        for i in range(3):
+            customer = state.create("cus", "customer")
+            Customer.objects.create(user=User.objects.create(username=f"sweep-{i}"), stripe_id=customer["id"])
+            subs.append(state.create_subscription(customer["id"], price))
+        UserSubscription.objects.create(user=User.objects.get(username="sweep-0"), subscription=plan, stripe_id=subs[0]["id"])
+        foreign = state.create_subscription(state.create("cus", "customer")["id"], price)
+        for sub in subs + [foreign]:
+            sub["created"] -= subs_utils.DANGLING_SUB_MIN_AGE + 60
+        # just created by a checkout that is still being finalized
+        fresh = state.create_subscription(subs[1]["customer"], price)
+
+        stats = subs_utils.sweep_dangling_subs(dry_run=True)
+        self.assertEqual((stats["list_calls"], stats["listed"], stats["dangling"]), (1, 4, 2))
+        self.assertEqual(state.requests["cancel_subscription"], 0)
+
+        stats = subs_utils.sweep_dangling_subs(concurrency=2, rps=200)
+        self.assertEqual((stats["canceled"], stats["failed"]), (2, 0))
+        self.assertEqual([state.objects[s["id"]]["status"] for s in subs], ["active", "canceled", "canceled"])
+        self.assertEqual(state.objects[foreign["id"]]["status"], "active")
+        self.assertEqual(state.objects[fresh["id"]]["status"], "active")
+        self.assertEqual(state.requests["retrieve"], 0)
+
+
+@override_settings(CATALOG_SYNC="command")
+class CatalogOutboxTestCase(FakeStripeTestCase):
+
+    def test_save_queues_and_drain_pushes(self):
+        plan = Subscription.objects.create(name="Outbox")
+        price = SubscriptionPrice.objects.create(subscription=plan, price=10)
+        self.assertEqual(sum(self.server.state.requests.values()), 0)
+        self.assertEqual(CatalogOutbox.objects.filter(processed__isnull=True).count(), 2)
+
+        self.assertEqual(subs_catalog.drain_outbox(), 2)
+        plan.refresh_from_db()
+        price.refresh_from_db()
+        self.assertEqual(self.server.state.objects[price.stripe_id]["product"], plan.stripe_id)
+        self.assertFalse(CatalogOutbox.objects.filter(processed__isnull=True).exists())
+        self.assertEqual(subs_catalog.drain_outbox(), 0)
+
+    def test_push_is_idempotent(self):
+        plan = Subscription.objects.create(name="Retry")
+        first = subs_catalog.push_product(plan)
+        self.assertEqual(subs_catalog.push_product(plan), first)
+        products = [o for o in self.server.state.objects.values() if o["object"] == "product"]
+        self.assertEqual(len(products), 1)
+        # Stripe refuses a key reused with other parameters
+        key = subs_catalog._idempotency_key(subs_catalog.PRODUCT, plan, {"name": plan.name})
+        helpers.billing.create_product(name="One", idempotency_key=key)
+        with self.assertRaises(stripe.IdempotencyError):
+            helpers.billing.create_product(name="Other", idempotency_key=key)
+
+    def test_edited_or_recreated_row_gets_a_new_object(self):
+        plan = Subscription.objects.create(name="Before")
+        first = subs_catalog.push_product(plan)
+        plan.name = "After"
+        edited = subs_catalog.push_product(plan)
+        self.assertNotEqual(edited, first)
+        self.assertEqual(self.server.state.objects[edited]["name"], "After")
+
+        # same id and payload, as after a database reset
+        plan.timestamp += datetime.timedelta(days=1)
+        self.assertNotEqual(subs_catalog.push_product(plan), edited)
+        with mock.patch.object(helpers.billing, "STRIPE_IDEMPOTENCY_PREFIX", "staging-"):
+            plan.timestamp -= datetime.timedelta(days=1)
+            self.assertNotIn(subs_catalog.push_product(plan), (first, edited))
+
+    def test_failed_push_stays_queued(self):
+        Subscription.objects.create(name="Flaky")
+        self.server.httpd.errors = {500: 1.0}
+        with self.assertLogs("subscriptions.catalog", "WARNING"):
+            self.assertEqual(subs_catalog.drain_outbox(), 0)
+        row = CatalogOutbox.objects.get()
+        self.assertIsNone(row.processed)
+        self.assertEqual(row.attempts, 1)
+        self.server.httpd.errors = {}
+        self.assertEqual(subs_catalog.drain_outbox(), 1)
+
+    def test_claimed_row_is_pushed_once(self):
+        Subscription.objects.create(name="Claimed")
+        # another process is pushing it
+        CatalogOutbox.objects.update(claimed_at=timezone.now())
+        self.assertEqual(subs_catalog.drain_outbox(), 0)
+        self.assertEqual(sum(self.server.state.requests.values()), 0)
+
+        # that process died; its claim expires
+        CatalogOutbox.objects.update(claimed_at=timezone.now() - job_queue.CLAIM_TIMEOUT - datetime.timedelta(seconds=1))
+        self.assertEqual(subs_catalog.drain_outbox(), 1)
+        row = CatalogOutbox.objects.get()
+        self.assertIsNotNone(row.processed)
+        self.assertIsNone(row.claimed_at)
+        self.assertEqual(row.attempts, 1)
+
+
+@override_settings(CATALOG_SYNC="command")
+class CatalogImportTestCase(FakeStripeTestCase):
+
+    def test_import_creates_and_reconciles_in_bulk(self):
+        state = self.server.state
+        products = [state.create("prod", "product", name=f"Plan {i}", active=True, metadata={}) for i in range(3)]
+        for i in range(250):
+            state.create(
+                "price", "price", product=products[i % 3]["id"], currency="usd", unit_amount=1000 + i,
+                recurring={"interval": "month"}, active=True, metadata={},
+            )
+        state.create("price", "price", product=products[0]["id"], currency="eur", unit_amount=900,
+                     recurring={"interval": "month"}, active=True, metadata={})
+        local = Subscription.objects.create(name="Old name", stripe_id=products[0]["id"])
+
+        with CaptureQueriesContext(connection) as queries:
+            stats = subs_catalog.import_catalog()
+        self.assertLess(len(queries), 20)
+        self.assertEqual(stats["api_calls"], 1 + 3)
+        self.assertEqual((stats["plans_created"], stats["plans_updated"]), (2, 1))
+        self.assertEqual((stats["prices_created"], stats["skipped"]), (250, 1))
+        local.refresh_from_db()
+        self.assertEqual(local.name, "Plan 0")
+        self.assertEqual(SubscriptionPrice.objects.filter(subscription=local, featured=True).count(), 1)
+        self.assertFalse(CatalogOutbox.objects.exists())
+
+        stats = subs_catalog.import_catalog()
+        self.assertEqual(stats["plans_created"] + stats["plans_updated"], 0)
+        self.assertEqual(stats["prices_created"] + stats["prices_updated"], 0)
+
+
+@override_settings(STRIPE_EVENTS_PROCESSING="command")
+@mock.patch.object(helpers.billing, "STRIPE_WEBHOOK_SECRET", WEBHOOK_SECRET)
+class StripeWebhookTestCase(FakeStripeTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.plan = Subscription.objects.create(name="Pro")
+        self.price = SubscriptionPrice.objects.create(subscription=self.plan, price=10)
+        subs_catalog.drain_outbox()
+        self.price.refresh_from_db()
+        self.user = User.objects.create_user("subscriber", password="pw")
+        self.customer_id = self.server.state.create("cus", "customer")["id"]
+        Customer.objects.create(user=self.user, stripe_id=self.customer_id)
+
+    def post_event(self, event_id, event_type, obj, created=None, secret=WEBHOOK_SECRET):
+        payload = json.dumps({
+            "id": event_id,
+            "object": "event",
+            "type": event_type,
+            "created": created or int(time.time()),
+            "data": {"object": obj},
+        })
+        timestamp = int(time.time())
+        signature = hmac.new(secret.encode(), f"{timestamp}.{payload}".encode(), hashlib.sha256).hexdigest()
+        return self.client.post(
+            reverse("stripe-webhook"), payload, content_type="application/json",
+            HTTP_STRIPE_SIGNATURE=f"t={timestamp},v1={signature}"
+        )
+
+    def test_rejects_bad_signature(self):
+        response = self.post_event("evt_1", "customer.subscription.updated", {"id": "sub_1"}, secret="whsec_wrong")
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(StripeEvent.objects.exists())
+
+    def test_checkout_then_subscription_events(self):
+        session = helpers.billing.start_checkout_session(
+            self.customer_id, success_url="http://testserver/", price_stripe_id=self.price.stripe_id
+        ).to_dict()
+        self.assertEqual(self.post_event("evt_1", "checkout.session.completed", session).status_code, 200)
+        self.assertEqual(self.post_event("evt_1", "checkout.session.completed", session).status_code, 200)
+        self.assertEqual(StripeEvent.objects.count(), 1)
+        self.assertEqual(subs_events.process_pending_events(), 1)
+        user_sub = UserSubscription.objects.get(user=self.user)
+        self.assertEqual(user_sub.stripe_id, session["subscription"])
+        self.assertEqual(user_sub.status, "active")
+
+        sub = dict(self.server.state.objects[session["subscription"]])
+        now = int(time.time())
+        self.post_event("evt_3", "customer.subscription.deleted", {**sub, "status": "canceled"}, created=now)
+        subs_events.process_pending_events()
+        # delivered late: must not undo the newer cancellation
+        self.post_event("evt_2", "customer.subscription.updated", {**sub, "status": "past_due"}, created=now - 10)
+        self.assertEqual(subs_events.process_pending_events(), 1)
+        user_sub.refresh_from_db()
+        self.assertEqual(user_sub.status, "canceled")
+
+    def test_claimed_event_is_applied_once(self):
+        sub = {"id": "sub_claimed01", "object": "subscription", "status": "active"}
+        self.post_event("evt_1", "customer.subscription.updated", sub)
+        event = StripeEvent.objects.get()
+        # another worker is applying it
+        StripeEvent.objects.filter(id=event.id).update(claimed_at=timezone.now())
+        self.assertEqual(subs_events.process_pending_events(), 0)
+        self.assertFalse(subs_events._claim(event.id, timezone.now()))
+
+        # that worker died; its claim expires
+        StripeEvent.objects.filter(id=event.id).update(
+            claimed_at=timezone.now() - subs_events.CLAIM_TIMEOUT - datetime.timedelta(seconds=1)
+        )
+        self.assertEqual(subs_events.process_pending_events(), 1)
+        event.refresh_from_db()
+        self.assertIsNotNone(event.processed)
+        self.assertIsNone(event.claimed_at)
+        self.assertEqual(event.attempts, 1)
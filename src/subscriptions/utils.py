@@ -1,12 +1,97 @@
+import asyncio
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
 import helpers.billing
+import helpers.cache
 
+from asgiref.sync import sync_to_async
 from django.db.models import Q
+from django.utils import timezone
 from customers.models import Customer
-from subscriptions.models import Subscription, UserSubscription, SubscriptionStatus
+from helpers import billing_async
+from helpers.rate_limit import TokenBucket
+from subscriptions.models import (
+    PRICE_PLAN_MAP_CACHE_KEY,
+    CheckoutSession,
+    Subscription,
+    SubscriptionPrice,
+    SubscriptionStatus,
+    UserSubscription,
+)
 
+logger = logging.getLogger(__name__)
 
-def refresh_active_users_subscriptions(
-        user_ids=None, 
+DANGLING_SUB_MIN_AGE = 60 * 60
+
+
+def _price_plan_map():
+    return dict(
+        SubscriptionPrice.objects.filter(stripe_id__isnull=False).values_list("stripe_id", "subscription_id")
+    )
+
+
+def get_subscription_for_price(price_stripe_id):
+    """
+    The plan a Stripe price belongs to, found through a cached
+    price -> plan id map (invalidated when a SubscriptionPrice changes).
+    """
+    plan_id = helpers.cache.cached_value(PRICE_PLAN_MAP_CACHE_KEY, _price_plan_map, ttl=3600, stale_ttl=3600).get(price_stripe_id)
+    if plan_id is None:
+        return Subscription.objects.filter(subscriptionprice__stripe_id=price_stripe_id).first()
+    return Subscription.objects.filter(id=plan_id).first()
+
+
+def get_processed_checkout(session_id):
+    return CheckoutSession.objects.filter(stripe_id=session_id).first()
+
+
+def record_checkout(session_id, user_sub_obj):
+    CheckoutSession.objects.get_or_create(
+        stripe_id=session_id,
+        defaults={"user": user_sub_obj.user, "user_subscription": user_sub_obj}
+    )
+
+
+def activate_user_subscription(user, subscription, sub_stripe_id, subscription_data):
+    """
+    Point the user's UserSubscription at a (new) Stripe subscription,
+    cancelling the one it replaces. Repeating it for the same Stripe
+    subscription only re-applies `subscription_data`.
+    """
+    updated_sub_options = {
+        "subscription": subscription,
+        "stripe_id": sub_stripe_id,
+        "user_cancelled": False,
+        **subscription_data,
+    }
+    user_sub_obj, created = UserSubscription.objects.get_or_create(
+        user=user,
+        defaults=updated_sub_options
+    )
+    if created:
+        return user_sub_obj, created
+    old_stripe_id = user_sub_obj.stripe_id
+    if old_stripe_id is not None and old_stripe_id != sub_stripe_id:
+        try:
+            helpers.billing.cancel_subscription(
+                old_stripe_id,
+                reason="Auto ended, new membership",
+                feedback="other"
+            )
+            logger.info(f"Cancelled old subscription: {old_stripe_id}")
+        except Exception as e:
+            # Don't fail the entire process if old subscription cancellation fails
+            logger.warning(f"Failed to cancel old subscription {old_stripe_id}: {str(e)}")
+    for k, v in updated_sub_options.items():
+        setattr(user_sub_obj, k, v)
+    user_sub_obj.save()
+    return user_sub_obj, created
+
+
+def get_refresh_queryset(
+        user_ids=None,
         active_only=True,
         days_left=-1,
         days_ago=-1,
@@ -24,19 +109,194 @@ def refresh_active_users_subscriptions(
         qs = qs.by_days_left(days_left=days_left)
     if day_start > -1 and day_end > -1:
         qs = qs.by_range(days_start=day_start, days_end=day_end, verbose=verbose)
+    return qs
+
+
+def _fetch_subscription(stripe_id, limiter=None):
+    # fresh snapshots only: what is read here is saved to UserSubscription
+    return helpers.billing.call_rate_limited(
+        lambda: helpers.billing.get_subscription_snapshot(stripe_id, allow_stale=False),
+        limiter=limiter
+    )
+
+
+def refresh_active_users_subscriptions(
+        user_ids=None, 
+        active_only=True,
+        days_left=-1,
+        days_ago=-1,
+        day_start=-1,
+        day_end=-1,
+        concurrency=1,
+        rps=None,
+        verbose=False):
+    qs = get_refresh_queryset(
+        user_ids=user_ids,
+        active_only=active_only,
+        days_left=days_left,
+        days_ago=days_ago,
+        day_start=day_start,
+        day_end=day_end,
+        verbose=verbose
+    )
+    if concurrency > 1:
+        return concurrent_refresh_users_subscriptions(qs, concurrency=concurrency, rps=rps, verbose=verbose)
     complete_count = 0
     qs_count = qs.count()
     for obj in qs:
         if verbose:
             print("Updating user", obj.user, obj.subscription, obj.current_period_end)
         if obj.stripe_id:
-            sub_data = helpers.billing.get_subscription(obj.stripe_id, raw=False)
+            sub_data = _fetch_subscription(obj.stripe_id)
             for k,v in sub_data.items():
                 setattr(obj, k, v)
             obj.save()
             complete_count += 1
     return complete_count == qs_count
 
+
+def _apply_subscription_data(obj, sub_data, verbose=False):
+    """
+    Set the fields of `sub_data` that differ on `obj`; returns their names.
+    """
+    # None periods are left to UserSubscription.save()'s fallbacks
+    diff = {k: v for k, v in sub_data.items() if v is not None and getattr(obj, k) != v}
+    if diff and verbose:
+        print("Updating user", obj.user_id, obj.stripe_id, diff)
+    for k, v in diff.items():
+        setattr(obj, k, v)
+    return set(diff)
+
+
+def _write_changed(changed, fields):
+    if not changed:
+        return
+    now = timezone.now()
+    for obj in changed:
+        obj.updated = now
+    UserSubscription.objects.bulk_update(changed, [*fields, "updated"], batch_size=500)
+    for obj in changed:
+        helpers.billing.invalidate_subscription(obj.stripe_id)
+
+
+def bulk_refresh_users_subscriptions(qs, verbose=False):
+    """
+    Refresh `qs` from a listing of every subscription on the Stripe
+    account (100 per call) instead of one retrieve per row, writing back
+    only rows that changed. Rows missing from the listing are retrieved
+    one by one.
+    """
+    stats = {"list_calls": 0, "retrieve_calls": 0, "listed": 0, "checked": 0, "changed": 0}
+    remote = {}
+    for page in helpers.billing.iter_subscription_pages():
+        stats["list_calls"] += 1
+        for sub in page:
+            remote[sub.id] = helpers.billing.serialize_subscription_data(sub)
+    stats["listed"] = len(remote)
+    changed = []
+    fields = set()
+    for obj in qs.exclude(stripe_id__isnull=True).exclude(stripe_id=""):
+        stats["checked"] += 1
+        sub_data = remote.get(obj.stripe_id)
+        if sub_data is None:
+            stats["retrieve_calls"] += 1
+            sub_data = _fetch_subscription(obj.stripe_id)
+        obj_fields = _apply_subscription_data(obj, sub_data, verbose=verbose)
+        if obj_fields:
+            fields |= obj_fields
+            changed.append(obj)
+    _write_changed(changed, fields)
+    stats["changed"] = len(changed)
+    return stats
+
+
+def concurrent_refresh_users_subscriptions(qs, concurrency=8, rps=None, batch_size=100, verbose=False):
+    """
+    Retrieve the subscriptions of `qs` from `concurrency` threads sharing
+    one token bucket of `rps` calls per second (STRIPE_MAX_RPS by default).
+    The threads only call Stripe; changed rows are written from this
+    thread, `batch_size` at a time. Returns True if every row refreshed.
+    """
+    limiter = TokenBucket(rps or helpers.billing.STRIPE_MAX_RPS)
+    objs = {}
+    for obj in qs.exclude(stripe_id__isnull=True).exclude(stripe_id=""):
+        objs.setdefault(obj.stripe_id, []).append(obj)
+    qs_count = qs.count()
+
+    def fetch(stripe_id):
+        return _fetch_subscription(stripe_id, limiter=limiter)
+
+    complete_count = 0
+    changed = []
+    fields = set()
+    with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="sync-subs") as executor:
+        futures = {executor.submit(fetch, stripe_id): stripe_id for stripe_id in objs}
+        for future in as_completed(futures):
+            stripe_id = futures[future]
+            try:
+                sub_data = future.result()
+            except Exception:
+                logger.warning("Failed to refresh subscription %s", stripe_id, exc_info=True)
+                continue
+            for obj in objs[stripe_id]:
+                complete_count += 1
+                obj_fields = _apply_subscription_data(obj, sub_data, verbose=verbose)
+                if obj_fields:
+                    fields |= obj_fields
+                    changed.append(obj)
+            if len(changed) >= batch_size:
+                _write_changed(changed, fields)
+                changed, fields = [], set()
+    _write_changed(changed, fields)
+    return complete_count == qs_count
+
+
+async def arefresh_users_subscriptions(qs, concurrency=10, rps=None, batch_size=100, verbose=False):
+    """
+    concurrent_refresh_users_subscriptions on one event loop: up to
+    `concurrency` retrieves in flight through helpers.billing_async,
+    throttled by a token bucket of `rps` calls per second. Run it with
+    async_to_sync so the ORM work stays on the calling thread.
+    """
+    limiter = TokenBucket(rps or helpers.billing.STRIPE_MAX_RPS)
+    semaphore = asyncio.Semaphore(concurrency)
+    objs = {}
+    async for obj in qs.exclude(stripe_id__isnull=True).exclude(stripe_id=""):
+        objs.setdefault(obj.stripe_id, []).append(obj)
+    qs_count = await qs.acount()
+
+    async def fetch(stripe_id):
+        async with semaphore:
+            try:
+                return stripe_id, await billing_async.acall_rate_limited(
+                    lambda: billing_async.aget_subscription(stripe_id, raw=False),
+                    limiter=limiter
+                )
+            except Exception as e:
+                return stripe_id, e
+
+    write_changed = sync_to_async(_write_changed)
+    complete_count = 0
+    changed = []
+    fields = set()
+    for next_result in asyncio.as_completed([fetch(stripe_id) for stripe_id in objs]):
+        stripe_id, sub_data = await next_result
+        if isinstance(sub_data, Exception):
+            logger.warning("Failed to refresh subscription %s", stripe_id, exc_info=sub_data)
+            continue
+        for obj in objs[stripe_id]:
+            complete_count += 1
+            obj_fields = _apply_subscription_data(obj, sub_data, verbose=verbose)
+            if obj_fields:
+                fields |= obj_fields
+                changed.append(obj)
+        if len(changed) >= batch_size:
+            await write_changed(changed, fields)
+            changed, fields = [], set()
+    await write_changed(changed, fields)
+    return complete_count == qs_count
+
+
 def clear_dangling_subs():
     qs = Customer.objects.filter(stripe_id__isnull=False)
     for customer_obj in qs:
@@ -51,6 +311,63 @@ def clear_dangling_subs():
             helpers.billing.cancel_subscription(sub.id, reason="Dangling active subscription", cancel_at_period_end=False)
             # print(sub.id, existing_user_subs_qs.exists())
 
+
+def sweep_dangling_subs(dry_run=False, concurrency=8, rps=None, verbose=False):
+    """
+    clear_dangling_subs in one pass over the account: list every active
+    subscription (100 per call), keep those of our customers, and cancel
+    the ones no UserSubscription points at, from `concurrency` threads
+    sharing a token bucket of `rps` calls per second. Subscriptions created
+    in the last DANGLING_SUB_MIN_AGE seconds are left alone.
+    """
+    # clear_dangling_subs matches case-insensitively and ignores whitespace
+    def normalize(stripe_id):
+        return stripe_id.strip().lower()
+
+    # a subscription younger than this may belong to a checkout still being finalized
+    created_before = int(time.time()) - DANGLING_SUB_MIN_AGE
+    customer_ids = set(Customer.objects.filter(stripe_id__isnull=False).values_list("stripe_id", flat=True))
+    stats = {"list_calls": 0, "listed": 0, "dangling": 0, "canceled": 0, "failed": 0}
+    candidates = []
+    for page in helpers.billing.iter_subscription_pages(status="active", created={"lt": created_before}):
+        stats["list_calls"] += 1
+        stats["listed"] += len(page)
+        candidates += [sub.id for sub in page if sub.customer in customer_ids]
+    # read after the listing, so rows written while it ran are seen
+    local_ids = {
+        normalize(stripe_id) for stripe_id in
+        UserSubscription.objects.filter(stripe_id__isnull=False).values_list("stripe_id", flat=True)
+    }
+    dangling = [stripe_id for stripe_id in candidates if normalize(stripe_id) not in local_ids]
+    stats["dangling"] = len(dangling)
+    if verbose:
+        for stripe_id in dangling:
+            print(f"{'Would cancel' if dry_run else 'Cancel'} dangling subscription {stripe_id}")
+    if dry_run:
+        return stats
+
+    limiter = TokenBucket(rps or helpers.billing.STRIPE_MAX_RPS)
+
+    def cancel(stripe_id):
+        return helpers.billing.call_rate_limited(
+            lambda: helpers.billing.cancel_subscription(
+                stripe_id, reason="Dangling active subscription", cancel_at_period_end=False
+            ),
+            limiter=limiter
+        )
+
+    with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="sweep-subs") as executor:
+        futures = {executor.submit(cancel, stripe_id): stripe_id for stripe_id in dangling}
+        for future in as_completed(futures):
+            try:
+                future.result()
+            except Exception:
+                logger.warning("Failed to cancel dangling subscription %s", futures[future], exc_info=True)
+                stats["failed"] += 1
+            else:
+                stats["canceled"] += 1
+    return stats
+
 def sync_subs_group_permissions():
     qs = Subscription.objects.filter(active=True)
     for obj in qs:
@@ -1,10 +1,19 @@
+import json
+
 import helpers.billing
+import stripe
+from django.conf import settings
 from django.contrib import messages
 from django.contrib.auth.decorators import login_required
+from django.db import transaction
+from django.http import HttpResponse, HttpResponseBadRequest
 from django.shortcuts import render, redirect
 from django.urls import reverse
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_POST
 
 from subscriptions.models import SubscriptionPrice, UserSubscription
+from subscriptions import events as subs_events
 from subscriptions import utils as subs_utils
 
 @login_required
@@ -59,4 +68,23 @@ def subscription_price_view(request, interval="month"):
         "mo_url": mo_url,
         "yr_url": yr_url,
         "active": active,
-    })
\ No newline at end of file
+    })
+
+
+@csrf_exempt
+@require_POST
+def stripe_webhook_view(request):
+    """
+    Verify and store the event, then acknowledge right away; the event is
+    applied by subscriptions.events outside of the request.
+    """
+    try:
+        helpers.billing.construct_webhook_event(request.body, request.headers.get("Stripe-Signature", ""))
+    except (ValueError, stripe.SignatureVerificationError):
+        return HttpResponseBadRequest()
+    event = json.loads(request.body)
+    if event["type"] in subs_events.HANDLED_EVENTS:
+        _obj, created = subs_events.record_event(event)
+        if created and settings.STRIPE_EVENTS_PROCESSING == "background":
+            transaction.on_commit(subs_events.wake_worker)
+    return HttpResponse(status=200)
@@ -0,0 +1,101 @@
+import atexit
+import logging
+import os
+import threading
+
+from django.db import close_old_connections
+
+logger = logging.getLogger(__name__)
+
+
+class VisitBuffer:
+    """
+    In-process write-behind buffer for page visits.
+
+    Views call `add()` and return right away. A daemon thread hands the
+    pending visits to `flush_fn` once `max_size` visits are queued or
+    `flush_interval` seconds have passed, whichever comes first. Anything
+    still pending is flushed when the worker process exits.
+    """
+
+    def __init__(self, flush_fn, max_size=100, flush_interval=5.0, max_pending=10_000):
+        self.flush_fn = flush_fn
+        self.max_size = max_size
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.dropped = 0
+        self._pending = []
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopped = threading.Event()
+        self._thread = None
+        self._pid = None
+        atexit.register(self.close)
+
+    def __len__(self):
+        return len(self._pending)
+
+    def add(self, visit):
+        self._ensure_started()
+        with self._lock:
+            if len(self._pending) >= self.max_pending:
+                # the flusher cannot keep up (e.g. the database is down);
+                # shed load instead of growing without bound
+                self.dropped += 1
+                return False
+            self._pending.append(visit)
+            size = len(self._pending)
+        if size >= self.max_size:
+            self._wakeup.set()
+        return True
+
+    def flush(self):
+        with self._flush_lock:
+            with self._lock:
+                batch, self._pending = self._pending, []
+            if not batch:
+                return 0
+            try:
+                self.flush_fn(batch)
+            except Exception:
+                logger.exception("Failed to flush %s page visits", len(batch))
+                with self._lock:
+                    room = max(self.max_pending - len(self._pending), 0)
+                    self.dropped += max(len(batch) - room, 0)
+                    self._pending[:0] = batch[:room]
+                return 0
+            return len(batch)
+
+    def close(self):
+        self._stopped.set()
+        self._wakeup.set()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join(timeout=self.flush_interval)
+        self.flush()
+
+    def _ensure_started(self):
+        pid = os.getpid()
+        if self._pid == pid:
+            return
+        with self._lock:
+            if self._pid == pid:
+                return
+            if self._pid is not None:
+                # forked worker: the parent owns whatever it had queued
+                self._pending = []
+            self._pid = pid
+            self._stopped.clear()
+            self._thread = threading.Thread(
+                target=self._run,
+                name="visits-flusher",
+                daemon=True
+            )
+            self._thread.start()
+
+    def _run(self):
+        while not self._stopped.is_set():
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            close_old_connections()
+            self.flush()
@@ -0,0 +1,181 @@
+import datetime
+import json
+import struct
+import sys
+import zlib
+from array import array
+
+from asgiref.sync import sync_to_async
+from django.utils import dateparse, timezone
+
+from visits import rollups as visits_rollups
+from visits.models import PageVisits
+
+MAGIC = b"PVC1"
+CHUNK_HEADER = struct.Struct("<II")  # compressed payload size, row count
+DICT_HEADER = struct.Struct("<I")  # size of the new dictionary entries
+EPOCH = datetime.datetime(1970, 1, 1, tzinfo=datetime.timezone.utc)
+
+
+def _to_micros(value):
+    return (value - EPOCH) // datetime.timedelta(microseconds=1)
+
+
+def _le_bytes(values):
+    if sys.byteorder == "big":
+        values = array(values.typecode, values)
+        values.byteswap()
+    return values.tobytes()
+
+
+def _from_le_bytes(typecode, data):
+    values = array(typecode)
+    values.frombytes(data)
+    if sys.byteorder == "big":
+        values.byteswap()
+    return values
+
+
+def parse_since(value):
+    """
+    Parse an export's start (an ISO date or datetime) and check it is
+    inside the raw retention window: prune_raw deletes older rows once
+    they are rolled up, so an export from before it would silently miss
+    visits. Raises ValueError.
+    """
+    since = dateparse.parse_datetime(value)
+    if since is None:
+        day = dateparse.parse_date(value)
+        if day is None:
+            raise ValueError(f"Invalid date: {value}")
+        since = datetime.datetime.combine(day, datetime.time())
+    if timezone.is_naive(since):
+        since = timezone.make_aware(since)
+    cutoff = visits_rollups.raw_retention_cutoff()
+    if since < cutoff:
+        raise ValueError(
+            f"Raw visits before {cutoff:%Y-%m-%d %H:%M} are pruned; use the rollups for older ranges"
+        )
+    return since
+
+
+def iter_visit_rows(chunk_size=10_000, start_after=0, since=None):
+    """
+    Yield lists of (id, path, timestamp) using keyset pagination on id,
+    so only one chunk is ever held in memory.
+    """
+    qs = PageVisits.objects.all()
+    if since is not None:
+        qs = qs.filter(timestamp__gte=since)
+    last_id = start_after
+    while True:
+        rows = list(
+            qs.filter(id__gt=last_id).order_by("id").values_list("id", "path", "timestamp")[:chunk_size]
+        )
+        if not rows:
+            return
+        yield rows
+        last_id = rows[-1][0]
+
+
+def encode_chunk(rows, dictionary):
+    """
+    One chunk: paths as indexes into a dictionary shared by the whole file
+    (only new entries are written), ids and timestamps as deltas, all
+    zlib-compressed.
+    """
+    new_paths = []
+    ids = array("q")
+    timestamps = array("q")
+    path_indexes = array("I")
+    prev_id = 0
+    prev_ts = 0
+    for row_id, path, timestamp in rows:
+        index = dictionary.get(path)
+        if index is None:
+            index = len(dictionary)
+            dictionary[path] = index
+            new_paths.append(path)
+        micros = _to_micros(timestamp)
+        ids.append(row_id - prev_id)
+        timestamps.append(micros - prev_ts)
+        path_indexes.append(index)
+        prev_id = row_id
+        prev_ts = micros
+    dict_bytes = json.dumps(new_paths).encode("utf-8")
+    payload = b"".join([
+        DICT_HEADER.pack(len(dict_bytes)),
+        dict_bytes,
+        _le_bytes(ids),
+        _le_bytes(timestamps),
+        _le_bytes(path_indexes),
+    ])
+    compressed = zlib.compress(payload)
+    return CHUNK_HEADER.pack(len(compressed), len(rows)) + compressed
+
+
+def iter_export(chunk_size=10_000, since=None):
+    """
+    Stream the raw PageVisits rows (from `since`, see parse_since) as bytes
+    in the columnar format. Only the raw retention window is complete;
+    older visits survive as rollups only.
+    """
+    yield MAGIC
+    dictionary = {}
+    for rows in iter_visit_rows(chunk_size=chunk_size, since=since):
+        yield encode_chunk(rows, dictionary)
+
+
+async def aiter_export(chunk_size=10_000, since=None):
+    """
+    iter_export as an async iterator for ASGI, which would otherwise read a
+    sync iterator into memory whole; each chunk is encoded in a worker thread.
+    """
+    chunks = iter_export(chunk_size=chunk_size, since=since)
+    next_chunk = sync_to_async(next)
+    while True:
+        data = await next_chunk(chunks, None)
+        if data is None:
+            return
+        yield data
+
+
+def _read_exact(fileobj, size):
+    data = fileobj.read(size)
+    if len(data) != size:
+        raise ValueError("truncated visits export")
+    return data
+
+
+def read_export(fileobj):
+    """
+    Yield lists of (id, path, timestamp) per chunk from a columnar export.
+    """
+    if fileobj.read(len(MAGIC)) != MAGIC:
+        raise ValueError("not a visits export file")
+    dictionary = []
+    while True:
+        header = fileobj.read(CHUNK_HEADER.size)
+        if not header:
+            return
+        if len(header) != CHUNK_HEADER.size:
+            raise ValueError("truncated visits export")
+        size, count = CHUNK_HEADER.unpack(header)
+        payload = zlib.decompress(_read_exact(fileobj, size))
+        (dict_size,) = DICT_HEADER.unpack_from(payload)
+        offset = DICT_HEADER.size
+        dictionary.extend(json.loads(payload[offset:offset + dict_size]))
+        offset += dict_size
+        ids = _from_le_bytes("q", payload[offset:offset + 8 * count])
+        offset += 8 * count
+        timestamps = _from_le_bytes("q", payload[offset:offset + 8 * count])
+        offset += 8 * count
+        path_indexes = _from_le_bytes("I", payload[offset:offset + 4 * count])
+        rows = []
+        row_id = 0
+        micros = 0
+        for id_delta, ts_delta, index in zip(ids, timestamps, path_indexes):
+            row_id += id_delta
+            micros += ts_delta
+            rows.append((row_id, dictionary[index], EPOCH + datetime.timedelta(microseconds=micros)))
+        yield rows
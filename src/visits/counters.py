@@ -0,0 +1,104 @@
+from collections import Counter
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, F, Sum
+
+from helpers.cache import cached_value
+from visits.models import PageVisits, RollupWatermark, VisitCounter, VisitRollup
+from visits.rollups import RAW_WATERMARK
+
+# paths always start with "/", so this can never clash with a real page
+TOTAL_KEY = "*"
+# bot hits are tallied apart from real visits, e.g. "bot:/about/" and "bot:*"
+BOT_PREFIX = "bot:"
+BOT_TOTAL_KEY = f"{BOT_PREFIX}{TOTAL_KEY}"
+
+
+def apply_counts(counts):
+    """
+    Add {path: n} deltas to the counters table, creating missing rows.
+    """
+    with transaction.atomic():
+        for path, n in counts.items():
+            updated = VisitCounter.objects.filter(path=path).update(count=F("count") + n)
+            if updated:
+                continue
+            _obj, created = VisitCounter.objects.get_or_create(path=path, defaults={"count": n})
+            if not created:
+                # another worker created the row in the meantime
+                VisitCounter.objects.filter(path=path).update(count=F("count") + n)
+
+
+def increment_counters(visits):
+    counts = Counter(v.path for v in visits)
+    counts[TOTAL_KEY] = len(visits)
+    apply_counts(counts)
+
+
+def increment_bot_counters(visits):
+    counts = Counter(f"{BOT_PREFIX}{v.path}" for v in visits)
+    counts[BOT_TOTAL_KEY] = len(visits)
+    apply_counts(counts)
+
+
+def get_visit_stats(path=None):
+    """
+    Total, per-path and percentage figures from at most two counter rows.
+    """
+    keys = [TOTAL_KEY]
+    if path is not None:
+        keys.append(path)
+    counts = dict(VisitCounter.objects.filter(path__in=keys).values_list("path", "count"))
+    total = counts.get(TOTAL_KEY, 0)
+    path_count = counts.get(path, 0)
+    percent = (path_count / total) * 100 if total else 0
+    return {
+        "total": total,
+        "path_count": path_count,
+        "percent": percent,
+    }
+
+
+def get_total_visits():
+    return get_visit_stats()["total"]
+
+
+def get_cached_visit_stats(path=None):
+    """
+    get_visit_stats() through the shared cache, for pages rendered on every hit.
+    """
+    return cached_value(
+        f"visits:stats:{path or TOTAL_KEY}",
+        lambda: get_visit_stats(path),
+        ttl=settings.VISITS_COUNTER_CACHE_TTL,
+        stale_ttl=settings.VISITS_COUNTER_CACHE_STALE_TTL,
+    )
+
+
+def get_cached_total_visits():
+    return get_cached_visit_stats()["total"]
+
+
+def rebuild_counters():
+    """
+    Recompute every counter from the minute rollups plus the raw
+    PageVisits rows that have not been rolled up (or pruned) yet. Bot
+    tallies have no raw rows to rebuild from and are kept as they are.
+    """
+    last_id = RollupWatermark.objects.filter(name=RAW_WATERMARK).values_list("last_id", flat=True).first() or 0
+    totals = Counter()
+    rolled_qs = VisitRollup.objects.filter(
+        granularity=VisitRollup.GranularityChoices.MINUTE
+    ).values("path").annotate(total=Sum("count")).order_by()
+    raw_qs = PageVisits.objects.filter(id__gt=last_id).values("path").annotate(total=Count("id")).order_by()
+    for row in rolled_qs:
+        totals[row["path"]] += row["total"]
+    for row in raw_qs:
+        totals[row["path"]] += row["total"]
+    counters = [VisitCounter(path=path, count=n) for path, n in totals.items()]
+    counters.append(VisitCounter(path=TOTAL_KEY, count=sum(c.count for c in counters)))
+    with transaction.atomic():
+        VisitCounter.objects.exclude(path__startswith=BOT_PREFIX).delete()
+        VisitCounter.objects.bulk_create(counters, batch_size=1_000)
+    return len(counters) - 1
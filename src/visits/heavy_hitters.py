@@ -0,0 +1,211 @@
+import atexit
+import datetime
+import logging
+import os
+import threading
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.utils import timezone
+
+from visits.models import HeavyHittersCheckpoint
+
+logger = logging.getLogger(__name__)
+
+WINDOWS = {
+    "hour": datetime.timedelta(hours=1),
+    "day": datetime.timedelta(days=1),
+}
+
+
+class SpaceSaving:
+    """
+    Space-Saving heavy-hitters summary holding at most `capacity` keys.
+
+    Each entry is key -> [count, error]; the true count lies within
+    [count - error, count]. Summaries merge by adding counts and keeping
+    the `capacity` largest.
+    """
+
+    def __init__(self, capacity=100, counters=None):
+        self.capacity = capacity
+        self.counters = {key: list(value) for key, value in (counters or {}).items()}
+
+    def offer(self, key, n=1):
+        entry = self.counters.get(key)
+        if entry is not None:
+            entry[0] += n
+            return
+        if len(self.counters) < self.capacity:
+            self.counters[key] = [n, 0]
+            return
+        min_key = min(self.counters, key=lambda k: self.counters[k][0])
+        min_count = self.counters.pop(min_key)[0]
+        self.counters[key] = [min_count + n, min_count]
+
+    def merge(self, other):
+        for key, (count, error) in other.counters.items():
+            entry = self.counters.setdefault(key, [0, 0])
+            entry[0] += count
+            entry[1] += error
+        if len(self.counters) > self.capacity:
+            keep = sorted(self.counters.items(), key=lambda item: item[1][0], reverse=True)
+            self.counters = dict(keep[:self.capacity])
+        return self
+
+    def top(self, n=10):
+        items = sorted(self.counters.items(), key=lambda item: item[1][0], reverse=True)
+        return [(key, count) for key, (count, _error) in items[:n]]
+
+
+def bucket_for(value):
+    minutes = settings.VISITS_HEAVY_HITTERS_BUCKET_MINUTES
+    value = value.replace(second=0, microsecond=0)
+    return value.replace(minute=value.minute - value.minute % minutes)
+
+
+def summarize(visits, capacity):
+    summaries = {}
+    for v in visits:
+        bucket = bucket_for(v.timestamp)
+        if bucket not in summaries:
+            summaries[bucket] = SpaceSaving(capacity)
+        summaries[bucket].offer(v.path)
+    return summaries
+
+
+def checkpoint(summaries):
+    """
+    Merge {bucket_start: SpaceSaving} into the per-bucket checkpoints.
+    """
+    capacity = settings.VISITS_HEAVY_HITTERS_CAPACITY
+    with transaction.atomic():
+        for bucket, summary in summaries.items():
+            obj, created = HeavyHittersCheckpoint.objects.select_for_update().get_or_create(
+                bucket_start=bucket,
+                defaults={"counters": summary.counters}
+            )
+            if created:
+                continue
+            obj.counters = summary.merge(SpaceSaving(capacity, obj.counters)).counters
+            obj.save(update_fields=["counters", "updated"])
+
+
+class HeavyHittersTracker:
+    """
+    This process's Space-Saving summaries per bucket. Visits are only
+    offered in memory; a daemon thread merges the summaries into the
+    shared checkpoints every `interval` seconds (and at exit), so workers
+    touch the hot checkpoint row once per interval, not once per flush.
+    """
+
+    def __init__(self, capacity=100, interval=30.0):
+        self.capacity = capacity
+        self.interval = interval
+        self._summaries = {}
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread = None
+        self._pid = None
+        atexit.register(self.close)
+
+    def offer(self, visits):
+        self._ensure_started()
+        with self._lock:
+            for bucket, summary in summarize(visits, self.capacity).items():
+                if bucket in self._summaries:
+                    self._summaries[bucket].merge(summary)
+                else:
+                    self._summaries[bucket] = summary
+
+    def flush(self):
+        with self._flush_lock:
+            with self._lock:
+                summaries, self._summaries = self._summaries, {}
+            if not summaries:
+                return 0
+            try:
+                checkpoint(summaries)
+            except Exception:
+                logger.exception("Failed to checkpoint heavy hitters")
+                # keep them for the next attempt
+                with self._lock:
+                    for bucket, summary in summaries.items():
+                        if bucket in self._summaries:
+                            summary.merge(self._summaries[bucket])
+                        self._summaries[bucket] = summary
+                return 0
+            return len(summaries)
+
+    def close(self):
+        self._stopped.set()
+        self.flush()
+
+    def _ensure_started(self):
+        pid = os.getpid()
+        if self._pid == pid:
+            return
+        with self._lock:
+            if self._pid == pid:
+                return
+            if self._pid is not None:
+                # forked worker: the parent checkpoints what it tracked
+                self._summaries = {}
+            self._pid = pid
+            self._stopped.clear()
+            self._thread = threading.Thread(target=self._run, name="heavy-hitters", daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            close_old_connections()
+            self.flush()
+
+
+_tracker = None
+_tracker_lock = threading.Lock()
+
+
+def get_tracker():
+    global _tracker
+    if _tracker is None:
+        with _tracker_lock:
+            if _tracker is None:
+                _tracker = HeavyHittersTracker(
+                    capacity=settings.VISITS_HEAVY_HITTERS_CAPACITY,
+                    interval=settings.VISITS_HEAVY_HITTERS_CHECKPOINT_INTERVAL,
+                )
+    return _tracker
+
+
+def track(visits):
+    get_tracker().offer(visits)
+
+
+def flush_tracker():
+    if _tracker is None:
+        return 0
+    return _tracker.flush()
+
+
+def top_paths(n=10, window="hour", now=None):
+    """
+    Approximate top-N paths over the last hour or day, as of the last
+    checkpoint of each worker. Cost depends on the number of buckets and
+    the summary capacity, not on visit volume.
+    """
+    now = now or timezone.now()
+    since = bucket_for(now - WINDOWS[window])
+    summary = SpaceSaving(settings.VISITS_HEAVY_HITTERS_CAPACITY)
+    qs = HeavyHittersCheckpoint.objects.filter(bucket_start__gte=since)
+    for counters in qs.values_list("counters", flat=True):
+        summary.merge(SpaceSaving(summary.capacity, counters))
+    return summary.top(n)
+
+
+def prune_checkpoints(now=None):
+    now = now or timezone.now()
+    cutoff = now - max(WINDOWS.values()) - datetime.timedelta(hours=1)
+    deleted, _ = HeavyHittersCheckpoint.objects.filter(bucket_start__lt=cutoff).delete()
+    return deleted
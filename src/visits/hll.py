@@ -0,0 +1,72 @@
+import hashlib
+import math
+import zlib
+
+DEFAULT_PRECISION = 12  # 4096 registers, ~1.6% standard error
+
+
+def hash_value(value):
+    """
+    64-bit hash for HyperLogLog.add_hash().
+    """
+    if isinstance(value, str):
+        value = value.encode("utf-8")
+    return int.from_bytes(hashlib.blake2b(value, digest_size=8).digest(), "big")
+
+
+class HyperLogLog:
+    """
+    HyperLogLog cardinality sketch over 64-bit hashes.
+
+    Sketches with the same precision merge by taking the register-wise
+    maximum, so per-worker and per-day sketches can be combined freely.
+    """
+
+    def __init__(self, precision=DEFAULT_PRECISION, registers=None):
+        if not 4 <= precision <= 18:
+            raise ValueError("precision must be between 4 and 18")
+        self.precision = precision
+        self.m = 1 << precision
+        if registers is None:
+            registers = bytearray(self.m)
+        elif len(registers) != self.m:
+            raise ValueError("register count does not match precision")
+        self.registers = bytearray(registers)
+
+    def add_hash(self, x):
+        p = self.precision
+        index = x >> (64 - p)
+        rest = x & ((1 << (64 - p)) - 1)
+        rank = (64 - p) - rest.bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def add(self, value):
+        self.add_hash(hash_value(value))
+
+    def merge(self, other):
+        if other.precision != self.precision:
+            raise ValueError("cannot merge sketches with different precision")
+        self.registers = bytearray(map(max, self.registers, other.registers))
+        return self
+
+    def count(self):
+        m = self.m
+        if m >= 128:
+            alpha = 0.7213 / (1 + 1.079 / m)
+        else:
+            alpha = {16: 0.673, 32: 0.697, 64: 0.709}[m]
+        estimate = alpha * m * m / sum(2.0 ** -r for r in self.registers)
+        zeros = self.registers.count(0)
+        if estimate <= 2.5 * m and zeros:
+            # small range correction (linear counting)
+            estimate = m * math.log(m / zeros)
+        return int(round(estimate))
+
+    def to_bytes(self):
+        return bytes([self.precision]) + zlib.compress(bytes(self.registers))
+
+    @classmethod
+    def from_bytes(cls, data):
+        data = bytes(data)
+        return cls(precision=data[0], registers=zlib.decompress(data[1:]))
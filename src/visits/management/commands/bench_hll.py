@@ -0,0 +1,50 @@
+import random
+import sys
+import time
+from typing import Any
+
+from django.core.management.base import BaseCommand
+
+from visits.hll import HyperLogLog, hash_value
+
+
+class Command(BaseCommand):
+    help = "Compare HyperLogLog unique counts against an exact set on synthetic visits"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--uniques", default="100,10000,1000000")
+        parser.add_argument("--repeat", default=3, type=int, help="average visits per visitor")
+        parser.add_argument("--precision", default="10,12,14")
+        parser.add_argument("--seed", default=42, type=int)
+
+    def handle(self, *args: Any, **options: Any):
+        # python manage.py bench_hll --uniques 1000,100000 --precision 12
+        rng = random.Random(options.get("seed"))
+        precisions = [int(x) for x in options.get("precision").split(",")]
+        repeat = options.get("repeat")
+        for n in [int(x) for x in options.get("uniques").split(",")]:
+            visitors = [f"{rng.getrandbits(32)}|Mozilla/5.0 visitor {i}" for i in range(n)]
+            stream = [rng.choice(visitors) for _ in range(n * repeat)] + visitors
+            hashes = [hash_value(v) for v in stream]
+
+            start = time.perf_counter()
+            exact = set(hashes)
+            exact_ms = (time.perf_counter() - start) * 1000
+            exact_bytes = sys.getsizeof(exact) + sum(sys.getsizeof(h) for h in exact)
+            self.stdout.write(
+                f"{n:>9,} uniques / {len(stream):,} visits: exact set {len(exact):,} "
+                f"in {exact_ms:.1f} ms, ~{exact_bytes / 1024:,.0f} KiB"
+            )
+            for precision in precisions:
+                start = time.perf_counter()
+                sketch = HyperLogLog(precision)
+                for h in hashes:
+                    sketch.add_hash(h)
+                estimate = sketch.count()
+                hll_ms = (time.perf_counter() - start) * 1000
+                error = (estimate - len(exact)) / len(exact) * 100
+                self.stdout.write(
+                    f"    p={precision:<2} estimate {estimate:>9,} ({error:+.2f}%) "
+                    f"in {hll_ms:.1f} ms, {sketch.m / 1024:.0f} KiB in memory, "
+                    f"{len(sketch.to_bytes()):,} bytes stored"
+                )
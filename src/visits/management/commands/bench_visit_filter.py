@@ -0,0 +1,61 @@
+import random
+import re
+import string
+import time
+from typing import Any
+
+from django.core.management.base import BaseCommand
+
+from visits.filters import DEFAULT_BOT_USER_AGENTS, PatternMatcher
+
+SAMPLE_USER_AGENTS = [
+    "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/126.0.0.0 Safari/537.36",
+    "Mozilla/5.0 (iPhone; CPU iPhone OS 17_5 like Mac OS X) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/17.5 Mobile/15E148 Safari/604.1",
+    "Mozilla/5.0 (compatible; Googlebot/2.1; +http://www.google.com/bot.html)",
+    "curl/8.5.0",
+    "kube-probe/1.29",
+]
+
+
+class Command(BaseCommand):
+    help = "Measure per-request cost of the bot User-Agent matcher at thousands of patterns"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--patterns", default="30,1000,5000", help="comma separated pattern counts")
+        parser.add_argument("--iterations", default=20_000, type=int)
+        parser.add_argument("--regex-loop", action="store_true", default=False,
+                            help="also time a loop of per-pattern regexes (slow at large counts)")
+
+    def handle(self, *args: Any, **options: Any):
+        # python manage.py bench_visit_filter --patterns 1000,10000
+        rng = random.Random(42)
+        iterations = options.get("iterations")
+        agents = [rng.choice(SAMPLE_USER_AGENTS) for _ in range(iterations)]
+        for count in [int(x) for x in options.get("patterns").split(",")]:
+            patterns = list(DEFAULT_BOT_USER_AGENTS)
+            while len(patterns) < count:
+                patterns.append("".join(rng.choices(string.ascii_lowercase + "-/", k=rng.randint(5, 14))))
+
+            start = time.perf_counter()
+            matcher = PatternMatcher(patterns)
+            build_ms = (time.perf_counter() - start) * 1000
+            timings = {"aho-corasick": self._time(matcher.search, agents)}
+
+            alternation = re.compile("|".join(re.escape(p) for p in patterns))
+            timings["single regex"] = self._time(lambda ua: alternation.search(ua.lower()) is not None, agents)
+
+            if options.get("regex_loop"):
+                compiled = [re.compile(re.escape(p)) for p in patterns]
+                timings["regex loop"] = self._time(
+                    lambda ua: any(r.search(ua.lower()) for r in compiled), agents[:max(iterations // 20, 1)]
+                )
+
+            self.stdout.write(f"{count:>6,} patterns ({len(matcher.goto):,} automaton states, built in {build_ms:.0f} ms)")
+            for name, per_call in timings.items():
+                self.stdout.write(f"    {name:>13}: {per_call * 1_000_000:8.2f} µs/request")
+
+    def _time(self, fn, agents):
+        start = time.perf_counter()
+        for ua in agents:
+            fn(ua)
+        return (time.perf_counter() - start) / len(agents)
@@ -0,0 +1,87 @@
+import json
+import statistics
+import time
+from typing import Any
+
+from asgiref.sync import async_to_sync
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser
+from django.core.management.base import BaseCommand, CommandError
+from django.test import RequestFactory, override_settings
+
+from cfehome.views import about_view
+from visits import utils as visits_utils
+from visits.views import visit_beacon_view
+
+# a fixed route, so the beacon view accepts it. Unless --keep, every visit
+# to it is purged after the run: bench a scratch database.
+BENCH_PATH = "/about/"
+BENCH_HOST = "localhost"
+BENCH_USER_AGENT = "Mozilla/5.0 (X11; Linux x86_64) Firefox/128.0"
+
+
+def _percentile(timings, pct):
+    return statistics.quantiles(timings, n=100)[pct - 1] * 1000
+
+
+class Command(BaseCommand):
+    help = "Compare about page latency with inline visit tracking vs the async beacon endpoint"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--requests", default=2_000, type=int)
+        parser.add_argument("--write-behind", action="store_true", default=False,
+                            help="buffer visits in both modes (default writes them synchronously)")
+        parser.add_argument("--keep", action="store_true", default=False,
+                            help=f"keep the visits to {BENCH_PATH} instead of purging them")
+
+    def handle(self, *args: Any, **options: Any):
+        # python manage.py bench_visit_tracking --requests 5000
+        n = options.get("requests")
+        factory = RequestFactory()
+        beacon_body = json.dumps({"events": [{"path": BENCH_PATH}]})
+        beacon_view = async_to_sync(visit_beacon_view)
+
+        def page():
+            request = factory.get(BENCH_PATH, HTTP_HOST=BENCH_HOST, HTTP_USER_AGENT=BENCH_USER_AGENT)
+            request.user = AnonymousUser()
+            about_view(request)
+
+        def beacon():
+            request = factory.post(
+                "/v/", beacon_body, content_type="application/json", HTTP_HOST=BENCH_HOST,
+                HTTP_ORIGIN=f"http://{BENCH_HOST}", HTTP_USER_AGENT=BENCH_USER_AGENT
+            )
+            request.user = AnonymousUser()
+            return beacon_view(request)
+
+        def run(fn):
+            timings = []
+            for _ in range(n):
+                start = time.perf_counter()
+                fn()
+                timings.append(time.perf_counter() - start)
+            visits_utils.flush_visits()
+            return timings
+
+        results = {}
+        allowed_hosts = [*settings.ALLOWED_HOSTS, BENCH_HOST]
+        with override_settings(VISITS_WRITE_BEHIND=options.get("write_behind"), ALLOWED_HOSTS=allowed_hosts):
+            with override_settings(VISITS_TRACKING="inline"):
+                results["inline page"] = run(page)
+            with override_settings(VISITS_TRACKING="beacon"):
+                # a rejected beacon is cheap; don't time it
+                status = beacon().status_code
+                if status != 204:
+                    raise CommandError(f"beacon POST returned {status}, expected 204")
+                results["beacon page"] = run(page)
+                results["beacon POST"] = run(beacon)
+
+        for name, timings in results.items():
+            self.stdout.write(
+                f"{name:>12}: p50 {_percentile(timings, 50):.3f} ms, "
+                f"p99 {_percentile(timings, 99):.3f} ms, mean {statistics.fmean(timings) * 1000:.3f} ms"
+            )
+        if settings.VISITS_STORAGE != "db":
+            return
+        if not options.get("keep"):
+            visits_utils.purge_path(BENCH_PATH)
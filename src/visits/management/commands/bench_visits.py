@@ -0,0 +1,59 @@
+import time
+from typing import Any
+
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser
+from django.core.management.base import BaseCommand
+from django.test import RequestFactory, override_settings
+
+from cfehome.views import about_view
+from visits.models import PageVisits
+from visits import utils as visits_utils
+
+BENCH_PATH = "/__bench__/visits/"
+BENCH_USER_AGENT = "Mozilla/5.0 (X11; Linux x86_64) Firefox/128.0"
+
+
+class Command(BaseCommand):
+    help = "Compare requests/sec of the about page with inline vs write-behind visit recording"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--requests", default=2_000, type=int)
+        parser.add_argument("--keep", action="store_true", default=False)
+
+    def handle(self, *args: Any, **options: Any):
+        # python manage.py bench_visits --requests 5000
+        n = options.get("requests")
+        factory = RequestFactory()
+
+        def run():
+            start = time.perf_counter()
+            for _ in range(n):
+                request = factory.get(BENCH_PATH, HTTP_USER_AGENT=BENCH_USER_AGENT)
+                request.user = AnonymousUser()
+                about_view(request)
+            elapsed = time.perf_counter() - start
+            flush_start = time.perf_counter()
+            visits_utils.flush_visits()
+            flush_elapsed = time.perf_counter() - flush_start
+            return elapsed, flush_elapsed
+
+        results = {}
+        with override_settings(VISITS_WRITE_BEHIND=False):
+            results["inline"] = run()
+        with override_settings(VISITS_WRITE_BEHIND=True):
+            results["write-behind"] = run()
+
+        for name, (elapsed, flush_elapsed) in results.items():
+            self.stdout.write(
+                f"{name:>12}: {n / elapsed:,.0f} req/s "
+                f"({elapsed * 1000 / n:.3f} ms/req, final flush {flush_elapsed * 1000:.1f} ms)"
+            )
+        if settings.VISITS_STORAGE != "db":
+            self.stdout.write(f"Visits went to {settings.VISITS_SEGMENT_DIR}, run replay_visit_segments to load them")
+            return
+        recorded = PageVisits.objects.filter(path=BENCH_PATH).count()
+        if recorded != n * len(results):
+            self.stdout.write(self.style.WARNING(f"Expected {n * len(results)} visits, found {recorded}"))
+        if not options.get("keep"):
+            visits_utils.purge_path(BENCH_PATH)
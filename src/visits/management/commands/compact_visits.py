@@ -0,0 +1,20 @@
+from typing import Any
+from django.core.management.base import BaseCommand
+
+from visits import rollups as visits_rollups
+
+class Command(BaseCommand):
+    help = "Fold raw page visits into minute/hour/day rollups and prune rolled-up raw rows"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--no-prune", action="store_true", default=False)
+
+    def handle(self, *args: Any, **options: Any):
+        # python manage.py compact_visits
+        results = visits_rollups.compact(prune=not options.get("no_prune"))
+        self.stdout.write(
+            self.style.SUCCESS(
+                "Folded {minute} visits into minutes, {hour} into hours, {day} into days; "
+                "pruned {pruned} raw rows".format(**results)
+            )
+        )
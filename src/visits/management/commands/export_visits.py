@@ -0,0 +1,32 @@
+from typing import Any
+
+from django.core.management.base import BaseCommand, CommandError
+
+from visits import columnar as visits_columnar
+
+
+class Command(BaseCommand):
+    help = (
+        "Stream raw PageVisits rows into a compressed columnar export file. Raw rows "
+        "are pruned after VISITS_RAW_RETENTION_DAYS; older visits exist only as rollups."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("out_path")
+        parser.add_argument("--chunk-size", default=10_000, type=int)
+        parser.add_argument("--since", help="ISO date or datetime inside the raw retention window")
+
+    def handle(self, *args: Any, **options: Any):
+        # python manage.py export_visits visits.pvc --since 2024-06-01
+        since = None
+        if options.get("since"):
+            try:
+                since = visits_columnar.parse_since(options.get("since"))
+            except ValueError as e:
+                raise CommandError(str(e))
+        size = 0
+        with open(options.get("out_path"), "wb") as f:
+            for data in visits_columnar.iter_export(chunk_size=options.get("chunk_size"), since=since):
+                f.write(data)
+                size += len(data)
+        self.stdout.write(self.style.SUCCESS(f"Wrote {size:,} bytes to {options.get('out_path')}"))
@@ -0,0 +1,25 @@
+from typing import Any
+
+from django.core.management.base import BaseCommand
+
+from visits import columnar as visits_columnar
+from visits import utils as visits_utils
+
+
+class Command(BaseCommand):
+    help = "Re-import a columnar visits export written by export_visits"
+
+    def add_arguments(self, parser):
+        parser.add_argument("in_path")
+
+    def handle(self, *args: Any, **options: Any):
+        # python manage.py import_visits visits.pvc
+        total = 0
+        with open(options.get("in_path"), "rb") as f:
+            for rows in visits_columnar.read_export(f):
+                visits_utils.write_visits([
+                    visits_utils.Visit(path=path, timestamp=timestamp)
+                    for _id, path, timestamp in rows
+                ])
+                total += len(rows)
+        self.stdout.write(self.style.SUCCESS(f"Imported {total} visits"))
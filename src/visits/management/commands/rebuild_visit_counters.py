@@ -0,0 +1,14 @@
+from typing import Any
+from django.core.management.base import BaseCommand
+
+from visits import counters as visits_counters
+
+class Command(BaseCommand):
+    help = "Rebuild the per-path visit counters from the raw PageVisits rows"
+
+    def handle(self, *args: Any, **options: Any):
+        paths = visits_counters.rebuild_counters()
+        total = visits_counters.get_total_visits()
+        self.stdout.write(
+            self.style.SUCCESS(f"Rebuilt counters for {paths} paths ({total} visits)")
+        )
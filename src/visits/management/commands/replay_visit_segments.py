@@ -0,0 +1,44 @@
+from itertools import islice
+from typing import Any
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from visits import segments as visits_segments
+from visits import utils as visits_utils
+from visits.models import ReplayedSegment
+
+
+class Command(BaseCommand):
+    help = "Bulk-load closed visit segment files into PageVisits or straight into the rollups"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--target", default="raw", choices=["raw", "rollups"])
+        parser.add_argument("--batch-size", default=5_000, type=int)
+        parser.add_argument("--dir", default=None)
+
+    def handle(self, *args: Any, **options: Any):
+        # python manage.py replay_visit_segments --target rollups
+        directory = options.get("dir") or settings.VISITS_SEGMENT_DIR
+        raw = options.get("target") == "raw"
+        batch_size = options.get("batch_size")
+        for segment in visits_segments.recover_open_segments(directory):
+            self.stdout.write(f"Recovered {segment.name} from a dead process")
+
+        total = 0
+        for segment in visits_segments.closed_segments(directory):
+            with transaction.atomic():
+                marker, created = ReplayedSegment.objects.get_or_create(name=segment.name)
+                if not created:
+                    self.stdout.write(self.style.WARNING(f"Skipping {segment.name}, already replayed"))
+                else:
+                    rows = (visits_utils.Visit(*row) for row in visits_segments.read_segment(segment))
+                    while batch := list(islice(rows, batch_size)):
+                        visits_utils.write_visits(batch, raw=raw)
+                        marker.visits += len(batch)
+                    marker.save()
+                    total += marker.visits
+                    self.stdout.write(f"Loaded {marker.visits} visits from {segment.name}")
+            visits_segments.remove_segment(segment)
+        self.stdout.write(self.style.SUCCESS(f"Replayed {total} visits"))
@@ -0,0 +1,17 @@
+from typing import Any
+from django.core.management.base import BaseCommand
+
+from visits import heavy_hitters as visits_heavy_hitters
+
+class Command(BaseCommand):
+    help = "Show the approximate most visited paths over the last hour or day"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--window", default="hour", choices=sorted(visits_heavy_hitters.WINDOWS))
+        parser.add_argument("-n", "--limit", default=10, type=int)
+
+    def handle(self, *args: Any, **options: Any):
+        # python manage.py top_paths --window day -n 20
+        rows = visits_heavy_hitters.top_paths(n=options.get("limit"), window=options.get("window"))
+        for path, count in rows:
+            self.stdout.write(f"{count:>10,}  {path}")
@@ -0,0 +1,18 @@
+# Generated by Django 5.0.14 on 2026-10-16 23:00
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("visits", "0001_initial"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="pagevisits",
+            name="timestamp",
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+    ]
@@ -0,0 +1,40 @@
+# Generated by Django 5.0.14 on 2026-10-16 23:01
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def seed_counters(apps, schema_editor):
+    PageVisits = apps.get_model("visits", "PageVisits")
+    VisitCounter = apps.get_model("visits", "VisitCounter")
+    qs = PageVisits.objects.values("path").annotate(total=Count("id")).order_by()
+    counters = [VisitCounter(path=row["path"], count=row["total"]) for row in qs]
+    counters.append(VisitCounter(path="*", count=sum(c.count for c in counters)))
+    VisitCounter.objects.bulk_create(counters, batch_size=1_000)
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("visits", "0002_pagevisits_timestamp_default"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="VisitCounter",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("path", models.TextField(unique=True)),
+                ("count", models.BigIntegerField(default=0)),
+                ("updated", models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.RunPython(seed_counters, migrations.RunPython.noop),
+    ]
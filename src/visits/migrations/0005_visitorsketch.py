@@ -0,0 +1,36 @@
+# Generated by Django 5.0.14 on 2026-10-16 23:03
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("visits", "0004_visitrollup_rollupwatermark"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="VisitorSketch",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("path", models.TextField()),
+                ("day", models.DateField()),
+                ("registers", models.BinaryField()),
+                ("updated", models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name="visitorsketch",
+            constraint=models.UniqueConstraint(
+                fields=("path", "day"), name="unique_visitor_sketch_day"
+            ),
+        ),
+    ]
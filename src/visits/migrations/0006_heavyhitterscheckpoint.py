@@ -0,0 +1,29 @@
+# Generated by Django 5.0.14 on 2026-10-16 23:04
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("visits", "0005_visitorsketch"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="HeavyHittersCheckpoint",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("bucket_start", models.DateTimeField(unique=True)),
+                ("counters", models.JSONField(default=dict)),
+                ("updated", models.DateTimeField(auto_now=True)),
+            ],
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 5.0.14 on 2026-10-16 23:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("visits", "0006_heavyhitterscheckpoint"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="ReplayedSegment",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("name", models.CharField(max_length=255, unique=True)),
+                ("visits", models.IntegerField(default=0)),
+                ("timestamp", models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+    ]
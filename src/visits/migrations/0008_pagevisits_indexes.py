@@ -0,0 +1,23 @@
+# Generated by Django 5.0.14 on 2026-10-17 00:06
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("visits", "0007_replayedsegment"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="pagevisits",
+            name="path",
+            field=models.TextField(db_index=True),
+        ),
+        migrations.AlterField(
+            model_name="pagevisits",
+            name="timestamp",
+            field=models.DateTimeField(db_index=True, default=django.utils.timezone.now),
+        ),
+    ]
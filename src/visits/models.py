@@ -1,4 +1,5 @@
 from django.db import models
+from django.utils import timezone
 
 # Create your models here.
 
@@ -7,5 +8,106 @@ class PageVisits(models.Model):
     # these two are both columns and they both map to a database table
     # db -> table 
     # id -> hidden -> primary key -> autofield -> 1,2,3,3,4
+    path = models.TextField(db_index=True)
+    # set when the visit happens, not when a buffered batch is flushed
+    timestamp = models.DateTimeField(default=timezone.now, db_index=True)
+
+
+class VisitCounter(models.Model):
+    """
+    Running visit count per path, kept up to date as visits are written.
+    The row keyed by visits.counters.TOTAL_KEY holds the grand total.
+    """
+    path = models.TextField(unique=True)
+    count = models.BigIntegerField(default=0)
+    updated = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.path}: {self.count}"
+
+
+class VisitRollup(models.Model):
+    """
+    Visit count for one path within one minute, hour or day bucket.
+    Filled in by visits.rollups.compact() from the raw PageVisits rows.
+    """
+    class GranularityChoices(models.TextChoices):
+        MINUTE = "minute", "Minute"
+        HOUR = "hour", "Hour"
+        DAY = "day", "Day"
+
+    granularity = models.CharField(max_length=10, choices=GranularityChoices.choices)
+    bucket_start = models.DateTimeField()
+    path = models.TextField()
+    count = models.BigIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["granularity", "bucket_start", "path"],
+                name="unique_visit_rollup_bucket"
+            )
+        ]
+
+    def __str__(self):
+        return f"{self.granularity} {self.bucket_start} {self.path}: {self.count}"
+
+
+class RollupWatermark(models.Model):
+    """
+    High-water mark for one compaction stage so it never rescans old data.
+    "raw" tracks the last folded PageVisits id, never past a row newer
+    than VISITS_ROLLUP_GRACE_SECONDS; "hour" and "day" track the
+    first bucket that has not been folded up yet.
+    """
+    name = models.CharField(max_length=20, unique=True)
+    last_id = models.BigIntegerField(default=0)
+    last_bucket = models.DateTimeField(blank=True, null=True)
+    updated = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.name}"
+
+
+class VisitorSketch(models.Model):
+    """
+    HyperLogLog sketch of the unique visitors of one path on one day.
+    """
     path = models.TextField()
-    timestamp = models.DateTimeField(auto_now_add=True)  
+    day = models.DateField()
+    registers = models.BinaryField()
+    updated = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["path", "day"], name="unique_visitor_sketch_day")
+        ]
+
+    def __str__(self):
+        return f"{self.day} {self.path}"
+
+
+class HeavyHittersCheckpoint(models.Model):
+    """
+    Space-Saving summary of the most visited paths within one time bucket,
+    merged from every worker's flushes.
+    """
+    bucket_start = models.DateTimeField(unique=True)
+    counters = models.JSONField(default=dict)
+    updated = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.bucket_start}"
+
+
+class ReplayedSegment(models.Model):
+    """
+    Segment files already loaded by replay_visit_segments, so a segment
+    that could not be deleted after loading is never loaded twice.
+    """
+    name = models.CharField(max_length=255, unique=True)
+    visits = models.IntegerField(default=0)
+    timestamp = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.name}"
@@ -0,0 +1,199 @@
+import datetime
+from collections import Counter
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, Sum
+from django.db.models.functions import TruncDay, TruncHour, TruncMinute
+from django.utils import timezone
+
+from visits import heavy_hitters as visits_heavy_hitters
+from visits.models import PageVisits, RollupWatermark, VisitRollup
+
+Granularity = VisitRollup.GranularityChoices
+
+RAW_WATERMARK = "raw"
+
+
+def truncate(value, granularity):
+    value = value.replace(second=0, microsecond=0)
+    if granularity in (Granularity.HOUR, Granularity.DAY):
+        value = value.replace(minute=0)
+    if granularity == Granularity.DAY:
+        value = value.replace(hour=0)
+    return value
+
+
+def _get_watermark(name):
+    obj, _created = RollupWatermark.objects.select_for_update().get_or_create(name=name)
+    return obj
+
+
+def _add_to_buckets(granularity, deltas):
+    """
+    Add {(bucket_start, path): n} deltas to the rollups of one granularity.
+    """
+    if not deltas:
+        return
+    buckets = {bucket for bucket, _path in deltas}
+    paths = {path for _bucket, path in deltas}
+    existing = {
+        (obj.bucket_start, obj.path): obj
+        for obj in VisitRollup.objects.filter(
+            granularity=granularity,
+            bucket_start__in=buckets,
+            path__in=paths
+        )
+    }
+    to_update = []
+    to_create = []
+    for key, n in deltas.items():
+        obj = existing.get(key)
+        if obj is None:
+            bucket_start, path = key
+            to_create.append(VisitRollup(granularity=granularity, bucket_start=bucket_start, path=path, count=n))
+        else:
+            obj.count += n
+            to_update.append(obj)
+    VisitRollup.objects.bulk_update(to_update, ["count"], batch_size=1_000)
+    VisitRollup.objects.bulk_create(to_create, batch_size=1_000)
+
+
+def add_minute_counts(minutes):
+    """
+    Add {(minute_start, path): n} to the minute buckets. Counts that arrive
+    late for an hour or day that was already folded up are added to those
+    buckets directly. Call inside a transaction.
+    """
+    hour_mark = _get_watermark(Granularity.HOUR).last_bucket
+    day_mark = _get_watermark(Granularity.DAY).last_bucket
+    late_hours = Counter()
+    late_days = Counter()
+    for (bucket, path), n in minutes.items():
+        if hour_mark is not None and bucket < hour_mark:
+            late_hours[(truncate(bucket, Granularity.HOUR), path)] += n
+            if day_mark is not None and bucket < day_mark:
+                late_days[(truncate(bucket, Granularity.DAY), path)] += n
+    _add_to_buckets(Granularity.MINUTE, minutes)
+    _add_to_buckets(Granularity.HOUR, late_hours)
+    _add_to_buckets(Granularity.DAY, late_days)
+
+
+def compact_raw(batch_size=50_000, now=None):
+    """
+    Fold PageVisits rows above the raw high-water mark into minute buckets.
+
+    Ids are handed out before rows commit, so concurrent flushes can commit
+    out of id order. The mark therefore stops below the first row newer than
+    VISITS_ROLLUP_GRACE_SECONDS: a flush still in flight has ids above the
+    mark and is picked up by a later run instead of being skipped.
+    """
+    now = now or timezone.now()
+    cutoff = now - datetime.timedelta(seconds=settings.VISITS_ROLLUP_GRACE_SECONDS)
+    folded = 0
+    while True:
+        with transaction.atomic():
+            watermark = _get_watermark(RAW_WATERMARK)
+            pending = PageVisits.objects.filter(id__gt=watermark.last_id)
+            ids = pending.order_by("id").values_list("id", flat=True)
+            first_recent = pending.filter(timestamp__gte=cutoff).order_by("id").values_list("id", flat=True).first()
+            if first_recent is not None:
+                ids = ids.filter(id__lt=first_recent)
+            upper_id = ids[batch_size - 1:batch_size].first() or ids.last()
+            if upper_id is None:
+                return folded
+            qs = pending.filter(
+                id__lte=upper_id
+            ).annotate(
+                bucket=TruncMinute("timestamp")
+            ).values("bucket", "path").annotate(total=Count("id")).order_by()
+            minutes = Counter({(row["bucket"], row["path"]): row["total"] for row in qs})
+            add_minute_counts(minutes)
+            folded += sum(minutes.values())
+            watermark.last_id = upper_id
+            watermark.save()
+
+
+def compact_level(granularity, now=None):
+    """
+    Fold closed minute buckets into hours, or closed hour buckets into days.
+    A bucket is closed once it ended more than VISITS_ROLLUP_GRACE_SECONDS ago,
+    which leaves buffered visits time to reach the database.
+    """
+    if granularity == Granularity.HOUR:
+        source, trunc = Granularity.MINUTE, TruncHour
+    else:
+        source, trunc = Granularity.HOUR, TruncDay
+    now = now or timezone.now()
+    grace = datetime.timedelta(seconds=settings.VISITS_ROLLUP_GRACE_SECONDS)
+    cutoff = truncate(now - grace, granularity)
+    with transaction.atomic():
+        watermark = _get_watermark(granularity)
+        qs = VisitRollup.objects.filter(granularity=source, bucket_start__lt=cutoff)
+        if watermark.last_bucket is not None:
+            if watermark.last_bucket >= cutoff:
+                return 0
+            qs = qs.filter(bucket_start__gte=watermark.last_bucket)
+        qs = qs.annotate(
+            bucket=trunc("bucket_start")
+        ).values("bucket", "path").annotate(total=Sum("count")).order_by()
+        deltas = Counter({(row["bucket"], row["path"]): row["total"] for row in qs})
+        _add_to_buckets(granularity, deltas)
+        watermark.last_bucket = cutoff
+        watermark.save()
+    return sum(deltas.values())
+
+
+def raw_retention_cutoff(retention_days=None):
+    """
+    Raw PageVisits rows older than this may have been pruned; only their
+    rollups are left.
+    """
+    if retention_days is None:
+        retention_days = settings.VISITS_RAW_RETENTION_DAYS
+    return timezone.now() - datetime.timedelta(days=retention_days)
+
+
+def prune_raw(retention_days=None, batch_size=10_000):
+    """
+    Delete raw PageVisits rows that were rolled up and are older than
+    the retention window.
+    """
+    cutoff = raw_retention_cutoff(retention_days)
+    last_id = RollupWatermark.objects.filter(name=RAW_WATERMARK).values_list("last_id", flat=True).first() or 0
+    qs = PageVisits.objects.filter(id__lte=last_id, timestamp__lt=cutoff)
+    deleted = 0
+    while True:
+        ids = list(qs.order_by("id").values_list("id", flat=True)[:batch_size])
+        if not ids:
+            return deleted
+        count, _ = PageVisits.objects.filter(id__in=ids).delete()
+        deleted += count
+
+
+def compact(prune=True, now=None):
+    results = {
+        "minute": compact_raw(now=now),
+        "hour": compact_level(Granularity.HOUR, now=now),
+        "day": compact_level(Granularity.DAY, now=now),
+        "pruned": 0,
+    }
+    if prune:
+        results["pruned"] = prune_raw()
+        visits_heavy_hitters.prune_checkpoints(now=now)
+    return results
+
+
+def get_visit_series(granularity, start, end, path=None):
+    """
+    [(bucket_start, count), ...] for buckets in [start, end).
+    """
+    qs = VisitRollup.objects.filter(
+        granularity=granularity,
+        bucket_start__gte=start,
+        bucket_start__lt=end
+    )
+    if path is not None:
+        qs = qs.filter(path=path)
+    qs = qs.values("bucket_start").annotate(total=Sum("count")).order_by("bucket_start")
+    return [(row["bucket_start"], row["total"]) for row in qs]
@@ -0,0 +1,222 @@
+import datetime
+import fcntl
+import json
+import mmap
+import os
+import socket
+import struct
+import threading
+import time
+from pathlib import Path
+
+# timestamp (µs since epoch), visitor hash, interned path id, flags
+RECORD = struct.Struct("<qQII")
+FLAG_BOT = 1
+EPOCH = datetime.datetime(1970, 1, 1, tzinfo=datetime.timezone.utc)
+
+NEW_SUFFIX = ".new"
+OPEN_SUFFIX = ".open"
+CLOSED_SUFFIX = ".seg"
+PATHS_SUFFIX = ".paths"
+
+
+def _to_micros(value):
+    return (value - EPOCH) // datetime.timedelta(microseconds=1)
+
+
+def _paths_file(segment):
+    return segment.with_suffix(PATHS_SUFFIX)
+
+
+class SegmentWriter:
+    """
+    Appends visits to rotating, append-only segment files.
+
+    Each segment is a sequence of fixed-width RECORDs plus a `.paths`
+    sidecar that interns the paths used by that segment, one JSON
+    `[id, path]` line per path. A path line is always flushed before the
+    first record that refers to it. Segments are written as `*.open` and
+    renamed to `*.seg` once they reach `max_bytes`, or by a daemon thread
+    once they are `max_age` seconds old. The writer holds an exclusive
+    flock on its open segment, so a segment nobody holds is abandoned.
+    """
+
+    def __init__(self, directory, max_bytes=4 * 1024 * 1024, max_age=300):
+        self.directory = Path(directory)
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self._lock = threading.Lock()
+        self._segment = None
+        self._file = None
+        self._paths_file = None
+        self._path_ids = {}
+        self._opened_at = 0
+        self._size = 0
+        self._stopped = threading.Event()
+        self._pid = None
+
+    def write(self, visits):
+        self._ensure_started()
+        with self._lock:
+            if self._file is not None and (
+                self._size >= self.max_bytes or time.monotonic() - self._opened_at >= self.max_age
+            ):
+                self._close_segment()
+            if self._file is None:
+                self._open_segment()
+            records = []
+            new_paths = []
+            for v in visits:
+                path_id = self._path_ids.get(v.path)
+                if path_id is None:
+                    path_id = len(self._path_ids)
+                    self._path_ids[v.path] = path_id
+                    new_paths.append(json.dumps([path_id, v.path]) + "\n")
+                records.append(RECORD.pack(
+                    _to_micros(v.timestamp),
+                    v.visitor or 0,
+                    path_id,
+                    FLAG_BOT if v.is_bot else 0
+                ))
+            if new_paths:
+                self._paths_file.write("".join(new_paths))
+                self._paths_file.flush()
+            data = b"".join(records)
+            self._file.write(data)
+            self._file.flush()
+            self._size += len(data)
+
+    def close(self):
+        self._stopped.set()
+        with self._lock:
+            if self._file is not None:
+                self._close_segment()
+
+    def _ensure_started(self):
+        pid = os.getpid()
+        if self._pid == pid:
+            return
+        with self._lock:
+            if self._pid == pid:
+                return
+            if self._file is not None:
+                # forked worker: the parent still holds the lock and closes the segment
+                self._file.close()
+                self._paths_file.close()
+                self._segment = self._file = self._paths_file = None
+            self._pid = pid
+            self._stopped.clear()
+            threading.Thread(target=self._run, name="visit-segments", daemon=True).start()
+
+    def _run(self):
+        timeout = self.max_age
+        while not self._stopped.wait(timeout):
+            with self._lock:
+                if self._file is None:
+                    timeout = self.max_age
+                    continue
+                timeout = self._opened_at + self.max_age - time.monotonic()
+                if timeout <= 0:
+                    self._close_segment()
+                    timeout = self.max_age
+
+    def _open_segment(self):
+        self.directory.mkdir(parents=True, exist_ok=True)
+        name = f"visits-{socket.gethostname()}-{os.getpid()}-{time.time_ns() // 1000}"
+        # locked before it is renamed to .open, so recovery never sees it unlocked
+        new = self.directory / f"{name}{NEW_SUFFIX}"
+        self._file = open(new, "ab")
+        fcntl.flock(self._file.fileno(), fcntl.LOCK_EX)
+        self._paths_file = open(_paths_file(new), "a", encoding="utf-8")
+        self._segment = new.rename(new.with_suffix(OPEN_SUFFIX))
+        self._path_ids = {}
+        self._opened_at = time.monotonic()
+        self._size = 0
+
+    def _close_segment(self):
+        # renamed while still locked, so recovery cannot close it first
+        self._segment.rename(self._segment.with_suffix(CLOSED_SUFFIX))
+        self._file.close()
+        self._paths_file.close()
+        self._segment = None
+        self._file = None
+        self._paths_file = None
+
+
+def recover_open_segments(directory):
+    """
+    Close `*.open` segments no writer holds a lock on (its process died,
+    whatever host or container it ran in), dropping a partially written
+    trailing record.
+    """
+    recovered = []
+    for segment in sorted(Path(directory).glob(f"*{OPEN_SUFFIX}")):
+        try:
+            f = open(segment, "r+b")
+        except FileNotFoundError:
+            # closed by its writer since the glob
+            continue
+        with f:
+            try:
+                fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                continue
+            if not segment.exists():
+                # closed by its writer between open() and flock()
+                continue
+            size = os.fstat(f.fileno()).st_size
+            usable = size - size % RECORD.size
+            if usable != size:
+                os.ftruncate(f.fileno(), usable)
+            segment.rename(segment.with_suffix(CLOSED_SUFFIX))
+        recovered.append(segment)
+    return recovered
+
+
+def closed_segments(directory):
+    return sorted(Path(directory).glob(f"*{CLOSED_SUFFIX}"))
+
+
+def _read_paths(segment):
+    paths = {}
+    paths_file = _paths_file(segment)
+    if not paths_file.exists():
+        return paths
+    with open(paths_file, encoding="utf-8") as f:
+        for line in f:
+            try:
+                path_id, path = json.loads(line)
+            except ValueError:
+                # torn trailing line; records that use it are skipped below
+                break
+            paths[path_id] = path
+    return paths
+
+
+def read_segment(segment):
+    """
+    Yield (path, timestamp, visitor, is_bot) tuples from a segment via mmap.
+    A partially written trailing record is ignored.
+    """
+    paths = _read_paths(segment)
+    with open(segment, "rb") as f:
+        size = os.fstat(f.fileno()).st_size
+        usable = size - size % RECORD.size
+        if usable == 0:
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            view = memoryview(mm)[:usable]
+            try:
+                for micros, visitor, path_id, flags in RECORD.iter_unpack(view):
+                    path = paths.get(path_id)
+                    if path is None:
+                        continue
+                    timestamp = EPOCH + datetime.timedelta(microseconds=micros)
+                    yield path, timestamp, visitor or None, bool(flags & FLAG_BOT)
+            finally:
+                view.release()
+
+
+def remove_segment(segment):
+    segment.unlink(missing_ok=True)
+    _paths_file(segment).unlink(missing_ok=True)
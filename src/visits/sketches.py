@@ -0,0 +1,95 @@
+from collections import defaultdict
+
+from django.conf import settings
+
+from visits.counters import TOTAL_KEY
+from visits.hll import HyperLogLog, hash_value
+from visits.models import VisitorSketch
+
+
+def get_client_ip(request):
+    """
+    REMOTE_ADDR, or the X-Forwarded-For entry appended by the outermost of
+    VISITS_TRUSTED_PROXY_HOPS proxies. Entries left of that one are set
+    by the client and never trusted.
+    """
+    hops = settings.VISITS_TRUSTED_PROXY_HOPS
+    if hops > 0:
+        forwarded = [ip.strip() for ip in request.META.get("HTTP_X_FORWARDED_FOR", "").split(",")]
+        if len(forwarded) >= hops and forwarded[-hops]:
+            return forwarded[-hops]
+    return request.META.get("REMOTE_ADDR", "")
+
+
+def get_visitor_hash(request):
+    """
+    Stable, non-reversible 64-bit visitor id: the user id when signed in,
+    otherwise client IP + User-Agent keyed with SECRET_KEY.
+    """
+    user = getattr(request, "user", None)
+    if user is not None and user.is_authenticated:
+        raw = f"user:{user.pk}"
+    else:
+        raw = f"{get_client_ip(request)}|{request.META.get('HTTP_USER_AGENT', '')}"
+    return hash_value(f"{settings.SECRET_KEY}|{raw}")
+
+
+def build_sketches(visits):
+    sketches = defaultdict(lambda: HyperLogLog(settings.VISITS_HLL_PRECISION))
+    for v in visits:
+        if v.visitor is None:
+            continue
+        day = v.timestamp.date()
+        sketches[(v.path, day)].add_hash(v.visitor)
+        sketches[(TOTAL_KEY, day)].add_hash(v.visitor)
+    return sketches
+
+
+def update_sketches(visits):
+    """
+    Merge a batch of visits into the stored (path, day) sketches.
+    Call inside a transaction.
+    """
+    sketches = build_sketches(visits)
+    if not sketches:
+        return
+    existing = VisitorSketch.objects.select_for_update().filter(
+        path__in={path for path, _day in sketches},
+        day__in={day for _path, day in sketches}
+    )
+    to_update = []
+    for obj in existing:
+        sketch = sketches.pop((obj.path, obj.day), None)
+        if sketch is None:
+            continue
+        obj.registers = sketch.merge(HyperLogLog.from_bytes(obj.registers)).to_bytes()
+        to_update.append(obj)
+    VisitorSketch.objects.bulk_update(to_update, ["registers"])
+    for (path, day), sketch in sketches.items():
+        obj, created = VisitorSketch.objects.get_or_create(
+            path=path, day=day, defaults={"registers": sketch.to_bytes()}
+        )
+        if not created:
+            # another worker created the row in the meantime
+            obj = VisitorSketch.objects.filter(pk=obj.pk).select_for_update().get()
+            obj.registers = sketch.merge(HyperLogLog.from_bytes(obj.registers)).to_bytes()
+            obj.save(update_fields=["registers", "updated"])
+
+
+def get_unique_visitors(path=None, start_day=None, end_day=None):
+    """
+    Approximate unique visitors for a path (or the whole site) over the
+    inclusive day range, merging the daily sketches.
+    """
+    qs = VisitorSketch.objects.filter(path=path or TOTAL_KEY)
+    if start_day is not None:
+        qs = qs.filter(day__gte=start_day)
+    if end_day is not None:
+        qs = qs.filter(day__lte=end_day)
+    merged = None
+    for registers in qs.values_list("registers", flat=True):
+        sketch = HyperLogLog.from_bytes(registers)
+        merged = sketch if merged is None else merged.merge(sketch)
+    if merged is None:
+        return 0
+    return merged.count()
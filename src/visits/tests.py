@@ -1,3 +1,420 @@
-from django.test import TestCase
+import atexit
+import datetime
+import io
+import os
+import pathlib
+import tempfile
+import time
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.management import CommandError, call_command
+from django.test import RequestFactory, TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from helpers.cache import cached_value
+from visits.buffer import VisitBuffer
+from visits.heavy_hitters import SpaceSaving
+from visits.hll import HyperLogLog, hash_value
+from visits.filters import PatternMatcher, is_bot
+from visits.models import PageVisits, VisitCounter, VisitorSketch, VisitRollup
+from visits.segments import SegmentWriter
+from visits import columnar as visits_columnar
+from visits import counters as visits_counters
+from visits import heavy_hitters as visits_heavy_hitters
+from visits import rollups as visits_rollups
+from visits import segments as visits_segments
+from visits import sketches as visits_sketches
+from visits import utils as visits_utils
+
+User = get_user_model()
+
+BROWSER_UA = "Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 Chrome/126.0 Safari/537.36"
+
+
+class VisitBufferTestCase(TestCase):
+
+    def test_flush_hands_over_pending_batch(self):
+        batches = []
+        buffer = VisitBuffer(flush_fn=batches.append, max_size=10, flush_interval=60)
+        buffer._ensure_started = lambda: None
+        self.addCleanup(atexit.unregister, buffer.close)
+        for i in range(3):
+            buffer.add(i)
+        self.assertEqual(buffer.flush(), 3)
+        self.assertEqual(batches, [[0, 1, 2]])
+        self.assertEqual(buffer.flush(), 0)
+
+    def test_failed_flush_requeues(self):
+        def fail(batch):
+            raise RuntimeError("db down")
+        buffer = VisitBuffer(flush_fn=fail, max_size=10, flush_interval=60, max_pending=2)
+        buffer._ensure_started = lambda: None
+        self.addCleanup(atexit.unregister, buffer.close)
+        for i in range(3):
+            buffer.add(i)
+        with self.assertLogs("visits.buffer", level="ERROR"):
+            self.assertEqual(buffer.flush(), 0)
+        self.assertEqual(len(buffer), 2)
+        self.assertEqual(buffer.dropped, 1)
+
+    @override_settings(VISITS_WRITE_BEHIND=False)
+    def test_record_visit_inline(self):
+        visits_utils.record_visit(path="/about/")
+        self.assertEqual(PageVisits.objects.filter(path="/about/").count(), 1)
+
+
+@override_settings(VISITS_WRITE_BEHIND=False)
+class VisitCounterTestCase(TestCase):
+
+    def test_counters_track_recorded_visits(self):
+        for path in ["/about/", "/about/", "/"]:
+            visits_utils.record_visit(path=path)
+        stats = visits_counters.get_visit_stats("/about/")
+        self.assertEqual(stats["total"], 3)
+        self.assertEqual(stats["path_count"], 2)
+        self.assertAlmostEqual(stats["percent"], 200 / 3)
+
+    def test_rebuild_matches_raw_rows(self):
+        PageVisits.objects.bulk_create([PageVisits(path="/a/"), PageVisits(path="/b/")])
+        visits_counters.rebuild_counters()
+        self.assertEqual(visits_counters.get_visit_stats("/a/")["path_count"], 1)
+        self.assertEqual(visits_counters.get_total_visits(), 2)
+
+    def test_purge_path_removes_pruned_visits_from_total(self):
+        for path in ["/about/", "/about/", "/"]:
+            visits_utils.record_visit(path=path)
+        visits_rollups.compact(prune=False, now=timezone.now() + datetime.timedelta(days=2))
+        self.assertTrue(VisitRollup.objects.filter(path="/about/").exists())
+        # the raw rows are gone, the counter and rollups still count them
+        PageVisits.objects.filter(path="/about/").delete()
+        visits_utils.purge_path("/about/")
+        self.assertEqual(visits_counters.get_visit_stats("/about/")["path_count"], 0)
+        self.assertEqual(visits_counters.get_total_visits(), 1)
+        self.assertFalse(VisitRollup.objects.filter(path="/about/").exists())
+
+
+class CachedValueTestCase(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.calls = 0
+
+    def compute(self):
+        self.calls += 1
+        return self.calls
+
+    def test_value_is_computed_once_per_ttl(self):
+        self.assertEqual(cached_value("test:value", self.compute, ttl=60), 1)
+        self.assertEqual(cached_value("test:value", self.compute, ttl=60), 1)
+        self.assertEqual(self.calls, 1)
+
+    def test_stale_value_served_while_refresh_is_locked(self):
+        cached_value("test:value", self.compute, ttl=0)
+        cache.add("test:value:lock", 1)
+        self.assertEqual(cached_value("test:value", self.compute, ttl=0), 1)
+        cache.delete("test:value:lock")
+        self.assertEqual(cached_value("test:value", self.compute, ttl=0), 2)
+
+
+@override_settings(VISITS_WRITE_BEHIND=False, VISITS_ROLLUP_GRACE_SECONDS=0, VISITS_RAW_RETENTION_DAYS=0)
+class VisitRollupTestCase(TestCase):
+
+    def test_compaction_folds_each_level_once(self):
+        base = timezone.now().replace(hour=10, minute=0, second=0, microsecond=0) - datetime.timedelta(days=2)
+        PageVisits.objects.bulk_create([
+            PageVisits(path="/", timestamp=base),
+            PageVisits(path="/", timestamp=base + datetime.timedelta(seconds=30)),
+            PageVisits(path="/", timestamp=base + datetime.timedelta(minutes=61)),
+        ])
+        results = visits_rollups.compact()
+        self.assertEqual(results["minute"], 3)
+        self.assertEqual(results["pruned"], 3)
+        Granularity = visits_rollups.Granularity
+        day = base.replace(hour=0)
+        self.assertEqual(
+            visits_rollups.get_visit_series(Granularity.HOUR, base, base + datetime.timedelta(hours=2)),
+            [(base, 2), (base + datetime.timedelta(hours=1), 1)]
+        )
+        self.assertEqual(
+            visits_rollups.get_visit_series(Granularity.DAY, day, day + datetime.timedelta(days=1)),
+            [(day, 3)]
+        )
+        # a late row for an already folded hour goes straight into the upper levels
+        PageVisits.objects.create(path="/", timestamp=base + datetime.timedelta(minutes=5))
+        results = visits_rollups.compact()
+        self.assertEqual((results["minute"], results["hour"], results["day"]), (1, 0, 0))
+        self.assertEqual(
+            visits_rollups.get_visit_series(Granularity.DAY, day, day + datetime.timedelta(days=1)),
+            [(day, 4)]
+        )
+        visits_counters.rebuild_counters()
+        self.assertEqual(visits_counters.get_total_visits(), 4)
+
+    @override_settings(VISITS_ROLLUP_GRACE_SECONDS=300)
+    def test_raw_mark_stops_below_recent_rows(self):
+        now = timezone.now()
+        old = now - datetime.timedelta(hours=1)
+        PageVisits.objects.bulk_create([
+            PageVisits(path="/", timestamp=old),
+            PageVisits(path="/", timestamp=now),
+            # committed ahead of the row above, e.g. by another worker
+            PageVisits(path="/", timestamp=old),
+        ])
+        self.assertEqual(visits_rollups.compact(prune=False)["minute"], 1)
+        results = visits_rollups.compact(now=now + datetime.timedelta(minutes=10))
+        self.assertEqual(results["minute"], 2)
+        self.assertEqual(PageVisits.objects.count(), 0)
+
+
+class HyperLogLogTestCase(TestCase):
+
+    def test_estimate_and_merge(self):
+        a = HyperLogLog(12)
+        b = HyperLogLog(12)
+        for i in range(5_000):
+            a.add(f"visitor-{i}")
+            b.add(f"visitor-{i + 2_500}")
+        self.assertAlmostEqual(a.count(), 5_000, delta=5_000 * 0.05)
+        merged = HyperLogLog.from_bytes(a.to_bytes()).merge(b)
+        self.assertAlmostEqual(merged.count(), 7_500, delta=7_500 * 0.05)
+
+    @override_settings(VISITS_WRITE_BEHIND=False)
+    def test_recorded_visits_update_daily_sketches(self):
+        factory = RequestFactory()
+        for ip in ["10.0.0.1", "10.0.0.2", "10.0.0.1"]:
+            visits_utils.record_visit(factory.get("/about/", REMOTE_ADDR=ip, HTTP_USER_AGENT=BROWSER_UA))
+        today = timezone.now().date()
+        self.assertEqual(visits_sketches.get_unique_visitors("/about/", today, today), 2)
+        self.assertEqual(visits_sketches.get_unique_visitors(), 2)
+
+    def test_sketch_created_concurrently_is_merged(self):
+        now = timezone.now()
+        visits_sketches.update_sketches([visits_utils.Visit("/about/", now, visitor=hash_value("a"))])
+        # the row did not exist yet when this worker looked for it
+        with mock.patch.object(VisitorSketch.objects, "select_for_update", return_value=VisitorSketch.objects.none()):
+            visits_sketches.update_sketches([visits_utils.Visit("/about/", now, visitor=hash_value("b"))])
+        self.assertEqual(VisitorSketch.objects.filter(path="/about/").count(), 1)
+        self.assertEqual(visits_sketches.get_unique_visitors("/about/"), 2)
+
+
+class HeavyHittersTestCase(TestCase):
+
+    def setUp(self):
+        # leave out what earlier tests tracked in this process
+        tracker = visits_heavy_hitters.HeavyHittersTracker(capacity=100, interval=60)
+        self.addCleanup(atexit.unregister, tracker.close)
+        patcher = mock.patch.object(visits_heavy_hitters, "_tracker", tracker)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_space_saving_keeps_heavy_keys(self):
+        summary = SpaceSaving(capacity=5)
+        for i in range(1_000):
+            summary.offer("/hot/" if i % 2 else f"/cold/{i}/")
+        self.assertEqual(summary.top(1)[0][0], "/hot/")
+        other = SpaceSaving(capacity=5, counters={"/hot/": [10, 0], "/warm/": [7, 0]})
+        self.assertEqual(summary.merge(other).top(1), [("/hot/", 510)])
+
+    @override_settings(VISITS_WRITE_BEHIND=False)
+    def test_top_paths_over_last_hour(self):
+        for path in ["/", "/about/", "/about/", "/pricing/", "/about/", "/"]:
+            visits_utils.record_visit(path=path)
+        # only tracked in memory until the next checkpoint
+        self.assertEqual(visits_heavy_hitters.top_paths(n=2, window="hour"), [])
+        visits_heavy_hitters.flush_tracker()
+        self.assertEqual(
+            visits_heavy_hitters.top_paths(n=2, window="hour"),
+            [("/about/", 3), ("/", 2)]
+        )
+
+
+class SegmentLogTestCase(TestCase):
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.directory = pathlib.Path(tmp.name)
+
+    def test_recover_and_replay_partial_segment(self):
+        writer = SegmentWriter(self.directory)
+        now = timezone.now()
+        writer.write([
+            visits_utils.Visit("/about/", now, 7),
+            visits_utils.Visit("/", now, None),
+        ])
+        segment = writer._segment
+        writer._file.write(b"\x00" * 5)  # torn trailing record
+        writer._file.flush()
+        self.assertEqual(visits_segments.recover_open_segments(self.directory), [])
+        # the writer dies: its lock goes with it
+        writer._stopped.set()
+        writer._file.close()
+        writer._paths_file.close()
+
+        self.assertEqual(visits_segments.recover_open_segments(self.directory), [segment])
+        closed = visits_segments.closed_segments(self.directory)
+        self.assertEqual(
+            list(visits_segments.read_segment(closed[0])),
+            [("/about/", now, 7, False), ("/", now, None, False)]
+        )
+        call_command("replay_visit_segments", dir=str(self.directory), stdout=io.StringIO())
+        self.assertEqual(PageVisits.objects.count(), 2)
+        self.assertEqual(visits_segments.closed_segments(self.directory), [])
+
+    def test_idle_segment_is_closed_after_max_age(self):
+        writer = SegmentWriter(self.directory, max_age=0.1)
+        self.addCleanup(writer.close)
+        writer.write([visits_utils.Visit("/about/", timezone.now(), 7)])
+        deadline = time.monotonic() + 5
+        while not visits_segments.closed_segments(self.directory) and time.monotonic() < deadline:
+            time.sleep(0.05)
+        self.assertEqual(len(visits_segments.closed_segments(self.directory)), 1)
+        self.assertEqual(list(self.directory.glob("*.open")), [])
+
+
+class ColumnarExportTestCase(TestCase):
+
+    def test_export_round_trip(self):
+        now = timezone.now()
+        PageVisits.objects.bulk_create([
+            PageVisits(path=["/", "/about/", "/pricing/"][i % 3], timestamp=now - datetime.timedelta(seconds=i))
+            for i in range(25)
+        ])
+        expected = list(PageVisits.objects.order_by("id").values_list("id", "path", "timestamp"))
+        data = b"".join(visits_columnar.iter_export(chunk_size=10))
+        rows = [row for chunk in visits_columnar.read_export(io.BytesIO(data)) for row in chunk]
+        self.assertEqual(rows, expected)
+
+    def test_export_refuses_pruned_ranges(self):
+        now = timezone.now()
+        PageVisits.objects.bulk_create([
+            PageVisits(path="/old/", timestamp=now - datetime.timedelta(days=2)),
+            PageVisits(path="/new/", timestamp=now),
+        ])
+        since = visits_columnar.parse_since((now - datetime.timedelta(days=1)).date().isoformat())
+        data = b"".join(visits_columnar.iter_export(since=since))
+        rows = [row for chunk in visits_columnar.read_export(io.BytesIO(data)) for row in chunk]
+        self.assertEqual([path for _, path, _ in rows], ["/new/"])
+
+        too_old = (now - datetime.timedelta(days=30)).date().isoformat()
+        with self.assertRaises(ValueError):
+            visits_columnar.parse_since(too_old)
+        with self.assertRaises(CommandError):
+            call_command("export_visits", os.devnull, since=too_old)
+        self.client.force_login(User.objects.create_user("staff", password="pw", is_staff=True))
+        response = self.client.get(reverse("visits-export"), {"since": too_old})
+        self.assertEqual(response.status_code, 400)
+
+    def test_export_view_is_staff_only(self):
+        response = self.client.get(reverse("visits-export"))
+        self.assertEqual(response.status_code, 302)
+        staff = User.objects.create_user("staff", password="pw", is_staff=True)
+        self.client.force_login(staff)
+        response = self.client.get(reverse("visits-export"))
+        self.assertEqual(b"".join(response.streaming_content), visits_columnar.MAGIC)
+
+    async def test_export_view_streams_under_asgi(self):
+        await PageVisits.objects.acreate(path="/")
+        staff = await User.objects.acreate(username="staff", is_staff=True)
+        await self.async_client.aforce_login(staff)
+        response = await self.async_client.get(reverse("visits-export"))
+        self.assertTrue(response.is_async)
+        data = b"".join([chunk async for chunk in response.streaming_content])
+        rows = [row for chunk in visits_columnar.read_export(io.BytesIO(data)) for row in chunk]
+        self.assertEqual([path for _, path, _ in rows], ["/"])
+
+
+class BotFilterTestCase(TestCase):
+
+    def test_pattern_matcher(self):
+        matcher = PatternMatcher(["bot", "kube-probe", "he", "hers"])
+        self.assertTrue(matcher.search("Mozilla/5.0 (compatible; Googlebot/2.1)"))
+        self.assertTrue(matcher.search("ushers"))
+        self.assertFalse(matcher.search("Mozilla/5.0 Firefox"))
+
+    @override_settings(VISITS_WRITE_BEHIND=False, VISITS_BOT_ACTION="tally")
+    def test_bot_hits_are_tallied_apart(self):
+        factory = RequestFactory()
+        visits_utils.record_visit(factory.get("/about/", HTTP_USER_AGENT=BROWSER_UA))
+        visits_utils.record_visit(factory.get("/about/", HTTP_USER_AGENT="curl/8.5.0"))
+        visits_utils.record_visit(factory.get("/wp-login.php", HTTP_USER_AGENT=BROWSER_UA))
+        self.assertEqual(PageVisits.objects.count(), 1)
+        self.assertEqual(visits_counters.get_total_visits(), 1)
+        self.assertEqual(visits_counters.get_visit_stats(visits_counters.BOT_TOTAL_KEY)["path_count"], 2)
+
+    def test_default_patterns_spare_real_visitors(self):
+        factory = RequestFactory()
+        cubot = "Mozilla/5.0 (Linux; Android 12; CUBOT KINGKONG 7) AppleWebKit/537.36 Chrome/120.0 Mobile Safari/537.36"
+        self.assertFalse(is_bot(factory.get("/healthy-recipes/", HTTP_USER_AGENT=cubot)))
+        self.assertFalse(is_bot(factory.get("/monitoring-guide/", HTTP_USER_AGENT=BROWSER_UA)))
+        self.assertTrue(is_bot(factory.get("/health/", HTTP_USER_AGENT=BROWSER_UA)))
+        self.assertTrue(is_bot(factory.get("/", HTTP_USER_AGENT="Mozilla/5.0 (compatible; bingbot/2.0)")))
+
+    @override_settings(VISITS_WRITE_BEHIND=False, VISITS_BOT_ACTION="tally")
+    def test_rebuild_keeps_bot_tallies(self):
+        factory = RequestFactory()
+        visits_utils.record_visit(factory.get("/about/", HTTP_USER_AGENT=BROWSER_UA))
+        visits_utils.record_visit(factory.get("/about/", HTTP_USER_AGENT="curl/8.5.0"))
+        visits_counters.rebuild_counters()
+        self.assertEqual(visits_counters.get_total_visits(), 1)
+        self.assertEqual(visits_counters.get_visit_stats(visits_counters.BOT_TOTAL_KEY)["path_count"], 1)
+        self.assertEqual(visits_counters.get_visit_stats(f"{visits_counters.BOT_PREFIX}/about/")["path_count"], 1)
+
+    @override_settings(VISITS_WRITE_BEHIND=False, VISITS_BOT_ACTION="drop")
+    def test_bot_hits_can_be_dropped(self):
+        request = RequestFactory().get("/", HTTP_USER_AGENT="kube-probe/1.29")
+        self.assertFalse(visits_utils.record_visit(request))
+        self.assertFalse(VisitCounter.objects.filter(path__startswith=visits_counters.BOT_PREFIX).exists())
+
+
+class VisitBeaconTestCase(TestCase):
+
+    def setUp(self):
+        cache.clear()
+
+    def post_beacon(self, body, **extra):
+        extra.setdefault("HTTP_ORIGIN", "http://testserver")
+        return self.client.post(
+            reverse("visit-beacon"), body, content_type="application/json", HTTP_USER_AGENT=BROWSER_UA, **extra
+        )
+
+    @override_settings(VISITS_WRITE_BEHIND=False, VISITS_TRACKING="beacon")
+    def test_beacon_records_visits_instead_of_page(self):
+        response = self.client.get("/about/", HTTP_USER_AGENT=BROWSER_UA)
+        self.assertContains(response, reverse("visit-beacon"))
+        self.assertFalse(PageVisits.objects.exists())
+        response = self.post_beacon('{"events": [{"path": "/about/"}, {"path": "/pricing/"}]}')
+        self.assertEqual(response.status_code, 204)
+        self.assertEqual(sorted(PageVisits.objects.values_list("path", flat=True)), ["/about/", "/pricing/"])
+
+    @override_settings(VISITS_WRITE_BEHIND=False)
+    def test_beacon_rejects_malformed_payloads(self):
+        url = reverse("visit-beacon")
+        for body in ["not json", '{"events": []}', '{"events": [{"path": "https://evil.example/"}]}',
+                     '{"events": [{"path": "/no-such-page/"}]}', '{"events": [{"path": "/profiles/made-up/"}]}',
+                     '{"events": [{"path": "/admin/anything/"}]}']:
+            self.assertEqual(self.post_beacon(body).status_code, 400)
+        self.assertEqual(self.post_beacon('{"events": [{"path": "/"}]}', HTTP_ORIGIN="https://evil.example").status_code, 403)
+        self.assertEqual(self.post_beacon('{"events": [{"path": "/"}]}', HTTP_ORIGIN="").status_code, 403)
+        response = self.post_beacon('{"events": [{"path": "/"}]}', HTTP_ORIGIN="", HTTP_REFERER="http://testserver/about/")
+        self.assertEqual(response.status_code, 204)
+        self.assertEqual(self.client.get(url).status_code, 405)
+
+    @override_settings(VISITS_WRITE_BEHIND=False, VISITS_BEACON_RATE_LIMIT=3)
+    def test_beacon_is_rate_limited_per_client(self):
+        body = '{"events": [{"path": "/"}, {"path": "/about/"}]}'
+        self.assertEqual(self.post_beacon(body).status_code, 204)
+        self.assertEqual(self.post_beacon(body).status_code, 429)
+        self.assertEqual(self.post_beacon(body, REMOTE_ADDR="10.0.0.2").status_code, 204)
+        # a client-supplied X-Forwarded-For does not reset the limit
+        self.assertEqual(self.post_beacon(body, HTTP_X_FORWARDED_FOR="203.0.113.9").status_code, 429)
+
+    @override_settings(VISITS_TRUSTED_PROXY_HOPS=1)
+    def test_client_ip_trusts_only_the_proxy_hop(self):
+        request = RequestFactory().get("/", REMOTE_ADDR="10.0.0.1", HTTP_X_FORWARDED_FOR="1.2.3.4, 198.51.100.7")
+        self.assertEqual(visits_sketches.get_client_ip(request), "198.51.100.7")
+        request = RequestFactory().get("/", REMOTE_ADDR="10.0.0.1")
+        self.assertEqual(visits_sketches.get_client_ip(request), "10.0.0.1")
@@ -0,0 +1,154 @@
+import atexit
+import threading
+from collections import Counter, namedtuple
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from visits import counters as visits_counters
+from visits import filters as visits_filters
+from visits import heavy_hitters as visits_heavy_hitters
+from visits import rollups as visits_rollups
+from visits import sketches as visits_sketches
+from visits.buffer import VisitBuffer
+from visits.models import PageVisits, VisitCounter, VisitorSketch, VisitRollup
+from visits.segments import SegmentWriter
+
+Visit = namedtuple("Visit", ["path", "timestamp", "visitor", "is_bot"], defaults=(None, False))
+
+_buffer = None
+_segment_writer = None
+_buffer_lock = threading.Lock()
+
+
+def get_segment_writer():
+    global _segment_writer
+    if _segment_writer is None:
+        with _buffer_lock:
+            if _segment_writer is None:
+                _segment_writer = SegmentWriter(
+                    settings.VISITS_SEGMENT_DIR,
+                    max_bytes=settings.VISITS_SEGMENT_MAX_BYTES,
+                    max_age=settings.VISITS_SEGMENT_MAX_AGE,
+                )
+                atexit.register(_segment_writer.close)
+    return _segment_writer
+
+
+def get_flush_fn():
+    if settings.VISITS_STORAGE == "segments":
+        return get_segment_writer().write
+    # created before the buffer, so it is checkpointed after the buffer's last flush at exit
+    visits_heavy_hitters.get_tracker()
+    return write_visits
+
+
+def get_visit_buffer():
+    global _buffer
+    if _buffer is None:
+        # resolve the flush target first: atexit runs in reverse order,
+        # so the buffer is flushed before the segment writer is closed
+        flush_fn = get_flush_fn()
+        with _buffer_lock:
+            if _buffer is None:
+                _buffer = VisitBuffer(
+                    flush_fn=flush_fn,
+                    max_size=settings.VISITS_BUFFER_SIZE,
+                    flush_interval=settings.VISITS_FLUSH_INTERVAL,
+                    max_pending=settings.VISITS_BUFFER_MAX_PENDING,
+                )
+    return _buffer
+
+
+def write_visits(visits, raw=True):
+    """
+    Persist a batch of visits with a single INSERT and fold it into the
+    per-path counters and visitor sketches in the same transaction, then
+    into this process's heavy-hitters tracker. With raw=False the visits
+    skip PageVisits and go straight into the minute rollups. Bot visits
+    are only tallied in the bot counters.
+    """
+    bots = [v for v in visits if v.is_bot]
+    if bots:
+        visits = [v for v in visits if not v.is_bot]
+    with transaction.atomic():
+        if bots:
+            visits_counters.increment_bot_counters(bots)
+        if not visits:
+            return
+        if raw:
+            PageVisits.objects.bulk_create(
+                [PageVisits(path=v.path, timestamp=v.timestamp) for v in visits]
+            )
+        else:
+            Granularity = visits_rollups.Granularity
+            visits_rollups.add_minute_counts(
+                Counter((visits_rollups.truncate(v.timestamp, Granularity.MINUTE), v.path) for v in visits)
+            )
+        visits_counters.increment_counters(visits)
+        visits_sketches.update_sketches(visits)
+    # in memory only; checkpointed by the tracker's own thread
+    visits_heavy_hitters.track(visits)
+
+
+def record_visit(request=None, path=None):
+    """
+    Record a page visit without touching the database.
+
+    With VISITS_WRITE_BEHIND disabled the visit is written inline,
+    which is what tests and one-off scripts usually want.
+    """
+    if path is None:
+        path = request.path
+    visitor = None
+    is_bot = False
+    if request is not None:
+        is_bot = visits_filters.is_bot(request, path)
+        if is_bot and settings.VISITS_BOT_ACTION == "drop":
+            return False
+        visitor = visits_sketches.get_visitor_hash(request)
+    visit = Visit(path=path, timestamp=timezone.now(), visitor=visitor, is_bot=is_bot)
+    if not settings.VISITS_WRITE_BEHIND:
+        get_flush_fn()([visit])
+        return True
+    return get_visit_buffer().add(visit)
+
+
+def flush_visits():
+    if _buffer is None:
+        return 0
+    return _buffer.flush()
+
+
+def track_page_visit(request):
+    """
+    Record the visit while rendering (VISITS_TRACKING="inline"), or return
+    True so the page template sends a beacon to visit_beacon_view instead.
+    """
+    if settings.VISITS_TRACKING == "beacon":
+        return True
+    record_visit(request)
+    return False
+
+
+def purge_path(path):
+    """
+    Remove every recorded visit of a path, e.g. after a benchmark.
+    """
+    with transaction.atomic():
+        deleted, _ = PageVisits.objects.filter(path=path).delete()
+        VisitRollup.objects.filter(path=path).delete()
+        VisitorSketch.objects.filter(path=path).delete()
+        # the counter also covers visits already pruned from PageVisits
+        for key, total_key in [
+            (path, visits_counters.TOTAL_KEY),
+            (f"{visits_counters.BOT_PREFIX}{path}", visits_counters.BOT_TOTAL_KEY),
+        ]:
+            counter = VisitCounter.objects.select_for_update().filter(path=key).first()
+            if counter is None:
+                continue
+            VisitCounter.objects.filter(path=total_key).update(count=F("count") - counter.count)
+            counter.delete()
+    return deleted
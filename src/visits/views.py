@@ -1,3 +1,127 @@
-from django.shortcuts import render
+import json
+import time
+from urllib.parse import urlsplit
 
-# Create your views here.
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.admin.views.decorators import staff_member_required
+from django.core.cache import cache
+from django.core.handlers.asgi import ASGIRequest
+from django.http import HttpResponse, HttpResponseBadRequest, HttpResponseForbidden, StreamingHttpResponse
+from django.urls import Resolver404, resolve
+from django.utils import timezone
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_POST
+
+from visits import columnar as visits_columnar
+from visits import sketches as visits_sketches
+from visits import utils as visits_utils
+
+LOGIN_URL = settings.LOGIN_URL
+
+
+@staff_member_required(login_url=LOGIN_URL)
+def visits_export_view(request, *args, **kwargs):
+    # raw visits only: ?since= must fall inside the raw retention window
+    since = None
+    if request.GET.get("since"):
+        try:
+            since = visits_columnar.parse_since(request.GET["since"])
+        except ValueError as e:
+            return HttpResponseBadRequest(str(e))
+    filename = f"visits-{timezone.now():%Y%m%d-%H%M%S}.pvc"
+    if isinstance(request, ASGIRequest):
+        chunks = visits_columnar.aiter_export(since=since)
+    else:
+        chunks = visits_columnar.iter_export(since=since)
+    response = StreamingHttpResponse(chunks, content_type="application/octet-stream")
+    response["Content-Disposition"] = f'attachment; filename="{filename}"'
+    return response
+
+
+def _same_origin(request):
+    """
+    Browsers send Origin (or at least Referer) with a beacon; a request
+    with neither did not come from one of our pages.
+    """
+    origin = request.META.get("HTTP_ORIGIN") or request.META.get("HTTP_REFERER")
+    if not origin:
+        return False
+    parts = urlsplit(origin)
+    if f"{parts.scheme}://{parts.netloc}" in settings.CSRF_TRUSTED_ORIGINS:
+        return True
+    return parts.netloc == request.get_host()
+
+
+def _is_page(path):
+    """
+    Only fixed routes count: a route with converters or a regex
+    (profiles, pricing intervals, the admin catch-all) would let a
+    script mint a new counter row per made-up path.
+    """
+    try:
+        match = resolve(path)
+    except Resolver404:
+        return False
+    return f"/{match.route}" == path
+
+
+async def _within_rate_limit(request, events):
+    # X-Forwarded-For is only trusted as far as VISITS_TRUSTED_PROXY_HOPS
+    key = f"visits:beacon:{visits_sketches.get_client_ip(request)}:{int(time.time() // 60)}"
+    if await cache.aadd(key, events, timeout=60):
+        return events <= settings.VISITS_BEACON_RATE_LIMIT
+    try:
+        return await cache.aincr(key, events) <= settings.VISITS_BEACON_RATE_LIMIT
+    except ValueError:
+        # expired between add and incr
+        return True
+
+
+def _parse_beacon(body):
+    """
+    Paths from a `{"events": [{"path": "/about/"}, ...]}` payload, or None
+    if it is malformed. Timestamps are taken on arrival, never from the client.
+    """
+    if len(body) > settings.VISITS_BEACON_MAX_BYTES:
+        return None
+    try:
+        data = json.loads(body)
+    except ValueError:
+        return None
+    events = data.get("events") if isinstance(data, dict) else None
+    if not isinstance(events, list) or not 0 < len(events) <= settings.VISITS_BEACON_MAX_EVENTS:
+        return None
+    paths = []
+    for event in events:
+        path = event.get("path") if isinstance(event, dict) else None
+        # only pages this site serves, so scripts cannot mint counter rows
+        if not isinstance(path, str) or not path.startswith("/") or len(path) > 2048 or not _is_page(path):
+            return None
+        paths.append(path)
+    return paths
+
+
+def _record_visits(request, paths):
+    for path in paths:
+        visits_utils.record_visit(request, path=path)
+
+
+@csrf_exempt
+@require_POST
+async def visit_beacon_view(request, *args, **kwargs):
+    if not _same_origin(request):
+        return HttpResponseForbidden()
+    paths = _parse_beacon(request.body)
+    if paths is None:
+        return HttpResponseBadRequest()
+    if not await _within_rate_limit(request, len(paths)):
+        return HttpResponse(status=429)
+    if hasattr(request, "auser"):
+        request.user = await request.auser()
+    if settings.VISITS_WRITE_BEHIND:
+        # only appends to the in-process buffer
+        _record_visits(request, paths)
+    else:
+        await sync_to_async(_record_visits)(request, paths)
+    return HttpResponse(status=204)